@@ -0,0 +1,678 @@
+"""
+Offline benchmarks of the scraping, parsing and data preparation hot paths.
+
+Nothing touches the network or a browser: scrapers read saved HTML pages through a
+fake WebDriver or HTTP session, and the data preparation and thumbnail benchmarks run
+on synthetic CSVs and images generated at `--scale` rows. Each benchmark reports its
+throughput, the latency percentiles of its steps and its peak traced memory, and a run
+is saved as JSON that a later run can be compared against with `--compare`.
+
+Saved pages go in `--fixture_dir` as `*.html` files, e.g. YouTube watch pages saved
+from a browser. A synthetic watch page is written there if it has none.
+
+The browser benchmarks are the exception, they need Chrome. They compare the browser
+profiles of `scraping.BROWSER_PROFILES` by loading synthetic watch pages, with images, a
+font, a video and an ad script, from a local fixture server, and report the bytes the
+server sent per page next to the time to the first extraction.
+"""
+
+import argparse
+from datetime import datetime
+import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_SCALE = 10000
+LABEL_BATCH_SIZE = 1000
+VECTOR_BATCH_SIZE = 10000
+# Pages, images and forward passes are far slower than label parsing, so they use fewer items
+PAGES_PER_ROW = 0.01
+IMAGES_PER_ROW = 0.01
+EXTRACTOR_IMAGES_PER_ROW = 0.001
+BROWSER_PAGES_PER_ROW = 0.002
+# Sizes of the subresources the fixture server sends, by path
+FIXTURE_ASSET_BYTES = {'.jpg': 30_000, '.woff2': 60_000, 'videoplayback': 2_000_000, '.js': 50_000}
+PERCENTILES = (50, 90, 99)
+RESULT_KEYS = ('items', 'steps', 'seconds', 'items_per_sec', 'latency_ms', 'peak_memory_mb')
+FIXTURE_URL = 'https://www.youtube.com/watch?v={}'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks scraping, parsing and data preparation offline.')
+    parser.add_argument('-s', '--scale', type=int, default=DEFAULT_SCALE,
+                        help='Rows of synthetic data, pages and images are scaled down from it')
+    parser.add_argument('-b', '--benchmarks', type=str, nargs='+', default=None,
+                        help='Benchmarks to run, defaults to all of them')
+    parser.add_argument('-o', '--output_dir', type=str, default='data/benchmarks',
+                        help='Directory to save the results JSON to')
+    parser.add_argument('--fixture_dir', type=str, default='data/benchmark_fixtures',
+                        help='Directory of saved HTML pages for the scraper benchmarks')
+    parser.add_argument('-c', '--compare', type=str, default=None,
+                        help='Results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Fraction of throughput a benchmark may lose before it counts as a regression')
+    parser.add_argument('--skip_memory', action='store_true',
+                        help='Skip the second pass of every benchmark that traces peak memory')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic data')
+
+    return parser.parse_args()
+
+
+# Synthetic data
+
+def synthetic_count_labels(rng, n, suffix='views'):
+    numbers = rng.integers(0, 10 ** 9, n)
+    labels = np.empty(n, dtype=object)
+    style = rng.integers(0, 4, n)
+    for i, (number, s) in enumerate(zip(numbers, style)):
+        if s == 0:
+            labels[i] = f'{number:,} {suffix}'
+        elif s == 1:
+            labels[i] = f'{number / 1e6:.1f}M {suffix}'
+        elif s == 2:
+            labels[i] = f'{number % 1000 / 10:.1f}K {suffix}'
+        else:
+            labels[i] = f'No {suffix}' if number % 50 == 0 else f'{number % 1000} {suffix}'
+    return labels
+
+def synthetic_date_labels(rng, n):
+    units = np.array(['second', 'minute', 'hour', 'day', 'week', 'month', 'year'])
+    dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3000, n), unit='D')
+    amounts = rng.integers(1, 12, n)
+    unit_idxs = rng.integers(0, len(units), n)
+    style = rng.integers(0, 10, n)
+    labels = np.empty(n, dtype=object)
+    for i in range(n):
+        if style[i] < 5:
+            labels[i] = dates[i].strftime('%b %d, %Y')
+        elif style[i] < 9:
+            unit = units[unit_idxs[i]] + ('s' if amounts[i] > 1 else '')
+            labels[i] = f'{amounts[i]} {unit} ago'
+        else:
+            labels[i] = 'Streamed ' + dates[i].strftime('%b %d, %Y')
+    return labels
+
+def synthetic_scrape_dates(rng, n):
+    dates = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 365, n), unit='D')
+    return np.array(dates.strftime('%b %d, %Y'), dtype=object)
+
+def synthetic_video_data(rng, n_rows, n_channels):
+    channel_idxs = rng.integers(0, n_channels, n_rows)
+    video_idxs = rng.integers(0, max(n_rows * 9 // 10, 1), n_rows)
+    return pd.DataFrame({
+        'thumbnail_link': [f'https://i.ytimg.com/vi/{i}/hqdefault.jpg' for i in video_idxs],
+        'view_count': rng.integers(0, 10 ** 8, n_rows),
+        'scrape_date': synthetic_scrape_dates(rng, n_rows),
+        'date': synthetic_date_labels(rng, n_rows),
+        'video_title': [f'Video {i}, part {i % 7}' for i in video_idxs],
+        'video_description': 'A description that is about as long as the truncated ones on the page',
+        'channel_name': [f'Channel {i}' for i in channel_idxs],
+        'subscriber_count': rng.integers(0, 10 ** 7, n_rows),
+        'likes': rng.integers(0, 10 ** 6, n_rows),
+        'video_url': [FIXTURE_URL.format(i) for i in video_idxs],
+        'channel_link': [f'https://www.youtube.com/@channel{i}' for i in channel_idxs],
+    })
+
+def synthetic_channel_videos(rng, n_channels, videos_per_channel=30):
+    n_rows = n_channels * videos_per_channel
+    channel_idxs = np.repeat(np.arange(n_channels), videos_per_channel)
+    return pd.DataFrame({
+        'channel_name': [f'Channel {i}' for i in channel_idxs],
+        'channel_link': [f'https://www.youtube.com/@channel{i}' for i in channel_idxs],
+        'scrape_date': np.repeat(synthetic_scrape_dates(rng, n_channels), videos_per_channel),
+        'position': np.tile(np.arange(videos_per_channel), n_channels),
+        'title': [f'Upload {i}' for i in range(n_rows)],
+        'upload_date': synthetic_date_labels(rng, n_rows),
+        'view_count': rng.integers(0, 10 ** 7, n_rows),
+    })
+
+def write_synthetic_thumbnails(rng, output_dir, n_images, size=(480, 360)):
+    """Writes JPEGs that compress like real thumbnails: smooth shapes rather than noise."""
+    from PIL import Image
+    os.makedirs(output_dir, exist_ok=True)
+    for i in range(n_images):
+        small = rng.integers(0, 255, (size[1] // 24, size[0] // 24, 3), dtype=np.uint8)
+        img = Image.fromarray(small).resize(size, Image.BICUBIC)
+        img.save(os.path.join(output_dir, f'{i}.jpg'), quality=85)
+
+def synthetic_watch_page(video_id, local_assets=False):
+    """
+    Returns the HTML of a watch page with both the DOM elements and the embedded JSON the
+    scrapers read. With `local_assets` it also loads a font, a video and an ad script, and
+    every image, from relative URLs.
+    """
+    channel_url = f'https://www.youtube.com/@channel{video_id % 97}'
+    title = f'Synthetic video {video_id}'
+    description = 'Fixture description. ' * 20
+    initial_data = {'contents': {'twoColumnWatchNextResults': {'results': {'results': {'contents': [
+        {'videoPrimaryInfoRenderer': {
+            'title': {'runs': [{'text': title}]},
+            'viewCount': {'videoViewCountRenderer': {'viewCount': {'simpleText': '1,234,567 views'}}},
+            'dateText': {'simpleText': 'Mar 2, 2021'},
+            'videoActions': {'buttons': [{'accessibility': {'label': '12,345 likes'}}]}}},
+        {'videoSecondaryInfoRenderer': {
+            'owner': {'videoOwnerRenderer': {
+                'title': {'runs': [{'text': f'Channel {video_id % 97}',
+                                    'navigationEndpoint': {}}]},
+                'navigationEndpoint': {'browseEndpoint': {'canonicalBaseUrl': f'/@channel{video_id % 97}'}},
+                'subscriberCountText': {'simpleText': '1.2M subscribers'}}},
+            'attributedDescription': {'content': description}}}
+    ]}}}}}
+    image_host = '' if local_assets else 'https://i.ytimg.com'
+    related = ''.join(
+        f'<a id="thumbnail" href="/watch?v={video_id + i}"><img src="{image_host}/vi/{video_id + i}/hq.jpg"></a>'
+        for i in range(1, 21))
+    assets = ''
+    if local_assets:
+        assets = f'''<style>@font-face {{font-family: Roboto; src: url(/fonts/roboto.woff2)}}
+body {{font-family: Roboto}}</style>
+<video src="/videoplayback?id={video_id}" autoplay muted preload="auto"></video>
+<script src="/pagead/ad.js"></script>'''
+    return f'''<html><head><title>{title} - YouTube</title></head><body>
+{assets}
+<h1 class="title style-scope"><yt-formatted-string>{title}</yt-formatted-string></h1>
+<span class="view-count">1,234,567 views</span>
+<div id="info-strings"><yt-formatted-string>Mar 2, 2021</yt-formatted-string></div>
+<div id="description"><yt-formatted-string>{description}</yt-formatted-string></div>
+<ytd-channel-name id="channel-name"><div><div><yt-formatted-string>
+<a href="{channel_url}">Channel {video_id % 97}</a></yt-formatted-string></div></div></ytd-channel-name>
+<yt-formatted-string id="owner-sub-count">1.2M subscribers</yt-formatted-string>
+<yt-formatted-string id="text" aria-label="12,345 likes">12K</yt-formatted-string>
+<div id="related" class="ytd-watch-flexy">{related}</div>
+<script>var ytInitialData = {json.dumps(initial_data)};</script>
+<script>var ytInitialPlayerResponse = {json.dumps({'videoDetails': {'title': title}})};</script>
+</body></html>'''
+
+def load_fixtures(fixture_dir):
+    """Returns (url, html) of every saved page, writing a synthetic one first if there are none."""
+    paths = sorted(glob.glob(os.path.join(fixture_dir, '*.html')))
+    if not paths:
+        os.makedirs(fixture_dir, exist_ok=True)
+        path = os.path.join(fixture_dir, 'synthetic_watch.html')
+        with open(path, 'w') as f:
+            f.write(synthetic_watch_page(0))
+        paths = [path]
+    pages = []
+    for i, path in enumerate(paths):
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append((FIXTURE_URL.format(i), f.read()))
+    return pages
+
+
+# Stand-ins for the browser and the network
+
+class FixtureServer():
+    """
+    Serves synthetic watch pages at /watch?v=<id> and filler bytes for their subresources
+    on a local port, on a background thread, and counts the bytes and requests it served.
+    """
+    def __init__(self):
+        fixture_server = self
+        self.n_bytes = 0
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+        class FixtureHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/watch'):
+                    video_id = int(self.path.split('v=')[-1])
+                    body = synthetic_watch_page(video_id, local_assets=True).encode('utf-8')
+                    content_type = 'text/html; charset=utf-8'
+                else:
+                    size = next((n for marker, n in FIXTURE_ASSET_BYTES.items() if marker in self.path), 0)
+                    body = (b'//' if self.path.endswith('.js') else b'') + b' ' * size
+                    content_type = 'application/javascript' if self.path.endswith('.js') else 'application/octet-stream'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with fixture_server._lock:
+                    fixture_server.n_bytes += len(body)
+                    fixture_server.n_requests += 1
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def url(self, video_id):
+        return f'http://127.0.0.1:{self.port}/watch?v={video_id}'
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeWebDriver():
+    """Serves saved pages to `YouTubeScraper` in place of a browser, answering XPath lookups with lxml."""
+    def __init__(self, pages):
+        self._pages = pages
+        self._page_idx = -1
+        self.get(None)
+
+    def get(self, url):
+        from lxml import html as lxml_html
+        self._page_idx = (self._page_idx + 1) % len(self._pages)
+        self.current_url, self._source = self._pages[self._page_idx]
+        self._tree = lxml_html.fromstring(self._source)
+        self.title = self._tree.findtext('.//title') or ''
+
+    def find_elements(self, by, value):
+        from scraping import SnapshotElement
+        return [SnapshotElement(e, self.current_url) for e in self._tree.xpath(value)]
+
+    def find_element(self, by, value):
+        from selenium.common.exceptions import NoSuchElementException
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(value)
+        return elements[0]
+
+    def execute_script(self, script, *args):
+        from scraping import SNAPSHOT_SCRIPT
+        if script == SNAPSHOT_SCRIPT:
+            return [self._source, self.current_url]
+        # Readiness checks, the saved page is always fully loaded
+        return True
+
+    def quit(self):
+        pass
+
+class FakeDriverPool():
+    """Hands the same `FakeWebDriver` to every scraper, like a `driver_pool.DriverPool`."""
+    def __init__(self, driver):
+        self.driver = driver
+
+    def acquire(self):
+        return self.driver
+
+    def release(self, driver, pages=0):
+        pass
+
+    def needs_recycle(self, driver, pages):
+        return False
+
+class FakeResponse():
+    def __init__(self, url, text, status_code=200):
+        self.url = url
+        self.text = text
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.text)
+
+class FakeSession():
+    """
+    Serves saved pages to `HTMLYouTubeScraper` in place of a `requests.Session`, cycling
+    through `pages` whatever the URL. GETs are answered with the error codes queued in
+    `statuses` first, and POSTs (browse continuations) with the JSON in `browse_pages`.
+    """
+    def __init__(self, pages, statuses=(), browse_pages=()):
+        self._pages = pages
+        self._page_idx = -1
+        self.statuses = list(statuses)
+        self.browse_pages = list(browse_pages)
+        self.n_requests = 0
+
+    def get(self, url, timeout=None):
+        self.n_requests += 1
+        if self.statuses:
+            return FakeResponse(url, '', self.statuses.pop(0))
+        self._page_idx = (self._page_idx + 1) % len(self._pages)
+        page_url, html = self._pages[self._page_idx]
+        return FakeResponse(page_url, html)
+
+    def post(self, url, params=None, json=None, timeout=None):
+        self.n_requests += 1
+        return FakeResponse(url, self.browse_pages.pop(0))
+
+    def close(self):
+        pass
+
+
+# Benchmarks
+#
+# Each benchmark is a generator that sets up its data, yields once when the timed part
+# starts, and then yields the number of items it processed after every step.
+
+def bench_yt_label_to_num(args, rng):
+    from scraping import yt_label_to_num
+    labels = synthetic_count_labels(rng, args.scale)
+    yield
+    for start in range(0, len(labels), LABEL_BATCH_SIZE):
+        batch = labels[start:start + LABEL_BATCH_SIZE]
+        [yt_label_to_num(label) for label in batch]
+        yield len(batch)
+
+def bench_labels_to_nums(args, rng):
+    from label_parsing import labels_to_nums
+    labels = synthetic_count_labels(rng, args.scale)
+    yield
+    for start in range(0, len(labels), VECTOR_BATCH_SIZE):
+        batch = labels[start:start + VECTOR_BATCH_SIZE]
+        labels_to_nums(batch)
+        yield len(batch)
+
+def bench_yt_label_to_datetime(args, rng):
+    from prepare_data import yt_label_to_datetime
+    labels = synthetic_date_labels(rng, args.scale)
+    reference_date = datetime(2023, 6, 1)
+    yield
+    for start in range(0, len(labels), LABEL_BATCH_SIZE):
+        batch = labels[start:start + LABEL_BATCH_SIZE]
+        for label in batch:
+            try:
+                yt_label_to_datetime(label, reference_date)
+            except ValueError:
+                pass
+        yield len(batch)
+
+def bench_labels_to_datetimes(args, rng):
+    from label_parsing import labels_to_datetimes
+    labels = synthetic_date_labels(rng, args.scale)
+    reference_dates = np.full(len(labels), np.datetime64('2023-06-01'))
+    yield
+    for start in range(0, len(labels), VECTOR_BATCH_SIZE):
+        batch = labels[start:start + VECTOR_BATCH_SIZE]
+        labels_to_datetimes(batch, reference_dates[start:start + VECTOR_BATCH_SIZE])
+        yield len(batch)
+
+def _bench_selenium_scraper(args, snapshot):
+    from scraping import YouTubeScraper
+    driver = FakeWebDriver(load_fixtures(args.fixture_dir))
+    scraper = YouTubeScraper(snapshot=snapshot, driver_pool=FakeDriverPool(driver))
+    n_pages = max(int(args.scale * PAGES_PER_ROW), 10)
+    yield
+    for _ in range(n_pages):
+        scraper._navigate(FIXTURE_URL.format(0))
+        if scraper.scrape_vid_data() is None:
+            raise RuntimeError('The fixture page could not be scraped')
+        yield 1
+
+def bench_scrape_vid_data(args, rng):
+    yield from _bench_selenium_scraper(args, snapshot=False)
+
+def bench_scrape_vid_data_snapshot(args, rng):
+    yield from _bench_selenium_scraper(args, snapshot=True)
+
+def bench_scrape_vid_data_html(args, rng):
+    from scraping import HTMLYouTubeScraper
+    scraper = HTMLYouTubeScraper(session=FakeSession(load_fixtures(args.fixture_dir)))
+    n_pages = max(int(args.scale * PAGES_PER_ROW), 10)
+    yield
+    for _ in range(n_pages):
+        scraper._load_page(FIXTURE_URL.format(0))
+        scraper.scrape_vid_data()
+        yield 1
+
+def _bench_browser_profile(args, profile):
+    """
+    Loads and scrapes fixture pages with a real headless Chrome using a browser profile.
+    Every other host is resolved to nowhere, so the browser never leaves the machine.
+    """
+    from scraping import YouTubeScraper, create_chrome_driver
+    server = FixtureServer()
+    driver = create_chrome_driver(
+        profile=profile, arguments=('--host-resolver-rules=MAP * ~NOTFOUND, EXCLUDE 127.0.0.1',))
+    scraper = YouTubeScraper(driver_pool=FakeDriverPool(driver))
+    n_pages = max(int(args.scale * BROWSER_PAGES_PER_ROW), 5)
+    try:
+        yield
+        for i in range(n_pages):
+            scraper._navigate(server.url(i))
+            if scraper.scrape_vid_data() is None:
+                raise RuntimeError('The fixture page could not be scraped')
+            yield 1
+        # Let subresources that load after the extraction finish before counting bytes
+        time.sleep(1.0)
+    finally:
+        driver.quit()
+        server.close()
+    return {'bytes_per_page': server.n_bytes / n_pages, 'requests_per_page': server.n_requests / n_pages}
+
+def bench_browser_default(args, rng):
+    return (yield from _bench_browser_profile(args, 'default'))
+
+def bench_browser_lean(args, rng):
+    return (yield from _bench_browser_profile(args, 'lean'))
+
+def bench_prepare_data(args, rng):
+    """Join, dedupe and date parsing of `prepare_data.py`, from CSV to output file."""
+    from channel_data import read_channel_videos, write_channel_videos
+    from data_store import iter_table
+    import prepare_data
+
+    n_channels = max(args.scale // 50, 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'videos.csv')
+        channel_path = os.path.join(tmp_dir, 'channel_videos.csv')
+        synthetic_video_data(rng, args.scale, n_channels).to_csv(video_path)
+        write_channel_videos(synthetic_channel_videos(rng, n_channels), channel_path)
+
+        channel_videos = read_channel_videos(channel_path)
+        channel_videos = prepare_data.format_dates(channel_videos, 'scrape_date')
+        channel_table = prepare_data.build_channel_table(channel_videos)
+        writer = prepare_data.ChunkWriter(os.path.join(tmp_dir, 'full_data.csv'))
+        seen_hashes = np.zeros(0, dtype=np.uint64)
+        offset = 0
+        yield
+        for chunk in iter_table(video_path, VECTOR_BATCH_SIZE, prepare_data.VIDEO_DTYPES):
+            n_rows = len(chunk)
+            chunk, _, seen_hashes = prepare_data.prepare_video_chunk(chunk, offset, channel_table, seen_hashes)
+            writer.write(chunk)
+            offset += n_rows
+            yield n_rows
+        writer.close()
+
+def bench_format_dates(args, rng):
+    import prepare_data
+    df = pd.DataFrame({'scrape_date': synthetic_scrape_dates(rng, args.scale),
+                       'date': synthetic_date_labels(rng, args.scale)})
+    yield
+    for start in range(0, len(df), VECTOR_BATCH_SIZE):
+        chunk = prepare_data.format_dates(df.iloc[start:start + VECTOR_BATCH_SIZE], 'scrape_date')
+        prepare_data.format_dates(chunk, 'date', 'scrape_date')
+        yield min(VECTOR_BATCH_SIZE, len(df) - start)
+
+def bench_image_dataset(args, rng):
+    from data_handling import ImageDataset, img_transform
+    n_images = max(int(args.scale * IMAGES_PER_ROW), 20)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_synthetic_thumbnails(rng, tmp_dir, n_images)
+        dataset = ImageDataset(root_dir=tmp_dir, transform=img_transform)
+        yield
+        for i in range(len(dataset)):
+            dataset[i]
+            yield 1
+
+def bench_decode_thumbnail(args, rng):
+    from thumbnail_packing import decode_thumbnail
+    n_images = max(int(args.scale * IMAGES_PER_ROW), 20)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_synthetic_thumbnails(rng, tmp_dir, n_images)
+        paths = [os.path.join(tmp_dir, name) for name in os.listdir(tmp_dir)]
+        yield
+        for path in paths:
+            decode_thumbnail(path)
+            yield 1
+
+def bench_feature_extractor(args, rng, batch_size=32):
+    import torch
+    from models import ImageFeatureExtractor
+    model = ImageFeatureExtractor().eval()
+    n_batches = max(int(args.scale * EXTRACTOR_IMAGES_PER_ROW) // batch_size, 2)
+    imgs = torch.from_numpy(rng.standard_normal((batch_size, 3, 224, 224), dtype=np.float32))
+    with torch.inference_mode():
+        model(imgs)
+        yield
+        for _ in range(n_batches):
+            model(imgs)
+            yield batch_size
+
+BENCHMARKS = {
+    'yt_label_to_num': bench_yt_label_to_num,
+    'labels_to_nums': bench_labels_to_nums,
+    'yt_label_to_datetime': bench_yt_label_to_datetime,
+    'labels_to_datetimes': bench_labels_to_datetimes,
+    'scrape_vid_data': bench_scrape_vid_data,
+    'scrape_vid_data_snapshot': bench_scrape_vid_data_snapshot,
+    'scrape_vid_data_html': bench_scrape_vid_data_html,
+    'browser_default': bench_browser_default,
+    'browser_lean': bench_browser_lean,
+    'prepare_data': bench_prepare_data,
+    'format_dates': bench_format_dates,
+    'image_dataset': bench_image_dataset,
+    'decode_thumbnail': bench_decode_thumbnail,
+    'feature_extractor': bench_feature_extractor,
+}
+
+
+# Running and comparing
+
+def _time_steps(steps):
+    """
+    Returns (items, seconds, step latencies, extra results). A benchmark can return a dict
+    of extra results, the work it does after its last step is not timed.
+    """
+    next(steps)
+    n_items, latencies = 0, []
+    start_time = time.perf_counter()
+    step_start = start_time
+    while True:
+        try:
+            n = next(steps)
+        except StopIteration as stop:
+            extras = stop.value or {}
+            break
+        now = time.perf_counter()
+        latencies.append(now - step_start)
+        n_items += n
+        step_start = now
+    return n_items, step_start - start_time, np.array(latencies), extras
+
+def _peak_memory(steps):
+    """Peak memory traced while the steps run, not counting the setup."""
+    next(steps)
+    tracemalloc.start()
+    try:
+        for _ in steps:
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmark(name, args):
+    """
+    Returns the result of one benchmark. A benchmark whose optional dependencies are not
+    installed is `skipped`, any other exception is reported as its `error`.
+    """
+    bench = BENCHMARKS[name]
+    try:
+        n_items, seconds, latencies, extras = _time_steps(bench(args, np.random.default_rng(args.seed)))
+        result = {
+            'items': n_items,
+            'steps': len(latencies),
+            'seconds': seconds,
+            'items_per_sec': n_items / seconds if seconds > 0 else None,
+            'latency_ms': {f'p{p}': float(np.percentile(latencies, p) * 1000) for p in PERCENTILES}
+                if len(latencies) else {},
+        }
+        result.update(extras)
+        if not args.skip_memory:
+            result['peak_memory_mb'] = _peak_memory(bench(args, np.random.default_rng(args.seed))) / 2 ** 20
+        return result
+    except ImportError as e:
+        return {'skipped': f'{type(e).__name__}: {e}'}
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare_results(old, new, tolerance=0.1):
+    """
+    Returns (lines describing each benchmark's change, names of benchmarks that regressed).
+    A benchmark that had a result before and now fails with an error counts as regressed.
+    """
+    lines, regressions = [], []
+    for name, result in new['results'].items():
+        old_result = old['results'].get(name, {})
+        old_rate, new_rate = old_result.get('items_per_sec'), result.get('items_per_sec')
+        if old_rate and 'error' in result:
+            regressions.append(name)
+            lines.append(f'{name}: {old_rate:,.1f} items/s -> failed, {result["error"]} REGRESSION')
+            continue
+        if not old_rate or not new_rate:
+            continue
+        change = new_rate / old_rate - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+        lines.append(f'{name}: {old_rate:,.1f} -> {new_rate:,.1f} items/s ({change:+.1%})'
+                     + (' REGRESSION' if regressed else ''))
+    return lines, regressions
+
+if __name__ == '__main__':
+    args = parse_args()
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f'Unknown benchmarks {unknown}, expected some of {list(BENCHMARKS)}.')
+
+    run = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': args.scale,
+        'results': {}
+    }
+    for name in names:
+        result = run_benchmark(name, args)
+        run['results'][name] = result
+        if 'skipped' in result:
+            print(f'{name}: skipped, {result["skipped"]}')
+        elif 'error' in result:
+            print(f'{name}: failed, {result["error"]}')
+        else:
+            latency = ', '.join(f'{k}={v:.3f}ms' for k, v in result['latency_ms'].items())
+            memory = f', peak {result["peak_memory_mb"]:.1f}MB' if 'peak_memory_mb' in result else ''
+            extras = ''.join(f', {key} {value:,.1f}' for key, value in result.items() if key not in RESULT_KEYS)
+            print(f'{name}: {result["items_per_sec"]:,.1f} items/s, step latency {latency}{memory}{extras}')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, 'benchmark-{}.json'.format(
+        datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(output_path, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f'Saved results to {output_path}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            lines, regressions = compare_results(json.load(f), run, args.tolerance)
+        print('\n'.join(lines))
+        if regressions:
+            print(f'{len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}')
+            sys.exit(1)
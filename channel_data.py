@@ -0,0 +1,78 @@
+"""
+Channel video lists as a long table, with one row per video on a channel's /videos page.
+
+Channel scrapes store `title`, `upload_date` and `view_count` as list columns, which
+the dataset formats keep as JSON arrays or Parquet lists. Everything downstream reads
+them through `read_channel_videos`, which flattens them into the columns below so no
+per-row Python objects or strings have to be parsed.
+"""
+
+import ast
+import os
+
+import pandas as pd
+
+from data_store import read_table
+
+
+VIDEO_LIST_COLUMNS = ['title', 'upload_date', 'view_count']
+CHANNEL_VIDEO_COLUMNS = ['channel_name', 'channel_link', 'scrape_date', 'position'] + VIDEO_LIST_COLUMNS
+
+
+def _parse_repr_lists(df):
+    """Parses list columns that an older CSV wrote as tuple reprs, e.g. "('a', 'b, c')"."""
+    df = df.copy()
+    for column in VIDEO_LIST_COLUMNS:
+        df[column] = [ast.literal_eval(value) if isinstance(value, str) else value for value in df[column]]
+    return df
+
+def explode_channel_videos(df):
+    """
+    Flattens channel rows with list columns into one row per video, numbered by its
+    `position` on the page. Rows with lists of different lengths are dropped.
+    """
+    if len(df) == 0:
+        return pd.DataFrame(columns=CHANNEL_VIDEO_COLUMNS)
+    if df[VIDEO_LIST_COLUMNS[0]].map(lambda value: isinstance(value, str)).any():
+        df = _parse_repr_lists(df)
+
+    lengths = pd.DataFrame({column: df[column].str.len().fillna(0).astype(int) for column in VIDEO_LIST_COLUMNS})
+    matching = lengths.eq(lengths.iloc[:, 0], axis=0).all(axis=1) & (lengths.iloc[:, 0] > 0)
+    df = df[matching].reset_index(drop=True)
+
+    long_df = df.drop(columns=VIDEO_LIST_COLUMNS).loc[df.index.repeat(lengths[matching].iloc[:, 0].values)]
+    long_df['position'] = long_df.groupby(level=0).cumcount().values
+    for column in VIDEO_LIST_COLUMNS:
+        long_df[column] = [value for values in df[column] for value in values]
+    return long_df.reset_index(drop=True)
+
+def _as_channel_videos(df):
+    """Returns channel data of any layout as a long table with `CHANNEL_VIDEO_COLUMNS`."""
+    if 'position' not in df.columns:
+        if 'video_id' in df.columns:
+            # Channel history rows already have one row per video
+            df = df.assign(position=df.groupby('channel_link').cumcount())
+        else:
+            df = explode_channel_videos(df)
+    columns = CHANNEL_VIDEO_COLUMNS + (['video_id'] if 'video_id' in df.columns else [])
+    return df[columns].reset_index(drop=True)
+
+def read_channel_videos(path):
+    """
+    Reads channel data from a Parquet or CSV file or a `ShardedDataset` directory, in
+    either layout, as a long table. CSV files written before list columns existed are
+    converted on the fly.
+    """
+    if not os.path.isdir(path) and path.endswith('.parquet'):
+        return _as_channel_videos(pd.read_parquet(path))
+    return _as_channel_videos(read_table(path))
+
+def write_channel_videos(df, path):
+    """Writes a long channel video table to Parquet, or to CSV (readable by `read_table`) if `path` ends with .csv."""
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    if path.endswith('.csv'):
+        df.to_csv(path)
+    else:
+        df.to_parquet(path, index=False)
@@ -0,0 +1,99 @@
+"""
+Features of each video's channel, computed from the long table of channel videos
+written by `prepare_data.py`.
+
+Channel histories are flattened into contiguous arrays grouped by channel, with an
+offset to where each channel starts. Every distinct (channel, scrape date) pair of the
+video rows becomes one segment of those arrays, and the windowed aggregates of all
+segments are computed at once with segment sums, then broadcast back to the rows.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+MONTH_IN_SECONDS = 60 * 60 * 24 * 30
+FEATURE_NAMES = ['month_avg_log_views', 'month_std_log_views', 'month_n_videos']
+# Most channel video entries expanded in memory at once
+CHUNK_ENTRIES = 5_000_000
+
+
+def flatten_channel_histories(channel_videos):
+    """
+    Returns (channels, offsets, upload_dates, log_views), where the videos of channel
+    `channels[i]` are at `offsets[i]:offsets[i + 1]` of the other two arrays. Upload
+    dates are int64 nanoseconds.
+    """
+    codes, channels = pd.factorize(channel_videos['channel_link'])
+    order = np.argsort(codes, kind='stable')
+    offsets = np.zeros(len(channels) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(channels)), out=offsets[1:])
+
+    upload_dates = channel_videos['upload_date'].values.astype('datetime64[ns]').view(np.int64)[order]
+    log_views = np.log1p(channel_videos['view_count'].values.astype(np.float64))[order]
+    return channels, offsets, upload_dates, log_views
+
+def _segment_sum(values, starts, lengths):
+    """Sums `values` over the segments at `starts`, empty segments sum to 0."""
+    sums = np.zeros(len(starts), dtype=np.float64)
+    non_empty = lengths > 0
+    if non_empty.any():
+        sums[non_empty] = np.add.reduceat(values, starts[non_empty])
+    return sums
+
+def _window_sums(offsets, upload_dates, log_views, query_codes, query_dates, window_seconds):
+    """Returns the count, sum and sum of squares of log views in the window before each query."""
+    lengths = offsets[query_codes + 1] - offsets[query_codes]
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    # Index of every channel video of every query, one segment per query
+    query_idxs = np.repeat(np.arange(len(lengths)), lengths)
+    video_idxs = np.arange(lengths.sum()) - starts[query_idxs] + offsets[query_codes][query_idxs]
+
+    time_up = (query_dates[query_idxs] - upload_dates[video_idxs]) / 1e9
+    keep = (time_up >= 0) & (time_up <= window_seconds)
+    kept_log_views = np.where(keep, log_views[video_idxs], 0.0)
+
+    return (_segment_sum(keep.astype(np.float64), starts, lengths),
+            _segment_sum(kept_log_views, starts, lengths),
+            _segment_sum(kept_log_views ** 2, starts, lengths))
+
+def channel_history_features(full_df, channel_videos, window_seconds=MONTH_IN_SECONDS,
+                             chunk_entries=CHUNK_ENTRIES):
+    """
+    Returns a float64 array of shape (len(full_df), len(FEATURE_NAMES)), aligned with the
+    rows of `full_df`. For each row it holds the mean and standard deviation of the log
+    views of its channel's videos uploaded within `window_seconds` before the row's
+    `scrape_date`, and how many there were. The mean and deviation are NaN without any
+    such videos, and rows whose channel has no videos get a count of 0.
+    """
+    channels, offsets, upload_dates, log_views = flatten_channel_histories(channel_videos)
+
+    # Rows of the same channel scraped at the same time share their features
+    row_codes = channels.get_indexer(full_df['channel_link'])
+    row_dates = full_df['scrape_date'].values.astype('datetime64[ns]').view(np.int64)
+    queries, row_queries = np.unique(np.stack([row_codes, row_dates], axis=1), axis=0, return_inverse=True)
+    row_queries = row_queries.reshape(-1)
+
+    counts = np.zeros(len(queries), dtype=np.float64)
+    sums = np.zeros(len(queries), dtype=np.float64)
+    square_sums = np.zeros(len(queries), dtype=np.float64)
+
+    has_channel = np.flatnonzero(queries[:, 0] >= 0)
+    query_codes = queries[has_channel, 0]
+    # Split the queries so that at most about `chunk_entries` videos are expanded at once
+    entries = np.cumsum(offsets[query_codes + 1] - offsets[query_codes])
+    bounds = np.searchsorted(entries, np.arange(chunk_entries, entries[-1] if len(entries) else 0, chunk_entries))
+    for chunk in np.split(np.arange(len(has_channel)), np.unique(bounds)):
+        if len(chunk) == 0:
+            continue
+        idxs = has_channel[chunk]
+        counts[idxs], sums[idxs], square_sums[idxs] = _window_sums(
+            offsets, upload_dates, log_views, queries[idxs, 0], queries[idxs, 1], window_seconds)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(square_sums / counts - means ** 2, 0.0))
+    features = np.stack([means, stds, counts], axis=1)
+    return features[row_queries]
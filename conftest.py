@@ -0,0 +1,82 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import threading
+
+import pytest
+
+
+class StubServer():
+    """
+    Serves `files` (path -> bytes) on a local port for the downloader tests. Range
+    requests get partial content, every response carries an ETag, and the status codes
+    queued in `failures[path]` are answered first, one per request.
+    """
+    def __init__(self):
+        stub = self
+        self.files = {}
+        self.failures = {}
+        self.requests = []
+        self.honor_range = True
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append((self.path, dict(self.headers)))
+                failures = stub.failures.get(self.path)
+                if failures:
+                    self.send_response(failures.pop(0))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path not in stub.files:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                body = stub.files[self.path]
+                etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                byte_range = self.headers.get('Range')
+                if byte_range and stub.honor_range:
+                    start, end = byte_range.split('=')[1].split('-')
+                    start = int(start)
+                    end = min(int(end) if end else len(body) - 1, len(body) - 1)
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+                    body = body[start:end + 1]
+                else:
+                    self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self._server.server_address[1], path)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
@@ -0,0 +1,371 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from data_store import ShardedDataset, open_dataset, read_table
+from pacing import AdaptiveRateLimiter
+from seen_index import canonical_channel_url, canonical_video_id
+
+
+SEARCH = 'search'
+VIDEO = 'video'
+CHANNEL = 'channel'
+TASK_KINDS = (SEARCH, VIDEO, CHANNEL)
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+LEASE_SECONDS = 120.0
+MAX_ATTEMPTS = 3
+IDLE_DELAY_SECONDS = 5.0
+JOIN_TIMEOUT_SECONDS = 60.0
+
+# Keys of scraping.SCRAPER_BACKENDS and scraping.BROWSER_PROFILES, repeated here so that
+# parsing the arguments does not import scraping and with it the browser dependencies
+SCRAPER_BACKEND_NAMES = ('selenium', 'html')
+BROWSER_PROFILE_NAMES = ('default', 'lean')
+
+
+def task_key(kind, payload):
+  """Returns the key that deduplicates tasks, so every video or channel is only queued once."""
+  if kind == VIDEO:
+    return canonical_video_id(payload['url'])
+  if kind == CHANNEL:
+    return canonical_channel_url(payload['url'])
+  return payload['term']
+
+
+class Task():
+  def __init__(self, task_id, kind, payload, attempts):
+    self.id = task_id
+    self.kind = kind
+    self.payload = payload
+    self.attempts = attempts
+
+
+class SQLiteTaskQueue():
+  """
+  Shared crawl task queue backed by a SQLite file, for workers on one machine
+  or on machines sharing a filesystem that supports SQLite locking.
+
+  This class defines the interface a queue backend needs (`put`, `lease`,
+  `heartbeat`, `complete`, `fail`, `counts`), so a networked backend can be
+  swapped in without touching the workers. Leases expire unless the worker
+  holding them sends heartbeats, after which the task is handed to another worker.
+  """
+  def __init__(self, path='data/tasks.sqlite', lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    dir_name = os.path.dirname(path)
+    if dir_name:
+      os.makedirs(dir_name, exist_ok=True)
+    self.path = path
+    self.lease_seconds = lease_seconds
+    self.max_attempts = max_attempts
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60.0, isolation_level=None)
+    with self._lock:
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS tasks ('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, key TEXT NOT NULL, '
+        'payload TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, state TEXT NOT NULL, '
+        'worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, '
+        'UNIQUE (kind, key))')
+      self._conn.execute(
+        'CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (state, priority, id)')
+
+  def put(self, kind, payload, priority=0):
+    """Queues a task unless an equal one was queued before. Lower priorities are leased first."""
+    return self.put_many(kind, [payload], priority) == 1
+
+  def put_many(self, kind, payloads, priority=0):
+    rows = [(kind, task_key(kind, payload), json.dumps(payload), priority, PENDING)
+            for payload in payloads]
+    with self._lock:
+      before = self._conn.total_changes
+      self._conn.execute('BEGIN IMMEDIATE')
+      self._conn.executemany(
+        'INSERT OR IGNORE INTO tasks (kind, key, payload, priority, state) VALUES (?, ?, ?, ?, ?)', rows)
+      self._conn.execute('COMMIT')
+      return self._conn.total_changes - before
+
+  def lease(self, worker_id, kinds=TASK_KINDS):
+    """
+    Leases the next pending task, or a task whose lease has expired. Returns None if there is none.
+    Expired tasks that ran out of attempts are marked failed instead of being leased again.
+    """
+    now = time.time()
+    kind_params = ', '.join('?' * len(kinds))
+    with self._lock:
+      self._conn.execute('BEGIN IMMEDIATE')
+      try:
+        self._conn.execute(
+          'UPDATE tasks SET state = ?, lease_expires = NULL, error = ? '
+          'WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+          (FAILED, 'Lease expired', LEASED, now, self.max_attempts))
+        row = self._conn.execute(
+          f'SELECT id, kind, payload, attempts FROM tasks WHERE kind IN ({kind_params}) AND '
+          '(state = ? OR (state = ? AND lease_expires < ? AND attempts < ?)) ORDER BY priority, id LIMIT 1',
+          (*kinds, PENDING, LEASED, now, self.max_attempts)).fetchone()
+        if row is None:
+          return None
+        task_id, kind, payload, attempts = row
+        self._conn.execute(
+          'UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?',
+          (LEASED, worker_id, now + self.lease_seconds, task_id))
+      finally:
+        self._conn.execute('COMMIT')
+    return Task(task_id, kind, json.loads(payload), attempts + 1)
+
+  def heartbeat(self, worker_id):
+    """Extends the leases of every task held by a worker."""
+    with self._lock:
+      self._conn.execute(
+        'UPDATE tasks SET lease_expires = ? WHERE worker = ? AND state = ?',
+        (time.time() + self.lease_seconds, worker_id, LEASED))
+
+  def complete(self, task, worker_id):
+    with self._lock:
+      self._conn.execute(
+        'UPDATE tasks SET state = ?, lease_expires = NULL WHERE id = ? AND worker = ?',
+        (DONE, task.id, worker_id))
+
+  def fail(self, task, worker_id, error):
+    """Puts a task back in the queue, or marks it failed once it ran out of attempts."""
+    state = FAILED if task.attempts >= self.max_attempts else PENDING
+    with self._lock:
+      self._conn.execute(
+        'UPDATE tasks SET state = ?, lease_expires = NULL, error = ? WHERE id = ? AND worker = ?',
+        (state, str(error), task.id, worker_id))
+
+  def counts(self):
+    with self._lock:
+      rows = self._conn.execute('SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state').fetchall()
+    return {f'{kind}/{state}': count for kind, state, count in rows}
+
+  def close(self):
+    with self._lock:
+      self._conn.close()
+
+
+class CrawlWorker():
+  """
+  Leases tasks from a shared queue and runs them with one scraper per thread.
+
+  Search tasks queue the videos found for the term, video tasks scrape a video
+  and queue its suggested videos (up to `max_depth`) and its channel, and
+  channel tasks scrape a channel's videos page. Rows go to per-writer shards of
+  the video and channel datasets, so any number of workers can share them.
+  """
+  def __init__(self, task_queue, scraper_factory, video_store, channel_store,
+               n_threads=4, max_depth=3, worker_id=None, kinds=TASK_KINDS):
+    self.task_queue = task_queue
+    self.scraper_factory = scraper_factory
+    self.video_store = video_store
+    self.channel_store = channel_store
+    self.n_threads = n_threads
+    self.max_depth = max_depth
+    self.kinds = kinds
+    self.worker_id = worker_id or '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+    self._stop = threading.Event()
+    self._threads = []
+    self.n_completed = 0
+    self.n_failed = 0
+
+  def _heartbeat_loop(self):
+    while not self._stop.wait(self.task_queue.lease_seconds / 3):
+      try:
+        self.task_queue.heartbeat(self.worker_id)
+      except Exception as e:
+        print(f'Heartbeat failed with exception: {e}')
+
+  def _run_search(self, scraper, task):
+    if not scraper.perform_yt_search(task.payload['term']):
+      raise IOError('Search page did not load')
+    links = [{'url': link['video_url'], 'thumbnail_link': link['thumbnail_link'], 'depth': 0}
+             for link in scraper.collect_search_links()]
+    self.task_queue.put_many(VIDEO, links)
+
+  def _run_video(self, scraper, task):
+    payload = task.payload
+    if not scraper._navigate(payload['url']):
+      raise IOError('Video page did not load')
+    video_data = scraper.scrape_vid_data()
+    if video_data is None:
+      raise IOError('Video data did not load')
+    row = {'thumbnail_link': payload.get('thumbnail_link')}
+    row.update(video_data)
+    self.video_store.append([row])
+    self.task_queue.put(CHANNEL, {'name': video_data['channel_name'], 'url': video_data['channel_link']})
+
+    if payload['depth'] < self.max_depth:
+      links = [{'url': link['video_url'], 'thumbnail_link': link['thumbnail_link'],
+                'depth': payload['depth'] + 1}
+               for link in scraper.collect_suggested_links()]
+      self.task_queue.put_many(VIDEO, links, priority=payload['depth'] + 1)
+
+  def _run_channel(self, scraper, task):
+    scraper._scrape_channel_page(task.payload['name'], task.payload['url'])
+    rows = scraper.flush_channel_data()
+    if not rows:
+      raise IOError('Channel data did not load')
+    self.channel_store.append(rows)
+
+  def _thread_loop(self):
+    runners = {SEARCH: self._run_search, VIDEO: self._run_video, CHANNEL: self._run_channel}
+    scraper = self.scraper_factory()
+    try:
+      while not self._stop.is_set():
+        task = self.task_queue.lease(self.worker_id, self.kinds)
+        if task is None:
+          self._stop.wait(IDLE_DELAY_SECONDS)
+          continue
+        try:
+          runners[task.kind](scraper, task)
+        except Exception as e:
+          self.n_failed += 1
+          self.task_queue.fail(task, self.worker_id, e)
+          # The session may be broken, so continue with a fresh scraper
+          scraper.terminate()
+          scraper = self.scraper_factory()
+          continue
+        self.n_completed += 1
+        self.task_queue.complete(task, self.worker_id)
+    finally:
+      scraper.terminate()
+
+  def run(self):
+    """Runs the worker until `stop` is called."""
+    heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+    heartbeat_thread.start()
+    self._threads = [threading.Thread(target=self._thread_loop) for _ in range(self.n_threads)]
+    for thread in self._threads:
+      thread.start()
+    for thread in self._threads:
+      thread.join()
+    self._stop.set()
+
+  def stop(self):
+    self._stop.set()
+
+  def join(self, timeout=JOIN_TIMEOUT_SECONDS):
+    """Waits up to `timeout` seconds in total for the scraper threads to finish their tasks."""
+    deadline = time.monotonic() + timeout
+    for thread in self._threads:
+      thread.join(max(0.0, deadline - time.monotonic()))
+    return not any(thread.is_alive() for thread in self._threads)
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Distributes crawl tasks over scraper processes and machines.')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  seed_parser = subparsers.add_parser('seed', help='Queue search terms and channels')
+  seed_parser.add_argument('-q', '--queue', type=str, default='data/tasks.sqlite',
+                           help='Task queue file')
+  seed_parser.add_argument('-s', '--search_terms_file', type=str, default=None,
+                           help='File containing search terms to queue')
+  seed_parser.add_argument('-v', '--video_data_file', type=str, default=None,
+                           help='Video data whose channels should be queued')
+
+  worker_parser = subparsers.add_parser('worker', help='Run crawl worker processes')
+  worker_parser.add_argument('-q', '--queue', type=str, default='data/tasks.sqlite',
+                             help='Task queue file')
+  worker_parser.add_argument('-vo', '--video_output_dir', type=str, default='data/yt_video_data',
+                             help='Dataset directory to write video data to')
+  worker_parser.add_argument('-co', '--channel_output_dir', type=str, default='data/yt_channel_data',
+                             help='Dataset directory to write channel data to')
+  worker_parser.add_argument('-p', '--n_processes', type=int, default=1,
+                             help='Number of worker processes to start on this machine')
+  worker_parser.add_argument('-n', '--n_threads', type=int, default=4,
+                             help='Number of scraper threads per process')
+  worker_parser.add_argument('-b', '--backend', type=str, default='selenium',
+                             choices=SCRAPER_BACKEND_NAMES, help='Scraper backend')
+  worker_parser.add_argument('--browser_profile', type=str, default='default', choices=BROWSER_PROFILE_NAMES,
+                             help='Chrome profile of the selenium backend, lean blocks images, media, fonts and ads')
+  worker_parser.add_argument('-d', '--max_depth', type=int, default=3,
+                             help='How many suggested videos deep to follow from each search')
+  worker_parser.add_argument('--max_rate', type=float, default=4.0,
+                             help='Most page loads per second for each process, 0 to disable')
+  worker_parser.add_argument('-k', '--kinds', type=str, nargs='+', default=list(TASK_KINDS),
+                             choices=TASK_KINDS, help='Kinds of tasks this worker runs')
+
+  status_parser = subparsers.add_parser('status', help='Print task counts and compact the datasets')
+  status_parser.add_argument('-q', '--queue', type=str, default='data/tasks.sqlite',
+                             help='Task queue file')
+  status_parser.add_argument('-vo', '--video_output_dir', type=str, default=None,
+                             help='Video dataset directory to compact')
+  status_parser.add_argument('-co', '--channel_output_dir', type=str, default=None,
+                             help='Channel dataset directory to compact')
+
+  return parser.parse_args()
+
+def run_worker_process(args):
+  # Imported here so the coordinator itself does not need a browser installed
+  from scraping import SCRAPER_BACKENDS
+
+  task_queue = SQLiteTaskQueue(args.queue)
+  video_store = ShardedDataset(args.video_output_dir, 'video_url', keep='first')
+  channel_store = ShardedDataset(args.channel_output_dir, 'channel_link', keep='last')
+  scraper_factory = SCRAPER_BACKENDS[args.backend]
+  if args.backend == 'selenium':
+    scraper_factory = functools.partial(scraper_factory, browser_profile=args.browser_profile)
+  if args.max_rate > 0:
+    rate_limiter = AdaptiveRateLimiter(rate=args.max_rate / 2, max_rate=args.max_rate)
+    scraper_factory = functools.partial(scraper_factory, rate_limiter=rate_limiter)
+  worker = CrawlWorker(
+    task_queue, scraper_factory, video_store, channel_store,
+    n_threads=args.n_threads, max_depth=args.max_depth, kinds=tuple(args.kinds))
+  try:
+    worker.run()
+  except KeyboardInterrupt:
+    worker.stop()
+    # The threads still write to the stores until their current task is done
+    if not worker.join():
+      print('Scraper threads did not stop in time, closing the datasets anyway')
+  finally:
+    video_store.close()
+    channel_store.close()
+    task_queue.close()
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.command == 'seed':
+    task_queue = SQLiteTaskQueue(args.queue)
+    if args.search_terms_file:
+      with open(args.search_terms_file, 'r') as f:
+        terms = [line.strip() for line in f if line.strip()]
+      print('# search tasks queued:', task_queue.put_many(SEARCH, [{'term': term} for term in terms]))
+    if args.video_data_file:
+      channels = read_table(args.video_data_file)[['channel_name', 'channel_link']].drop_duplicates()
+      payloads = [{'name': name, 'url': url} for name, url in channels.itertuples(index=False)]
+      print('# channel tasks queued:', task_queue.put_many(CHANNEL, payloads))
+
+  elif args.command == 'worker':
+    processes = [multiprocessing.Process(target=run_worker_process, args=(args,))
+                 for _ in range(args.n_processes)]
+    for process in processes:
+      process.start()
+    try:
+      for process in processes:
+        process.join()
+    except KeyboardInterrupt:
+      for process in processes:
+        process.join()
+
+  elif args.command == 'status':
+    task_queue = SQLiteTaskQueue(args.queue)
+    for name, count in sorted(task_queue.counts().items()):
+      print(f'{name}: {count}')
+    for path in (args.video_output_dir, args.channel_output_dir):
+      if path is not None and os.path.isdir(path):
+        open_dataset(path).compact()
@@ -1,9 +1,12 @@
 import os
 from PIL import Image
 
+import numpy as np
 from torch.utils.data import Dataset
 import torchvision.transforms as transforms
 
+import thumbnail_packing
+
 img_transform = transforms.Compose([
         transforms.Resize((224, 224)),
         transforms.ToTensor(),
@@ -12,11 +15,20 @@ img_transform = transforms.Compose([
             std=[0.229, 0.224, 0.225])
     ])
 
+# Same as `img_transform` for images that `thumbnail_packing` already resized
+packed_img_transform = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize(
+            mean=[0.485, 0.456, 0.406],
+            std=[0.229, 0.224, 0.225])
+    ])
+
 class ImageDataset(Dataset):
     def __init__(self, root_dir, transform=None):
         self.root_dir = root_dir
         self.transform = transform
-        self.img_names = os.listdir(self.root_dir)
+        # Thumbnails are named by their row number, skip anything else left in the directory
+        self.img_names = [name for name in os.listdir(self.root_dir) if name.endswith('.jpg')]
 
     def __len__(self):
         return len(self.img_names)
@@ -24,7 +36,46 @@ class ImageDataset(Dataset):
     def __getitem__(self, idx):
         img_name = self.img_names[idx]
         img_path = os.path.join(self.root_dir, img_name)
-        img = Image.open(img_path)
+        img = Image.open(img_path).convert('RGB')
+        if self.transform:
+            img = self.transform(img)
+        return img_name, img
+
+class PackedImageDataset(Dataset):
+    """
+    Reads thumbnails packed by `thumbnail_packing` from memory-mapped shards, so getting an
+    image is a copy of one pre-decoded 224x224x3 array instead of a file open and JPEG decode.
+    Items are (file name, image) like in `ImageDataset`, and `content_hashes` holds the hash
+    of each original file for `embedding_cache`.
+    """
+    def __init__(self, root_dir, transform=None):
+        self.root_dir = root_dir
+        self.transform = transform
+        meta, self.img_names, self.content_hashes, self._shard_idxs, self._rows = \
+            thumbnail_packing.load_index(root_dir)
+        self.img_names = self.img_names.tolist()
+        self.content_hashes = self.content_hashes.tolist()
+        self._shards = None
+
+    def _open_shards(self):
+        n_shards = int(self._shard_idxs.max()) + 1 if len(self._shard_idxs) else 0
+        self._shards = [
+            np.load(os.path.join(self.root_dir, thumbnail_packing.SHARD_NAME_TEMPLATE.format(i)), mmap_mode='r')
+            for i in range(n_shards)]
+
+    def __getstate__(self):
+        # Workers must map the shards themselves rather than receive a copy of their contents
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+    def __len__(self):
+        return len(self.img_names)
+
+    def __getitem__(self, idx):
+        if self._shards is None:
+            self._open_shards()
+        img = np.array(self._shards[self._shard_idxs[idx]][self._rows[idx]])
         if self.transform:
             img = self.transform(img)
-        return img_name, img
\ No newline at end of file
+        return self.img_names[idx], img
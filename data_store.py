@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+SHARD_FORMATS = ('jsonl', 'parquet')
+ROWS_PER_SHARD = 50000
+STALE_ACTIVE_SECONDS = 3600
+ACTIVE_SUFFIX = '.active'
+PART_NAME_TEMPLATE = 'part-{}-{:010d}.{}'
+PART_NAME_PATTERN = re.compile(r'^part-(.+)-(\d{10})\.(jsonl|parquet)(\.active)?$')
+BASE_NAME_TEMPLATE = 'compacted-{:06d}'
+BASE_NAME_PATTERN = re.compile(r'^compacted-(\d{6})$')
+BASE_META_FILE = '_meta.json'
+DATASET_META_FILE = '_dataset.json'
+# Every row is stamped with when it was appended, so `keep` resolves duplicates across writers
+WRITE_TIME_COLUMN = '_written_at'
+
+
+def default_writer_id():
+  return '{}_{}'.format(socket.gethostname().replace('-', '_'), os.getpid())
+
+def _read_shard(path):
+  if path.endswith('.parquet'):
+    return pd.read_parquet(path)
+  rows = []
+  with open(path, 'r') as f:
+    for line in f:
+      try:
+        rows.append(json.loads(line))
+      except ValueError:
+        # A crash while appending can leave a partial last line behind
+        continue
+  return pd.DataFrame(rows)
+
+def _write_times(df):
+  """Returns the append time of every row in ns, -1 for rows written before rows were stamped."""
+  if WRITE_TIME_COLUMN not in df.columns:
+    return np.full(len(df), -1, dtype=np.int64)
+  return df[WRITE_TIME_COLUMN].fillna(-1).astype(np.int64).values
+
+def _write_rows(path, rows, shard_format):
+  if shard_format == 'parquet':
+    pd.DataFrame(rows).to_parquet(path, index=False)
+  else:
+    with open(path, 'w') as f:
+      for row in rows:
+        f.write(json.dumps(row, default=str) + '\n')
+
+class ShardedDataset():
+  """
+  Append-only on-disk table of scraped rows, stored as a directory of shards.
+
+  New rows are appended to delta shards (`part-*.jsonl` or `part-*.parquet`), so
+  saving costs O(new rows). Each writer, which may be another process or machine
+  sharing the directory, appends to its own shards named by `writer_id`. JSONL
+  shards carry an `.active` suffix while they are appended to and are sealed by a
+  rename. `compact` folds the sealed deltas into a new `compacted-*` base
+  directory while dropping rows with a duplicate `key`, holding only the set of
+  keys and one shard in memory. Every step is a file append or an atomic rename,
+  so a crash loses at most the unflushed rows.
+
+  Which of the rows with the same key is first or last is decided by the time each row
+  was appended, stored in `WRITE_TIME_COLUMN`, not by the shard it is in, so writers on
+  several machines should keep their clocks in sync. `read` drops that column.
+  """
+  def __init__(self, path, key, shard_format='jsonl', rows_per_shard=ROWS_PER_SHARD, keep='first',
+               writer_id=None):
+    if shard_format not in SHARD_FORMATS:
+      raise ValueError(f'Unknown shard format "{shard_format}", expected one of {SHARD_FORMATS}.')
+    if keep not in ('first', 'last'):
+      raise ValueError('`keep` must be "first" or "last".')
+    self.path = path
+    self.key = key
+    self.shard_format = shard_format
+    self.rows_per_shard = rows_per_shard
+    self.keep = keep
+    self.writer_id = writer_id or default_writer_id()
+
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, DATASET_META_FILE)
+    if not os.path.isfile(meta_path):
+      with open(meta_path, 'w') as f:
+        json.dump({'key': key, 'keep': keep, 'shard_format': shard_format}, f)
+
+    self._lock = threading.Lock()
+    self._compact_lock = threading.Lock()
+    self._compaction_thread = None
+    self._stop_compaction = threading.Event()
+
+    seqs = [int(m.group(2)) for m in map(PART_NAME_PATTERN.match, os.listdir(path))
+            if m and m.group(1) == self.writer_id]
+    self._next_seq = max(seqs + [-1]) + 1
+    self._active_path = None
+    self._active_rows = 0
+
+  def _current_base(self):
+    """Returns (base dir, names of the deltas it includes) of the newest complete base, or None."""
+    bases = sorted(m.group(0) for m in map(BASE_NAME_PATTERN.match, os.listdir(self.path)) if m)
+    if not bases:
+      return None
+    base_dir = os.path.join(self.path, bases[-1])
+    with open(os.path.join(base_dir, BASE_META_FILE), 'r') as f:
+      return base_dir, set(json.load(f)['included'])
+
+  def _shard_paths(self, sealed_only=False):
+    """Returns every shard that makes up the dataset, base shards first, and the deltas among them."""
+    base = self._current_base()
+    base_paths, included = [], set()
+    if base is not None:
+      base_dir, included = base
+      base_paths = [os.path.join(base_dir, name) for name in sorted(os.listdir(base_dir))
+                    if name != BASE_META_FILE]
+
+    deltas = []
+    for name in sorted(os.listdir(self.path)):
+      match = PART_NAME_PATTERN.match(name)
+      if not match or name in included or (sealed_only and match.group(4)):
+        continue
+      deltas.append(os.path.join(self.path, name))
+    return base_paths + deltas, deltas
+
+  def _new_part_path(self, shard_format):
+    path = os.path.join(self.path, PART_NAME_TEMPLATE.format(self.writer_id, self._next_seq, shard_format))
+    self._next_seq += 1
+    return path
+
+  def _seal(self):
+    if self._active_path is not None:
+      os.replace(self._active_path, self._active_path[:-len(ACTIVE_SUFFIX)])
+      self._active_path = None
+
+  def append(self, rows):
+    """Durably appends a list of row dicts."""
+    if not rows:
+      return
+    with self._lock:
+      written_at = time.time_ns()
+      rows = [dict(row, **{WRITE_TIME_COLUMN: written_at}) for row in rows]
+      if self.shard_format == 'parquet':
+        path = self._new_part_path('parquet')
+        _write_rows(path + '.tmp', rows, 'parquet')
+        os.replace(path + '.tmp', path)
+        return
+
+      if self._active_path is not None and self._active_rows >= self.rows_per_shard:
+        self._seal()
+      if self._active_path is None:
+        self._active_path = self._new_part_path('jsonl') + ACTIVE_SUFFIX
+        self._active_rows = 0
+      with open(self._active_path, 'a') as f:
+        for row in rows:
+          f.write(json.dumps(row, default=str) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      self._active_rows += len(rows)
+
+  def _seal_stale(self, stale_seconds):
+    """Seals active shards of other writers that have not been written to for `stale_seconds`."""
+    now = time.time()
+    for name in os.listdir(self.path):
+      match = PART_NAME_PATTERN.match(name)
+      if not match or not match.group(4) or match.group(1) == self.writer_id:
+        continue
+      path = os.path.join(self.path, name)
+      try:
+        if now - os.path.getmtime(path) > stale_seconds:
+          os.replace(path, path[:-len(ACTIVE_SUFFIX)])
+      except OSError:
+        continue
+
+  def compact(self, stale_seconds=STALE_ACTIVE_SECONDS):
+    """Merges all sealed delta shards into a new base, dropping duplicate keys."""
+    with self._compact_lock:
+      with self._lock:
+        # Seal the shard that is being appended to, later rows go to a new one
+        self._seal()
+      self._seal_stale(stale_seconds)
+      base = self._current_base()
+      inputs, deltas = self._shard_paths(sealed_only=True)
+      if not deltas:
+        return
+
+      gen = 0 if base is None else int(BASE_NAME_PATTERN.match(os.path.basename(base[0])).group(1)) + 1
+      new_base = os.path.join(self.path, BASE_NAME_TEMPLATE.format(gen))
+      tmp_base = new_base + '.tmp'
+      shutil.rmtree(tmp_base, ignore_errors=True)
+      os.makedirs(tmp_base)
+
+      # Decide which rows survive holding only the keys and write times of every shard in memory
+      rows = []
+      for position, path in enumerate(inputs):
+        df = _read_shard(path)
+        if len(df) == 0:
+          continue
+        rows.append(pd.DataFrame({'key': df[self.key].values, 'written_at': _write_times(df),
+                                  'position': position, 'row': df.index}))
+      kept = {}
+      if rows:
+        rows = pd.concat(rows, ignore_index=True).sort_values('written_at', kind='stable')
+        rows = rows.drop_duplicates(subset='key', keep=self.keep)
+        kept = {inputs[position]: set(shard_rows) for position, shard_rows in rows.groupby('position')['row']}
+
+      out_rows, out_idx = [], 0
+      for path in inputs:
+        if not kept.get(path):
+          continue
+        df = _read_shard(path)
+        df = df.loc[sorted(kept[path])]
+        out_rows.extend(df.to_dict('records'))
+        while len(out_rows) >= self.rows_per_shard:
+          _write_rows(os.path.join(tmp_base, f'{out_idx:06d}.{self.shard_format}'),
+                      out_rows[:self.rows_per_shard], self.shard_format)
+          out_rows = out_rows[self.rows_per_shard:]
+          out_idx += 1
+      if out_rows:
+        _write_rows(os.path.join(tmp_base, f'{out_idx:06d}.{self.shard_format}'),
+                    out_rows, self.shard_format)
+      with open(os.path.join(tmp_base, BASE_META_FILE), 'w') as f:
+        json.dump({'included': [os.path.basename(path) for path in deltas], 'key': self.key}, f)
+
+      # Publishing the new base is atomic, the old files are only removed afterwards
+      os.replace(tmp_base, new_base)
+      if base is not None:
+        shutil.rmtree(base[0], ignore_errors=True)
+      for path in deltas:
+        os.remove(path)
+
+  def read(self):
+    """Loads the whole dataset into a DataFrame, dropping duplicate keys."""
+    dfs = [_read_shard(path) for path in self._shard_paths()[0]]
+    dfs = [df for df in dfs if len(df) > 0]
+    if not dfs:
+      return pd.DataFrame()
+    df = pd.concat(dfs, axis=0, ignore_index=True)
+    # Rows stay in shard order, only the choice between duplicates goes by write time
+    kept = df.iloc[np.argsort(_write_times(df), kind='stable')].drop_duplicates(subset=self.key, keep=self.keep)
+    df = df.loc[np.sort(kept.index.values)]
+    return df.drop(columns=WRITE_TIME_COLUMN, errors='ignore').reset_index(drop=True)
+
+  def start_compaction(self, interval=600):
+    """Starts a background thread that compacts the dataset every `interval` seconds."""
+    if self._compaction_thread is not None and self._compaction_thread.is_alive():
+      return
+    self._stop_compaction.clear()
+
+    def compaction_loop():
+      while not self._stop_compaction.wait(interval):
+        try:
+          self.compact()
+        except Exception as e:
+          print(f'Compaction of {self.path} failed with exception: {e}')
+
+    self._compaction_thread = threading.Thread(target=compaction_loop, daemon=True)
+    self._compaction_thread.start()
+
+  def stop_compaction(self):
+    self._stop_compaction.set()
+    if self._compaction_thread is not None:
+      self._compaction_thread.join()
+      self._compaction_thread = None
+
+  def close(self):
+    """Stops background compaction and seals the shard this writer is appending to."""
+    self.stop_compaction()
+    with self._lock:
+      self._seal()
+
+def open_dataset(path):
+  """Opens an existing `ShardedDataset` with the settings it was created with."""
+  with open(os.path.join(path, DATASET_META_FILE), 'r') as f:
+    meta = json.load(f)
+  return ShardedDataset(path, meta['key'], shard_format=meta['shard_format'], keep=meta['keep'])
+
+def read_table(path):
+  """Reads scraped data from either a CSV file or a `ShardedDataset` directory."""
+  if os.path.isdir(path):
+    return open_dataset(path).read()
+  return pd.read_csv(path, index_col=0)
+
+def iter_table(path, chunksize=None, dtype=None, compact=False):
+  """
+  Yields the rows of a CSV file or a `ShardedDataset` directory in chunks, so that
+  only one chunk is in memory at a time. CSV files are read `chunksize` rows at a time
+  (all at once if it is None) and datasets one shard at a time. `dtype` maps columns to
+  their types and may name columns the data does not have.
+
+  Duplicate keys of a dataset are only dropped by compacting it first, which `compact`
+  does, and then shards that running writers are still appending to are left out.
+  Thumbnails and features are named by the row number in this order, so every tool that
+  numbers rows reads them through this function with `compact` set.
+  """
+  if os.path.isdir(path):
+    dataset = open_dataset(path)
+    if compact:
+      dataset.compact()
+    for shard_path in dataset._shard_paths(sealed_only=compact)[0]:
+      df = _read_shard(shard_path).drop(columns=WRITE_TIME_COLUMN, errors='ignore')
+      if len(df) > 0:
+        yield df.astype({k: v for k, v in (dtype or {}).items() if k in df.columns})
+  elif chunksize is None:
+    yield pd.read_csv(path, index_col=0, dtype=dtype)
+  else:
+    with pd.read_csv(path, index_col=0, dtype=dtype, chunksize=chunksize) as reader:
+      yield from reader
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Compacts a scraped dataset and exports it to CSV.')
+  parser.add_argument('dataset', type=str, help='Dataset directory')
+  parser.add_argument('output_file', type=str, help='CSV file to write')
+
+  return parser.parse_args()
+
+if __name__ == '__main__':
+  args = parse_args()
+  dataset = open_dataset(args.dataset)
+  dataset.compact()
+  df = dataset.read()
+  print('# rows:', str(len(df)))
+  df.to_csv(args.output_file)
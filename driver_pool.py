@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+
+from pacing import backoff_delay
+
+try:
+  import psutil
+except ImportError:
+  psutil = None
+
+
+RECYCLE_PAGES = 500
+CREATE_RETRY_DELAY_SECONDS = 3.0
+CREATE_MAX_DELAY_SECONDS = 120.0
+ACQUIRE_TIMEOUT_SECONDS = 300.0
+
+
+def process_tree_rss_mb(driver):
+  """Returns the resident memory of a ChromeDriver and all of its browser processes in MB."""
+  if psutil is None:
+    return 0.0
+  try:
+    process = psutil.Process(driver.service.process.pid)
+    processes = [process] + process.children(recursive=True)
+  except (AttributeError, psutil.Error):
+    return 0.0
+
+  rss = 0
+  for p in processes:
+    try:
+      rss += p.memory_info().rss
+    except psutil.Error:
+      continue
+  return rss / (1024 * 1024)
+
+def ping_driver(driver):
+  """Default health check, a session that can still run a script is healthy."""
+  return driver.execute_script('return 1') == 1
+
+
+class DriverPool():
+  """
+  Pool of pre-warmed WebDriver sessions that scrapers lease instead of starting
+  their own browser.
+
+  Sessions are health-checked when they are returned and recycled once they have
+  loaded `max_pages` pages or their process tree uses more than `max_rss_mb`.
+  Discarded sessions are replaced on a background thread so a warm session is
+  usually waiting by the time the next scraper needs one. Sessions that fail to
+  start are retried with backoff until they do, so the pool never shrinks.
+  `factory` is any callable that returns a driver, which makes the pool usable
+  with fake drivers.
+  """
+  def __init__(self, factory, size=4, max_pages=RECYCLE_PAGES, max_rss_mb=None,
+               health_check=ping_driver, rss_func=process_tree_rss_mb):
+    if max_rss_mb is not None and psutil is None and rss_func is process_tree_rss_mb:
+      print('psutil is not installed, sessions will not be recycled based on memory use')
+    self.factory = factory
+    self.size = size
+    self.max_pages = max_pages
+    self.max_rss_mb = max_rss_mb
+    self.health_check = health_check
+    self.rss_func = rss_func
+
+    self._idle = queue.Queue()
+    self._pages = {}
+    self._lock = threading.Lock()
+    self._closed = False
+    self.n_created = 0
+    self.n_recycled = 0
+    self.n_failed = 0
+
+    for _ in range(size):
+      self._spawn()
+
+  def _spawn(self):
+    threading.Thread(target=self._create, daemon=True).start()
+
+  def _create(self):
+    attempt = 0
+    while True:
+      if self._closed:
+        return
+      try:
+        driver = self.factory()
+        break
+      except Exception as e:
+        print(f'Failed to start a driver session (attempt {attempt + 1}): {e}')
+        time.sleep(backoff_delay(attempt, CREATE_RETRY_DELAY_SECONDS, CREATE_MAX_DELAY_SECONDS))
+        attempt += 1
+
+    with self._lock:
+      if self._closed:
+        self._quit(driver)
+        return
+      self._pages[driver] = 0
+      self.n_created += 1
+    self._idle.put(driver)
+
+  def _quit(self, driver):
+    try:
+      driver.quit()
+    except Exception as e:
+      print(f'Tried to quit a driver session, but failed with exception: {e}')
+
+  def _discard(self, driver):
+    with self._lock:
+      self._pages.pop(driver, None)
+    self._quit(driver)
+    if not self._closed:
+      self._spawn()
+
+  def is_healthy(self, driver):
+    try:
+      return bool(self.health_check(driver))
+    except Exception:
+      return False
+
+  def needs_recycle(self, driver, pages=0):
+    """Returns True if a session has loaded too many pages or uses too much memory."""
+    with self._lock:
+      total_pages = self._pages.get(driver, 0) + pages
+    if self.max_pages is not None and total_pages >= self.max_pages:
+      return True
+    if self.max_rss_mb is not None and self.rss_func(driver) >= self.max_rss_mb:
+      return True
+    return False
+
+  def acquire(self, timeout=ACQUIRE_TIMEOUT_SECONDS):
+    """
+    Leases a session, waiting for one to become available. Raises `TimeoutError` if
+    none did within `timeout` seconds, None waits forever.
+    """
+    if self._closed:
+      raise RuntimeError('The driver pool has been closed.')
+    try:
+      return self._idle.get(timeout=timeout)
+    except queue.Empty:
+      raise TimeoutError(f'No driver session became available within {timeout} seconds.')
+
+  def release(self, driver, pages=0):
+    """Returns a leased session after it has loaded `pages` more pages."""
+    if self._closed:
+      self._quit(driver)
+      return
+
+    if not self.is_healthy(driver):
+      self.n_failed += 1
+      self._discard(driver)
+    elif self.needs_recycle(driver, pages):
+      self.n_recycled += 1
+      self._discard(driver)
+    else:
+      with self._lock:
+        self._pages[driver] = self._pages.get(driver, 0) + pages
+      self._idle.put(driver)
+
+  def close(self):
+    with self._lock:
+      self._closed = True
+    while True:
+      try:
+        driver = self._idle.get_nowait()
+      except queue.Empty:
+        break
+      self._quit(driver)
@@ -0,0 +1,146 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+HASH_BYTES = 16
+HASH_WORKERS = 8
+QUERY_BATCH_SIZE = 500
+
+
+def hash_file(path):
+    """Returns a hex digest of a file's contents, so renamed copies of an image share one key."""
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=HASH_BYTES).hexdigest()
+
+def hash_files(paths, n_workers=HASH_WORKERS):
+    """Hashes many files in parallel, hashing releases the GIL so threads are enough."""
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(hash_file, paths))
+
+def model_fingerprint(model, transform=None, extra=''):
+    """
+    Returns a digest of a model's weights, the image transform and any extra settings
+    (e.g. the precision). Cached features are only reused for the same fingerprint, so
+    changing any of these invalidates them.
+    """
+    digest = hashlib.blake2b(digest_size=HASH_BYTES)
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        digest.update(str(tuple(tensor.shape)).encode())
+        if tensor.is_quantized:
+            tensor = tensor.int_repr()
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    digest.update(repr(transform).encode())
+    digest.update(str(extra).encode())
+    return digest.hexdigest()
+
+
+class EmbeddingCache():
+    """
+    Feature vectors stored by (model fingerprint, content hash of the image), in a SQLite file.
+
+    Because the key is the image content rather than its file name, thumbnails that are
+    renamed by a reindex of the video data keep their cached features, and duplicate
+    thumbnails are only extracted once. Entries of other fingerprints are left alone
+    until `invalidate` drops them, and `compact` drops entries no image refers to anymore.
+    """
+    def __init__(self, path='data/embedding_cache.sqlite', fingerprint='', dtype=np.float32):
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self.path = path
+        self.fingerprint = fingerprint
+        self.dtype = np.dtype(dtype)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'fingerprint TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL, '
+                'last_used REAL, PRIMARY KEY (fingerprint, content_hash))')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM embeddings WHERE fingerprint = ?', (self.fingerprint,)).fetchone()[0]
+
+    def get_many(self, content_hashes):
+        """Returns a dict of content hash to vector for every hash that is cached."""
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        found = {}
+        now = time.time()
+        with self._lock, self._conn:
+            for start in range(0, len(unique_hashes), QUERY_BATCH_SIZE):
+                batch = unique_hashes[start:start + QUERY_BATCH_SIZE]
+                params = ', '.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT content_hash, vector FROM embeddings WHERE fingerprint = ? '
+                    f'AND content_hash IN ({params})', (self.fingerprint, *batch)).fetchall()
+                for content_hash, vector in rows:
+                    found[content_hash] = np.frombuffer(vector, dtype=self.dtype)
+                self._conn.execute(
+                    f'UPDATE embeddings SET last_used = ? WHERE fingerprint = ? '
+                    f'AND content_hash IN ({params})', (now, self.fingerprint, *batch))
+        return found
+
+    def put_many(self, content_hashes, vectors):
+        now = time.time()
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        rows = [(self.fingerprint, content_hash, vector.tobytes(), now)
+                for content_hash, vector in zip(content_hashes, vectors)]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (fingerprint, content_hash, vector, last_used) '
+                'VALUES (?, ?, ?, ?)', rows)
+
+    def invalidate(self):
+        """Drops every entry computed with a different model or transform. Returns how many were dropped."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM embeddings WHERE fingerprint != ?', (self.fingerprint,))
+        return cursor.rowcount
+
+    def compact(self, referenced_hashes):
+        """Drops entries whose image is not in `referenced_hashes` and shrinks the file."""
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS referenced (content_hash TEXT PRIMARY KEY)')
+            self._conn.execute('DELETE FROM referenced')
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO referenced (content_hash) VALUES (?)',
+                ((content_hash,) for content_hash in referenced_hashes))
+            cursor = self._conn.execute(
+                'DELETE FROM embeddings WHERE content_hash NOT IN (SELECT content_hash FROM referenced)')
+            n_removed = cursor.rowcount
+        with self._lock:
+            self._conn.execute('VACUUM')
+        return n_removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Drops stale entries from a thumbnail embedding cache.')
+    parser.add_argument('-c', '--cache_file', type=str, default='data/embedding_cache.sqlite',
+                        help='Cache file to compact')
+    parser.add_argument('-t', '--thumbnail_dir', type=str, default='thumbnails',
+                        help='Directory of the thumbnails whose entries should be kept')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    paths = [os.path.join(args.thumbnail_dir, name) for name in os.listdir(args.thumbnail_dir)]
+    cache = EmbeddingCache(args.cache_file)
+    n_removed = cache.compact(hash_files(paths))
+    cache.close()
+    print(f'Removed {n_removed} unreferenced entries')
@@ -0,0 +1,143 @@
+import json
+import os
+
+import numpy as np
+
+
+VECTORS_FILE = 'vectors.bin'
+IDS_FILE = 'ids.npy'
+SORTED_IDS_FILE = 'sorted_ids.npy'
+SORTED_ROWS_FILE = 'sorted_rows.npy'
+META_FILE = 'meta.json'
+DTYPES = ('float32', 'float16')
+
+
+def _save_atomic(path, array):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingStore():
+    """
+    On-disk table of feature vectors keyed by integer IDs, e.g. the `feature_id` column of
+    the prepared data.
+
+    Vectors are kept in one flat float32 or float16 buffer that is opened with `np.memmap`,
+    so opening a store is instant, only the rows that are used get read, and processes
+    reading the same store share its pages. IDs are kept in row order and as a sorted copy
+    with the matching rows, which `lookup` binary searches for a whole array of IDs at once.
+    Appending only writes the new rows and rebuilds the ID index.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self.dtype = np.dtype(meta['dtype'])
+        self._n_rows = meta['n_rows']
+        self._load()
+
+    @classmethod
+    def create(cls, path, ids, vectors, dtype='float32'):
+        """Writes a new store, replacing any store already at `path`."""
+        if dtype not in DTYPES:
+            raise ValueError(f'Unknown dtype "{dtype}", expected one of {DTYPES}.')
+        vectors = np.asarray(vectors)
+        os.makedirs(path, exist_ok=True)
+        meta = {'dim': int(vectors.shape[1]) if vectors.ndim == 2 else 0, 'dtype': dtype, 'n_rows': 0}
+        with open(os.path.join(path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+        open(os.path.join(path, VECTORS_FILE), 'wb').close()
+        for file_name in (IDS_FILE, SORTED_IDS_FILE, SORTED_ROWS_FILE):
+            _save_atomic(os.path.join(path, file_name), np.zeros(0, dtype=np.int64))
+
+        store = cls(path)
+        store.append(ids, vectors)
+        return store
+
+    def _load(self):
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        if self._n_rows > 0:
+            self.vectors = np.memmap(vectors_path, dtype=self.dtype, mode='r', shape=(self._n_rows, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+        self.ids = np.load(os.path.join(self.path, IDS_FILE), mmap_mode='r')[:self._n_rows]
+
+        self._sorted_ids = np.load(os.path.join(self.path, SORTED_IDS_FILE), mmap_mode='r')
+        self._sorted_rows = np.load(os.path.join(self.path, SORTED_ROWS_FILE), mmap_mode='r')
+        if len(self._sorted_ids) != self._n_rows:
+            # An append was interrupted before its metadata was written, index the committed rows only
+            self._sorted_rows = np.argsort(np.asarray(self.ids), kind='stable')
+            self._sorted_ids = np.asarray(self.ids)[self._sorted_rows]
+
+    def __len__(self):
+        return self._n_rows
+
+    def __contains__(self, feature_id):
+        return bool(self.contains(np.array([feature_id]))[0])
+
+    def _positions(self, ids):
+        positions = np.searchsorted(self._sorted_ids, ids)
+        positions = np.minimum(positions, max(len(self._sorted_ids) - 1, 0))
+        if len(self._sorted_ids) == 0:
+            return positions, np.zeros(len(ids), dtype=bool)
+        return positions, self._sorted_ids[positions] == ids
+
+    def contains(self, ids):
+        """Returns a boolean mask of which IDs are in the store."""
+        return self._positions(np.asarray(ids, dtype=np.int64))[1]
+
+    def rows(self, ids):
+        """Returns the row of every ID in the vector buffer. Raises a KeyError if any is missing."""
+        ids = np.asarray(ids, dtype=np.int64)
+        positions, found = self._positions(ids)
+        if not found.all():
+            missing = ids[~found]
+            raise KeyError(f'{len(missing)} IDs are not in the store, e.g. {missing[:5].tolist()}')
+        return self._sorted_rows[positions]
+
+    def lookup(self, ids):
+        """Returns the vectors of an array of IDs, in the same order, reading only those rows."""
+        rows = self.rows(ids)
+        # Reading in row order keeps the disk access sequential
+        order = np.argsort(rows, kind='stable')
+        vectors = np.empty((len(rows), self.dim), dtype=self.dtype)
+        vectors[order] = self.vectors[rows[order]]
+        return vectors
+
+    def append(self, ids, vectors):
+        """Appends vectors for IDs that are not in the store yet."""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        if len(ids) != len(vectors):
+            raise ValueError(f'Got {len(ids)} IDs for {len(vectors)} vectors.')
+        if len(ids) == 0:
+            return
+        if vectors.shape[1] != self.dim and self._n_rows > 0:
+            raise ValueError(f'Vectors have {vectors.shape[1]} dimensions, the store has {self.dim}.')
+        if len(np.unique(ids)) != len(ids) or self.contains(ids).any():
+            raise ValueError('IDs must be unique and not already be in the store.')
+
+        # The metadata is written last, rows past its `n_rows` are ignored if this is interrupted
+        with open(os.path.join(self.path, VECTORS_FILE), 'r+b') as f:
+            f.seek(self._n_rows * self.dim * self.dtype.itemsize)
+            f.write(vectors.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+        all_ids = np.concatenate([np.asarray(self.ids), ids])
+        sorted_rows = np.argsort(all_ids, kind='stable')
+        _save_atomic(os.path.join(self.path, IDS_FILE), all_ids)
+        _save_atomic(os.path.join(self.path, SORTED_IDS_FILE), all_ids[sorted_rows])
+        _save_atomic(os.path.join(self.path, SORTED_ROWS_FILE), sorted_rows)
+
+        self.dim = int(vectors.shape[1])
+        self._n_rows = len(all_ids)
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'dim': self.dim, 'dtype': self.dtype.name, 'n_rows': self._n_rows}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self._load()
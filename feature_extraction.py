@@ -0,0 +1,237 @@
+"""
+Benchmarks thumbnail feature extraction on the CPU at fp32, bf16 and int8.
+
+The speed and accuracy of the reduced precisions depend on the CPU (bf16 is only fast
+with AVX-512 BF16 or AMX) and on the thumbnails, so measure them on the machine and
+data the features will be extracted on:
+
+    python feature_extraction.py -t thumbnails -n 1024 -s 256
+
+The first lines give images_per_sec of each precision, and for bf16 and int8 their
+speedup and mean_cosine, min_cosine and max_abs_diff against the fp32 features of the
+same images. The last lines compare every pair of precisions on the first `-s`
+thumbnails. Both models load pretrained torchvision weights, which are downloaded on
+the first run.
+"""
+
+import argparse
+import contextlib
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+import torchvision
+
+from data_handling import ImageDataset, img_transform
+from models import ImageFeatureExtractor
+
+
+PRECISIONS = ('fp32', 'bf16', 'int8')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks thumbnail feature extraction on the CPU.')
+    parser.add_argument('-t', '--thumbnail_dir', type=str, default='thumbnails',
+                        help='Directory of thumbnails to benchmark on')
+    parser.add_argument('-p', '--precisions', type=str, nargs='+', default=list(PRECISIONS),
+                        choices=PRECISIONS, help='Precisions to compare against fp32')
+    parser.add_argument('-n', '--n_images', type=int, default=1024,
+                        help='Number of thumbnails to run through each model')
+    parser.add_argument('-b', '--batch_size', type=int, default=64,
+                        help='Images per forward pass')
+    parser.add_argument('--n_threads', type=int, default=None,
+                        help='Intra-op threads used by torch, defaults to the number of cores')
+    parser.add_argument('--n_workers', type=int, default=4,
+                        help='Processes that decode images while the model runs')
+    parser.add_argument('-s', '--sample_size', type=int, default=256,
+                        help='Number of thumbnails the features of every pair of precisions are compared on')
+
+    return parser.parse_args()
+
+def build_int8_extractor():
+    """
+    ResNet-50 with torchvision's pre-quantized int8 weights (fbgemm), with the classifier
+    removed like in `ImageFeatureExtractor`. Dynamic quantization only covers linear
+    layers, which this network has none of once the classifier is gone, so static
+    quantization is what makes the convolutions cheaper.
+    """
+    torch.backends.quantized.engine = 'fbgemm'
+    model = torchvision.models.quantization.resnet50(pretrained=True, quantize=True)
+    model.fc = nn.Identity()
+    return model
+
+class FeatureExtractionEngine():
+    """
+    Runs `ImageFeatureExtractor` over image datasets for inference only.
+
+    Images are decoded by `n_workers` DataLoader processes while the model runs, the
+    model uses the channels-last memory layout and `torch.inference_mode`, and
+    `n_threads` sets the number of intra-op threads. `precision` is one of:
+      - fp32: the reference model
+      - bf16: fp32 weights with bfloat16 autocast, fast on CPUs with AVX-512 BF16 or AMX
+      - int8: statically quantized weights and activations, CPU only
+
+    The reduced precisions change the features slightly. `compare_precisions` measures
+    how much on a sample, and `benchmark` reports it next to the throughput of each precision.
+    """
+    def __init__(self, precision='fp32', device='cpu', n_threads=None, n_workers=4, batch_size=64):
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unknown precision "{precision}", expected one of {PRECISIONS}.')
+        if precision == 'int8' and device != 'cpu':
+            raise ValueError('int8 feature extraction is only supported on the CPU.')
+        self.precision = precision
+        self.device = device
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        if n_threads is not None:
+            torch.set_num_threads(n_threads)
+
+        if precision == 'int8':
+            model = build_int8_extractor()
+        else:
+            model = ImageFeatureExtractor()
+        self.model = model.eval().to(device, memory_format=torch.channels_last)
+
+    def _autocast(self):
+        if self.precision == 'bf16':
+            return torch.autocast(device_type=self.device.split(':')[0], dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def make_loader(self, dataset):
+        loader_kwargs = {}
+        if self.n_workers > 0:
+            # Keep several batches decoded ahead so the model never waits on JPEG decoding
+            loader_kwargs = {'prefetch_factor': 4, 'persistent_workers': True}
+        return DataLoader(dataset, batch_size=self.batch_size, shuffle=False,
+                          num_workers=self.n_workers, **loader_kwargs)
+
+    def extract_batches(self, dataset, loader=None):
+        """
+        Yields (image names, float32 feature array) for every batch of `dataset`. `loader`
+        reuses a DataLoader of `dataset` from `make_loader`, e.g. one whose workers are warm.
+        """
+        if loader is None:
+            loader = self.make_loader(dataset)
+        with torch.inference_mode(), self._autocast():
+            for img_names, imgs in loader:
+                imgs = imgs.to(self.device, memory_format=torch.channels_last)
+                features = self.model(imgs)
+                yield list(img_names), features.float().cpu().numpy()
+
+    def _batches(self, dataset, progress=None, loader=None):
+        batches = self.extract_batches(dataset, loader)
+        if progress is not None:
+            batches = progress(batches, total=(len(dataset) + self.batch_size - 1) // self.batch_size)
+        return batches
+
+    def extract(self, dataset, progress=None, loader=None):
+        """Returns (image names, feature array) for the whole dataset, `progress` can be e.g. `tqdm.tqdm`."""
+        all_names, all_features = [], []
+        for img_names, features in self._batches(dataset, progress, loader):
+            all_names.extend(img_names)
+            all_features.append(features)
+        if not all_features:
+            return all_names, np.zeros((0, 2048), dtype=np.float32)
+        return all_names, np.concatenate(all_features, axis=0)
+
+    def extract_cached(self, dataset, cache, content_hashes, progress=None):
+        """
+        Returns the features of every image in `dataset` in order, like `extract`, but only
+        runs images whose content hash is missing from `cache` (an
+        `embedding_cache.EmbeddingCache`) through the model, and caches their features.
+        """
+        found = cache.get_many(content_hashes)
+        missing_idxs, missing_hashes = [], set()
+        for i, content_hash in enumerate(content_hashes):
+            if content_hash not in found and content_hash not in missing_hashes:
+                missing_idxs.append(i)
+                missing_hashes.add(content_hash)
+        print(f'{len(content_hashes) - len(missing_idxs)} images cached, extracting {len(missing_idxs)}')
+
+        if missing_idxs:
+            offset = 0
+            for _, features in self._batches(Subset(dataset, missing_idxs), progress):
+                batch_hashes = [content_hashes[i] for i in missing_idxs[offset:offset + len(features)]]
+                cache.put_many(batch_hashes, features)
+                found.update(zip(batch_hashes, features.astype(cache.dtype)))
+                offset += len(features)
+
+        if not content_hashes:
+            return np.zeros((0, 2048), dtype=cache.dtype)
+        return np.stack([found[content_hash] for content_hash in content_hashes])
+
+def compare_features(reference, features):
+    """Returns the mean and minimum cosine similarity and the max absolute difference of two feature arrays."""
+    reference = reference.astype(np.float64)
+    features = features.astype(np.float64)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(features, axis=1)
+    cosine = (reference * features).sum(axis=1) / np.maximum(norms, 1e-12)
+    return {
+        'mean_cosine': float(cosine.mean()),
+        'min_cosine': float(cosine.min()),
+        'max_abs_diff': float(np.abs(reference - features).max())
+    }
+
+def compare_precisions(dataset, precisions=PRECISIONS, sample_size=256, **engine_kwargs):
+    """
+    Extracts the features of the first `sample_size` images of `dataset` with each
+    precision and returns `compare_features` of every pair, keyed like 'fp32/int8'.
+    """
+    if len(dataset) == 0:
+        raise ValueError('Cannot compare precisions on an empty dataset.')
+    sample = Subset(dataset, range(min(len(dataset), sample_size)))
+    features = {}
+    for precision in precisions:
+        _, features[precision] = FeatureExtractionEngine(precision=precision, **engine_kwargs).extract(sample)
+    return {f'{a}/{b}': compare_features(features[a], features[b])
+            for i, a in enumerate(precisions) for b in precisions[i + 1:]}
+
+def benchmark(dataset, precisions=PRECISIONS, **engine_kwargs):
+    """
+    Extracts features for `dataset` with each precision and returns a dict of images/sec,
+    and of the accuracy delta against fp32 for the other precisions.
+    """
+    if len(dataset) == 0:
+        raise ValueError('Cannot benchmark feature extraction on an empty dataset.')
+    results = {}
+    reference = None
+    for precision in ('fp32',) + tuple(p for p in precisions if p != 'fp32'):
+        engine = FeatureExtractionEngine(precision=precision, **engine_kwargs)
+        loader = engine.make_loader(dataset)
+        # Warm up on the timed loader, the first batch includes worker startup and lazy initialization
+        batches = engine.extract_batches(dataset, loader)
+        next(batches)
+        batches.close()
+
+        start_time = time.perf_counter()
+        _, features = engine.extract(dataset, loader=loader)
+        elapsed = time.perf_counter() - start_time
+
+        result = {'images_per_sec': len(dataset) / elapsed}
+        if reference is None:
+            reference = features
+        else:
+            result.update(compare_features(reference, features))
+            result['speedup'] = result['images_per_sec'] / results['fp32']['images_per_sec']
+        results[precision] = result
+    return results
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    dataset = ImageDataset(root_dir=args.thumbnail_dir, transform=img_transform)
+    dataset = Subset(dataset, range(min(len(dataset), args.n_images)))
+    print(f'Benchmarking on {len(dataset)} thumbnails with {torch.get_num_threads()} threads')
+
+    results = benchmark(dataset, args.precisions, n_threads=args.n_threads,
+                        n_workers=args.n_workers, batch_size=args.batch_size)
+    for precision, result in results.items():
+        print(precision + ': ' + ', '.join(f'{k}={v:.4f}' for k, v in result.items()))
+
+    comparisons = compare_precisions(dataset, ('fp32',) + tuple(p for p in args.precisions if p != 'fp32'),
+                                     args.sample_size, n_threads=args.n_threads,
+                                     n_workers=args.n_workers, batch_size=args.batch_size)
+    for pair, result in comparisons.items():
+        print(pair + ': ' + ', '.join(f'{k}={v:.4f}' for k, v in result.items()))
@@ -0,0 +1,130 @@
+from collections import defaultdict
+import heapq
+import itertools
+import threading
+
+from seen_index import VIDEO, canonical_video_id
+
+
+MAX_FRONTIER_SIZE = 1000000
+MAX_ATTEMPTS = 3
+
+
+class FrontierEntry():
+  def __init__(self, url, thumbnail_link=None, channel=None, depth=0):
+    self.url = url
+    self.thumbnail_link = thumbnail_link
+    self.channel = channel
+    self.depth = depth
+    self.attempts = 0
+
+def bfs_priority(entry, frontier):
+  """Shallowest videos first."""
+  return (entry.depth,)
+
+def channel_fair_priority(entry, frontier):
+  """Videos from the channels that have been scraped the least first, then by depth."""
+  return (frontier.channel_scrapes[entry.channel], entry.depth)
+
+def novelty_priority(entry, frontier):
+  """Videos from channels that have been discovered the least first, then by depth."""
+  return (frontier.channel_discoveries[entry.channel], entry.depth)
+
+PRIORITIES = {
+  'bfs': bfs_priority,
+  'channel_fair': channel_fair_priority,
+  'novelty': novelty_priority
+}
+
+
+class CrawlFrontier():
+  """
+  Prioritized, deduplicated queue of video links shared by all scraper threads.
+
+  Every link found on a search or watch page is pushed instead of just one
+  randomly clicked link, and workers pop the best unseen link and navigate to
+  it directly. `priority` is one of `PRIORITIES` or a callable that maps
+  `(entry, frontier)` to a sortable tuple. Priorities that depend on crawl
+  progress are re-evaluated lazily when an entry reaches the top of the queue.
+  """
+  def __init__(self, priority='bfs', seen_index=None, max_size=MAX_FRONTIER_SIZE, max_attempts=MAX_ATTEMPTS):
+    self.priority = PRIORITIES[priority] if isinstance(priority, str) else priority
+    self.seen_index = seen_index
+    self.max_size = max_size
+    self.max_attempts = max_attempts
+    self.n_failed = 0
+
+    self.channel_scrapes = defaultdict(int)
+    self.channel_discoveries = defaultdict(int)
+    self._heap = []
+    self._queued = set()
+    self._counter = itertools.count()
+    self._lock = threading.Lock()
+    self._not_empty = threading.Condition(self._lock)
+
+  def __len__(self):
+    return len(self._heap)
+
+  def _is_seen(self, url):
+    return self.seen_index is not None and self.seen_index.contains(VIDEO, url)
+
+  def push(self, url, thumbnail_link=None, channel=None, depth=0):
+    """Queues a link unless it was queued or scraped before. Returns True if it was queued."""
+    key = canonical_video_id(url)
+    with self._lock:
+      if key in self._queued or len(self._heap) >= self.max_size:
+        return False
+      if self._is_seen(url):
+        return False
+      entry = FrontierEntry(url, thumbnail_link, channel, depth)
+      self._queued.add(key)
+      self.channel_discoveries[channel] += 1
+      heapq.heappush(self._heap, (self.priority(entry, self), next(self._counter), entry))
+      self._not_empty.notify()
+    return True
+
+  def push_many(self, links, depth=0):
+    """Queues dicts with a `video_url` and optional `thumbnail_link` and `channel`."""
+    n_queued = 0
+    for link in links:
+      n_queued += self.push(link['video_url'], link.get('thumbnail_link'),
+                            link.get('channel'), depth)
+    return n_queued
+
+  def pop(self, timeout=None):
+    """Returns the best unseen `FrontierEntry`, or None if none arrives within `timeout`."""
+    with self._not_empty:
+      while True:
+        if not self._heap and not self._not_empty.wait(timeout):
+          return None
+        if not self._heap:
+          continue
+
+        priority, count, entry = heapq.heappop(self._heap)
+        if self._is_seen(entry.url):
+          continue
+
+        # Lazily re-rank entries whose priority changed while they were queued
+        current = self.priority(entry, self)
+        if current != priority and self._heap and current > self._heap[0][0]:
+          heapq.heappush(self._heap, (current, count, entry))
+          continue
+        return entry
+
+  def requeue(self, entry):
+    """
+    Queues an entry whose page failed to load again, behind the entries of the same
+    priority, until it failed `max_attempts` times. Returns True if it was queued.
+    """
+    with self._lock:
+      entry.attempts += 1
+      if entry.attempts >= self.max_attempts:
+        self.n_failed += 1
+        return False
+      heapq.heappush(self._heap, (self.priority(entry, self), next(self._counter), entry))
+      self._not_empty.notify()
+    return True
+
+  def mark_scraped(self, entry):
+    with self._lock:
+      self.channel_scrapes[entry.channel] += 1
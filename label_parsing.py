@@ -0,0 +1,99 @@
+"""
+Batch versions of the YT label parsers in `scraping.py` and `prepare_data.py`.
+
+Every parser factorizes its input so the string work is only done once per
+unique label, then maps the parsed values back onto the full column. Each
+returns the parsed values along with a boolean mask of which labels could be
+parsed.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+NUM_MULTIPLIERS = {'k': 1e3, 'm': 1e6, 'b': 1e9}
+NUM_PATTERN = r'^\s*(\d*\.?\d+)\s*([kmb])?'
+NO_COUNT_PATTERN = r'^\s*no\b'
+
+TIME_UNIT_SECONDS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 60 * 60 * 24,
+    'week': 60 * 60 * 24 * 7,
+    'month': 60 * 60 * 24 * 30,
+    'year': 60 * 60 * 24 * 365,
+}
+TIME_AGO_PATTERN = r'^(\d+) (second|minute|hour|day|week|month|year)s? ago$'
+ABSOLUTE_DATE_FORMAT = '%b %d, %Y'
+
+
+def _factorize(labels):
+    """Returns the codes and unique labels (as a string Series) of a Series or array."""
+    codes, uniques = pd.factorize(np.asarray(labels, dtype=object))
+    return codes, pd.Series(uniques, dtype=object).astype(str)
+
+def _take(unique_values, unique_valid, codes, fill_value):
+    values = unique_values[codes] if len(unique_values) else np.full(len(codes), fill_value)
+    valid = unique_valid[codes] if len(unique_valid) else np.zeros(len(codes), dtype=bool)
+    missing = codes < 0
+    values[missing] = fill_value
+    valid[missing] = False
+    return values, valid
+
+def labels_to_nums(labels):
+    """
+    Converts YT formatted numbers with added text ("1.2M views", "3,401 likes")
+    into an int64 array. Returns (values, valid), where invalid entries are 0.
+    """
+    codes, uniques = _factorize(labels)
+
+    lowered = uniques.str.lower().str.replace(',', '', regex=False)
+    parts = lowered.str.extract(NUM_PATTERN)
+    numbers = parts[0].astype(float)
+    multipliers = parts[1].map(NUM_MULTIPLIERS).fillna(1.0)
+
+    # "No views" and "No likes" are displayed instead of a zero count
+    no_count = lowered.str.contains(NO_COUNT_PATTERN, regex=True)
+    numbers[no_count] = 0.0
+
+    unique_valid = numbers.notna().values
+    unique_values = np.zeros(len(uniques), dtype=np.int64)
+    unique_values[unique_valid] = np.floor(
+        numbers.values[unique_valid] * multipliers.values[unique_valid]).astype(np.int64)
+
+    return _take(unique_values, unique_valid, codes, 0)
+
+def labels_to_datetimes(labels, reference_dates=None):
+    """
+    Converts YT formatted dates into a datetime64[ns] array. Handles absolute dates
+    ("Mar 2, 2021"), relative dates ("2 weeks ago") and prefixed labels such as
+    "Streamed 3 days ago" or "Premiered Mar 2, 2021". Relative dates are resolved
+    against `reference_dates`, which must be aligned with `labels`, and are invalid
+    without it. Returns (values, valid), where invalid entries are NaT.
+    """
+    codes, uniques = _factorize(labels)
+
+    # Like `yt_label_to_datetime`, only the last three words carry the date
+    tail = uniques.str.strip().str.split().str[-3:].str.join(' ')
+
+    relative = tail.str.lower().str.extract(TIME_AGO_PATTERN)
+    unique_offsets = relative[0].astype(float) * relative[1].map(TIME_UNIT_SECONDS)
+    unique_is_relative = unique_offsets.notna().values
+
+    unique_absolute = pd.to_datetime(tail, format=ABSOLUTE_DATE_FORMAT, errors='coerce')
+
+    nat = np.datetime64('NaT', 'ns')
+    values, valid = _take(
+        unique_absolute.values.astype('datetime64[ns]'), unique_absolute.notna().values, codes, nat)
+
+    if reference_dates is not None and unique_is_relative.any():
+        offsets, is_relative = _take(
+            unique_offsets.fillna(0).values, unique_is_relative, codes, 0.0)
+        reference_dates = pd.to_datetime(
+            np.asarray(reference_dates), errors='coerce').values.astype('datetime64[ns]')
+        relative_dates = reference_dates - pd.to_timedelta(offsets, unit='s').values
+        values = np.where(is_relative, relative_dates, values)
+        valid = valid | (is_relative & ~np.isnat(relative_dates))
+
+    return values, valid
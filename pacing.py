@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+
+
+INITIAL_RATE = 2.0
+MIN_RATE = 0.1
+MAX_RATE = 10.0
+BURST = 4.0
+RATE_INCREASE = 0.05
+ERROR_DECREASE = 0.8
+THROTTLE_DECREASE = 0.5
+THROTTLE_COOLDOWN_SECONDS = 30.0
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE_SECONDS, max_delay=BACKOFF_MAX_SECONDS):
+  """Exponential backoff with full jitter for the `attempt`-th retry, starting at 0."""
+  return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+class AdaptiveRateLimiter():
+  """
+  Token bucket that caps the rate of page loads across every scraper thread
+  sharing it, and adapts that rate to how the site responds.
+
+  Each successful page raises the rate by `increase` requests per second, errors
+  multiply it by `error_decrease` and throttling responses (HTTP 429, consent or
+  captcha pages) by `throttle_decrease`, after which the rate stays put for
+  `cooldown` seconds. This keeps the aggregate rate just under what the site
+  tolerates without hand-tuned sleeps. The rate is per process, so processes
+  sharing a connection should split `max_rate` between them.
+  """
+  def __init__(self, rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, burst=BURST,
+               increase=RATE_INCREASE, error_decrease=ERROR_DECREASE,
+               throttle_decrease=THROTTLE_DECREASE, cooldown=THROTTLE_COOLDOWN_SECONDS):
+    self.rate = rate
+    self.min_rate = min_rate
+    self.max_rate = max_rate
+    self.burst = burst
+    self.increase = increase
+    self.error_decrease = error_decrease
+    self.throttle_decrease = throttle_decrease
+    self.cooldown = cooldown
+
+    self._tokens = burst
+    self._last_refill = time.monotonic()
+    self._hold_until = 0.0
+    self._lock = threading.Lock()
+    self.n_requests = 0
+    self.n_errors = 0
+    self.n_throttles = 0
+
+  def _refill(self, now):
+    self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+    self._last_refill = now
+
+  def acquire(self):
+    """Blocks until the next request may be sent."""
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._refill(now)
+        if self._tokens >= 1:
+          self._tokens -= 1
+          self.n_requests += 1
+          return
+        delay = (1 - self._tokens) / self.rate
+      time.sleep(delay)
+
+  def record_success(self):
+    with self._lock:
+      if time.monotonic() >= self._hold_until:
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+  def record_error(self):
+    with self._lock:
+      self.n_errors += 1
+      self.rate = max(self.min_rate, self.rate * self.error_decrease)
+
+  def record_throttle(self):
+    with self._lock:
+      self.n_throttles += 1
+      self.rate = max(self.min_rate, self.rate * self.throttle_decrease)
+      self._hold_until = time.monotonic() + self.cooldown
+      # Drop any saved up burst so the slowdown takes effect immediately
+      self._tokens = min(self._tokens, 0)
@@ -0,0 +1,212 @@
+import json
+import re
+
+
+YT_BASE_URL = 'https://www.youtube.com'
+YT_WATCH_URL_TEMPLATE = YT_BASE_URL + '/watch?v={}'
+YT_THUMBNAIL_URL_TEMPLATE = 'https://i.ytimg.com/vi/{}/hqdefault.jpg'
+YT_BROWSE_API_URL = YT_BASE_URL + '/youtubei/v1/browse'
+DEFAULT_CLIENT_VERSION = '2.20231101.00.00'
+INITIAL_DATA_MARKERS = {
+  name: re.compile(r'(?:var\s+|window\[["\'])?' + name + r'(?:["\']\])?\s*=\s*')
+  for name in ('ytInitialData', 'ytInitialPlayerResponse')
+}
+
+YTCFG_PATTERNS = {
+  'api_key': re.compile(r'"INNERTUBE_API_KEY"\s*:\s*"([^"]+)"'),
+  'client_version': re.compile(r'"INNERTUBE_CLIENT_VERSION"\s*:\s*"([^"]+)"')
+}
+
+_json_decoder = json.JSONDecoder()
+
+
+def extract_initial_json(html, name='ytInitialData'):
+  """Returns the JSON object assigned to `name` in a raw YouTube page, or None."""
+  for match in INITIAL_DATA_MARKERS[name].finditer(html):
+    start = match.end()
+    if html[start:start+1] != '{':
+      continue
+    try:
+      obj, _ = _json_decoder.raw_decode(html, start)
+    except ValueError:
+      continue
+    return obj
+  return None
+
+def extract_ytcfg(html):
+  """Returns the InnerTube `api_key` and `client_version` set in a raw YouTube page, None if missing."""
+  config = {}
+  for name, pattern in YTCFG_PATTERNS.items():
+    match = pattern.search(html)
+    config[name] = match.group(1) if match else None
+  return config
+
+def find_all(obj, key):
+  """Yields every value stored under `key` anywhere in a nested JSON object."""
+  if isinstance(obj, dict):
+    for k, v in obj.items():
+      if k == key:
+        yield v
+      if isinstance(v, (dict, list)):
+        yield from find_all(v, key)
+  elif isinstance(obj, list):
+    for item in obj:
+      yield from find_all(item, key)
+
+def find_first(obj, key, default=None):
+  return next(find_all(obj, key), default)
+
+def get_text(obj):
+  """Returns the display text of a YT text object (`simpleText` or `runs`)."""
+  if obj is None:
+    return None
+  if isinstance(obj, str):
+    return obj
+  if 'simpleText' in obj:
+    return obj['simpleText']
+  if 'runs' in obj:
+    return ''.join(run.get('text', '') for run in obj['runs'])
+  if 'content' in obj:
+    return obj['content']
+  return None
+
+def get_path(obj, *keys, default=None):
+  for key in keys:
+    try:
+      obj = obj[key]
+    except (KeyError, IndexError, TypeError):
+      return default
+  return obj
+
+def best_thumbnail_url(renderer):
+  thumbnails = get_path(renderer, 'thumbnail', 'thumbnails', default=[])
+  if not thumbnails:
+    return None
+  return thumbnails[-1].get('url')
+
+def _absolute_url(url):
+  if url is None or url.startswith('http'):
+    return url
+  return YT_BASE_URL + url
+
+def _channel_url(owner):
+  browse = get_path(owner, 'navigationEndpoint', 'browseEndpoint', default={})
+  if browse.get('canonicalBaseUrl'):
+    return _absolute_url(browse['canonicalBaseUrl'])
+  if browse.get('browseId'):
+    return _absolute_url('/channel/' + browse['browseId'])
+  return None
+
+def _video_links(renderers):
+  videos = []
+  for renderer in renderers:
+    video_id = renderer.get('videoId') if isinstance(renderer, dict) else None
+    if video_id is None:
+      continue
+    byline = renderer.get('shortBylineText') or renderer.get('longBylineText') or renderer.get('ownerText')
+    videos.append({
+      'video_url': YT_WATCH_URL_TEMPLATE.format(video_id),
+      'thumbnail_link': best_thumbnail_url(renderer) or YT_THUMBNAIL_URL_TEMPLATE.format(video_id),
+      'channel': get_text(byline)
+    })
+  return videos
+
+def parse_search_page(initial_data):
+  """Returns the video links listed in the `ytInitialData` of a search results page."""
+  return _video_links(find_all(initial_data, 'videoRenderer'))
+
+def parse_suggested_videos(initial_data):
+  """Returns the video links listed in the related bar of a watch page."""
+  secondary = find_first(initial_data, 'secondaryResults', {})
+  renderers = list(find_all(secondary, 'compactVideoRenderer'))
+  # Newer layouts wrap related videos in lockup view models
+  for lockup in find_all(secondary, 'lockupViewModel'):
+    if lockup.get('contentType', 'LOCKUP_CONTENT_TYPE_VIDEO') == 'LOCKUP_CONTENT_TYPE_VIDEO':
+      renderers.append({
+        'videoId': lockup.get('contentId'),
+        'thumbnail': {'thumbnails': find_first(lockup, 'sources', [])}
+      })
+  return _video_links(renderers)
+
+def parse_watch_page(initial_data, player_response):
+  """
+  Returns the raw text labels of a watch page, keyed like the output of
+  `YouTubeScraper.scrape_vid_data`. Values are left as the strings YouTube displays so that the caller can
+  convert them the same way it converts DOM text.
+  """
+  initial_data = initial_data or {}
+  player_response = player_response or {}
+  primary = find_first(initial_data, 'videoPrimaryInfoRenderer', {})
+  secondary = find_first(initial_data, 'videoSecondaryInfoRenderer', {})
+  owner = find_first(secondary, 'videoOwnerRenderer', {})
+  details = player_response.get('videoDetails', {})
+  microformat = get_path(player_response, 'microformat', 'playerMicroformatRenderer', default={})
+
+  view_renderer = find_first(primary, 'videoViewCountRenderer', {})
+  view_count = get_text(view_renderer.get('viewCount'))
+  if view_count is None and details.get('viewCount') is not None:
+    view_count = details['viewCount'] + ' views'
+
+  likes = None
+  for label in find_all(primary, 'label'):
+    if isinstance(label, str) and ' likes' in label.lower():
+      likes = label
+      break
+
+  description = get_text(get_path(secondary, 'attributedDescription'))
+  if description is None:
+    description = get_text(get_path(secondary, 'description'))
+  if description is None:
+    description = details.get('shortDescription')
+
+  return {
+    'view_count': view_count,
+    'date': get_text(primary.get('dateText')) or microformat.get('publishDate'),
+    'video_title': get_text(primary.get('title')) or details.get('title'),
+    'video_description': description,
+    'channel_name': get_text(owner.get('title')) or details.get('author'),
+    'channel_link': _channel_url(owner) or _absolute_url(microformat.get('ownerProfileUrl')),
+    'subscriber_count': get_text(owner.get('subscriberCountText')),
+    'likes': likes
+  }
+
+def parse_channel_video_tiles(data):
+  """
+  Returns a dict of `video_id`, `title`, `upload_date` and `view_count` labels for each video
+  on a channel /videos page or in a browse continuation response, newest first.
+  """
+  tiles = []
+  for key in ('gridVideoRenderer', 'videoRenderer'):
+    for renderer in find_all(data, key):
+      if 'videoId' not in renderer:
+        continue
+      tiles.append({
+        'video_id': renderer['videoId'],
+        'title': get_text(renderer.get('title')),
+        'upload_date': get_text(renderer.get('publishedTimeText')),
+        'view_count': get_text(renderer.get('viewCountText'))
+      })
+  return tiles
+
+def parse_channel_videos_page(initial_data):
+  """Returns (titles, upload_dates, view_counts) labels for each video on a channel /videos page."""
+  tiles = parse_channel_video_tiles(initial_data)
+  titles = [tile['title'] for tile in tiles]
+  upload_dates = [tile['upload_date'] for tile in tiles]
+  view_counts = [tile['view_count'] for tile in tiles]
+  return titles, upload_dates, view_counts
+
+def find_continuation_token(data):
+  """Returns the token that loads the next batch of a paged list, or None on the last batch."""
+  for renderer in find_all(data, 'continuationItemRenderer'):
+    token = get_path(renderer, 'continuationEndpoint', 'continuationCommand', 'token')
+    if token is not None:
+      return token
+  return None
+
+def browse_continuation_request(token, client_version):
+  """Returns the JSON body of an InnerTube browse request for the batch behind `token`."""
+  return {
+    'context': {'client': {'clientName': 'WEB', 'clientVersion': client_version, 'hl': 'en'}},
+    'continuation': token
+  }
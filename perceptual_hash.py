@@ -0,0 +1,178 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import thumbnail_packing
+
+
+HASH_SIZE = 8
+DEFAULT_MAX_DISTANCE = 3
+# Number of set bits of every byte value
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Groups near-identical thumbnails by perceptual hash.')
+    parser.add_argument('-t', '--thumbnail_dir', type=str, default='thumbnails',
+                        help='Directory of thumbnails to hash')
+    parser.add_argument('-o', '--output_file', type=str, default='data/thumbnail_groups.csv',
+                        help='CSV file to write the group of every thumbnail to')
+    parser.add_argument('-d', '--max_distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help='Most bits two hashes may differ by to be grouped')
+    parser.add_argument('-n', '--n_workers', type=int, default=os.cpu_count(),
+                        help='Number of processes that hash thumbnails')
+
+    return parser.parse_args()
+
+def dhash_image(img, hash_size=HASH_SIZE):
+    """
+    Returns the difference hash of a PIL image as an int: the image is shrunk to
+    (hash_size + 1) x hash_size grayscale pixels and each bit says whether a pixel is
+    brighter than its left neighbor. Re-encoding, resizing and small edits flip few bits.
+    """
+    img.draft('L', (hash_size * 4, hash_size * 4))
+    pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+def dhash_file(path):
+    """Returns the difference hash of an image file, or None if it can't be decoded."""
+    try:
+        with Image.open(path) as img:
+            return dhash_image(img)
+    except (OSError, ValueError) as e:
+        print(f'Could not hash "{path}": {e}')
+        return None
+
+def _dhash_packed_rows(args):
+    shard_path, rows = args
+    shard = np.load(shard_path, mmap_mode='r')
+    return [dhash_image(Image.fromarray(np.asarray(shard[row]))) for row in rows]
+
+def _to_array(hashes):
+    valid = np.array([h is not None for h in hashes], dtype=bool)
+    return np.array([h if h is not None else 0 for h in hashes], dtype=np.uint64), valid
+
+def hash_thumbnail_files(paths, n_workers=None):
+    """Hashes image files in a process pool, returns (uint64 hashes, mask of decodable files)."""
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return _to_array(list(executor.map(dhash_file, paths, chunksize=256)))
+
+def hash_packed_thumbnails(packed_dir, n_workers=None, rows_per_task=2048):
+    """Hashes the thumbnails of a `thumbnail_packing` directory in its index order, like `hash_thumbnail_files`."""
+    _, names, _, shards, rows = thumbnail_packing.load_index(packed_dir)
+    tasks = []
+    for start in range(0, len(names), rows_per_task):
+        for shard_idx in np.unique(shards[start:start + rows_per_task]):
+            task_rows = rows[start:start + rows_per_task][shards[start:start + rows_per_task] == shard_idx]
+            shard_path = os.path.join(packed_dir, thumbnail_packing.SHARD_NAME_TEMPLATE.format(shard_idx))
+            tasks.append((shard_path, task_rows))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        hashes = [h for task_hashes in executor.map(_dhash_packed_rows, tasks) for h in task_hashes]
+    return _to_array(hashes)
+
+def hamming_distances(a, b):
+    """Number of differing bits between two aligned uint64 arrays."""
+    xor = np.ascontiguousarray(np.bitwise_xor(a, b), dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    return POPCOUNT_TABLE[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def _candidate_pairs(hashes, max_distance):
+    """
+    Returns index pairs of hashes within `max_distance` bits. The 64 bits are split into
+    max_distance + 1 bands, and two hashes that close must be equal in at least one band,
+    so only hashes that share a band value are compared.
+    """
+    n_bands = min(max_distance + 1, 64)
+    boundaries = np.linspace(0, 64, n_bands + 1).astype(np.uint64)
+    pairs_a, pairs_b = [], []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        mask = np.uint64((1 << int(end - start)) - 1)
+        bands = (hashes >> start) & mask
+        order = np.argsort(bands, kind='stable')
+        sorted_bands = bands[order]
+
+        # Members of a bucket are adjacent once sorted, compare each with the ones `shift` later
+        bucket_starts = np.flatnonzero(np.r_[True, sorted_bands[1:] != sorted_bands[:-1]])
+        bucket_sizes = np.diff(np.r_[bucket_starts, len(order)])
+        bucket_ends = np.repeat(bucket_starts + bucket_sizes, bucket_sizes)
+        n_later = bucket_ends - np.arange(len(order)) - 1
+        active = np.flatnonzero(n_later > 0)
+        shift = 1
+        while len(active) > 0:
+            a, b = order[active], order[active + shift]
+            close = hamming_distances(hashes[a], hashes[b]) <= max_distance
+            pairs_a.append(a[close])
+            pairs_b.append(b[close])
+            shift += 1
+            active = active[n_later[active] >= shift]
+    if not pairs_a:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(pairs_a), np.concatenate(pairs_b)
+
+def _connected_components(n, a, b):
+    """Returns the smallest member index of the component of each of `n` nodes joined by edges (a, b)."""
+    labels = np.arange(n)
+    while True:
+        new_labels = labels.copy()
+        edge_labels = np.minimum(labels[a], labels[b])
+        np.minimum.at(new_labels, a, edge_labels)
+        np.minimum.at(new_labels, b, edge_labels)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+def group_near_duplicates(hashes, max_distance=DEFAULT_MAX_DISTANCE, valid=None):
+    """
+    Groups hashes that are within `max_distance` bits of each other, directly or through
+    other members of the group. Returns, for every hash, the index of the first member of
+    its group. Hashes masked out by `valid` each get a group of their own.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    valid = np.ones(len(hashes), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+    groups = np.arange(len(hashes))
+    valid_idxs = np.flatnonzero(valid)
+    if len(valid_idxs) == 0:
+        return groups
+
+    # Identical hashes are grouped by value, only distinct hashes are compared
+    unique_hashes, inverse = np.unique(hashes[valid_idxs], return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if max_distance > 0:
+        components = _connected_components(len(unique_hashes), *_candidate_pairs(unique_hashes, max_distance))
+    else:
+        components = np.arange(len(unique_hashes))
+
+    first_members = np.full(len(unique_hashes), len(hashes), dtype=np.int64)
+    np.minimum.at(first_members, components[inverse], valid_idxs)
+    groups[valid_idxs] = first_members[components[inverse]]
+    return groups
+
+def save_groups(path, feature_ids, groups, hashes):
+    """Writes the group of every thumbnail as (feature_id, group_feature_id, dhash) rows."""
+    feature_ids = np.asarray(feature_ids)
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    pd.DataFrame({
+        'feature_id': feature_ids,
+        'group_feature_id': feature_ids[groups],
+        'dhash': [f'{int(h):016x}' for h in hashes]
+    }).to_csv(path, index=False)
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    img_names = sorted(name for name in os.listdir(args.thumbnail_dir) if name.endswith('.jpg'))
+    hashes, valid = hash_thumbnail_files(
+        [os.path.join(args.thumbnail_dir, name) for name in img_names], args.n_workers)
+    groups = group_near_duplicates(hashes, args.max_distance, valid)
+    feature_ids = [int(name.split('.')[0]) for name in img_names]
+    save_groups(args.output_file, feature_ids, groups, hashes)
+    print(f'{len(np.unique(groups))} groups among {len(img_names)} thumbnails')
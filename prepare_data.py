@@ -1,39 +1,86 @@
 import argparse
-import pickle
+import os
 
 import numpy as np
 import pandas as pd
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import Subset
 import tqdm
 
 from datetime import datetime, timedelta
-from data_handling import ImageDataset, img_transform
-from models import ImageFeatureExtractor
+from channel_data import read_channel_videos, write_channel_videos
+from data_handling import ImageDataset, PackedImageDataset, img_transform, packed_img_transform
+from data_store import iter_table
+from embedding_cache import EmbeddingCache, hash_files, model_fingerprint
+from embedding_store import DTYPES, EmbeddingStore
+from feature_extraction import PRECISIONS, FeatureExtractionEngine
+from label_parsing import labels_to_datetimes
+from perceptual_hash import group_near_duplicates, hash_packed_thumbnails, hash_thumbnail_files, save_groups
 
 
-DEVICE = 'cuda:0'
-
+OUTPUT_FORMATS = ('csv', 'parquet')
+# Declared up front so chunks are parsed the same way and counts don't become floats or objects
+VIDEO_DTYPES = {
+    'video_url': 'str',
+    'video_title': 'str',
+    'video_description': 'str',
+    'thumbnail_link': 'str',
+    'date': 'str',
+    'scrape_date': 'str',
+    'channel_name': 'category',
+    'channel_link': 'category',
+    'view_count': 'Int64',
+    'subscriber_count': 'Int64',
+    'likes': 'Int64',
+}
+COUNT_COLUMNS = ['view_count', 'subscriber_count', 'likes']
+DEDUPE_COLUMNS = ['video_url', 'video_title']
 
 def parse_args():
   parser = argparse.ArgumentParser(description='Prepares scraped data for use.')
-  parser.add_argument('-v', '--video_data_file', type=str, default='data/yt_video_data.csv',
-                      help='File to that contains video data')
-  parser.add_argument('-c', '--channel_data_file', type=str, default='data/yt_channel_data.csv',
-                      help='File to that contains channel data')
-  parser.add_argument('-o', '--output_file', type=str, default='data/full_data.csv',
-                      help='File to write full data to')
-  parser.add_argument('-ot', '--output_thumbnail_features', type=str, default='data/thumbnail_features.pkl',
-                      help='Where to write the thumbnail features to')
-
-  return parser.parse_args()
-
-channel_column_changes = {
-    'title': 'vid_page_titles',
-    'upload_date': 'vid_page_upload_date',
-    'view_count': 'vid_page_views',
-    'scrape_date': 'channel_scrape_date',
-}
+  parser.add_argument('-v', '--video_data_file', type=str, default='data/yt_video_data',
+                      help='File or dataset directory that contains video data')
+  parser.add_argument('-c', '--channel_data_file', type=str, default='data/yt_channel_data',
+                      help='File or dataset directory that contains channel data')
+  parser.add_argument('-o', '--output_file', type=str, default=None,
+                      help='File to write full data to, defaults to data/full_data.csv or .parquet')
+  parser.add_argument('-f', '--output_format', '--output-format', type=str, default='csv', choices=OUTPUT_FORMATS,
+                      help='Format of the full data file, parquet requires pyarrow')
+  parser.add_argument('--chunksize', type=int, default=100000,
+                      help='Video rows to process at a time, bounds memory use regardless of the input size')
+  parser.add_argument('-oc', '--output_channel_videos', type=str, default='data/channel_videos.parquet',
+                      help='File to write one row per channel video to, Parquet unless it ends with .csv')
+  parser.add_argument('-ot', '--output_thumbnail_features', type=str, default='data/thumbnail_features',
+                      help='Embedding store directory to write the thumbnail features to')
+  parser.add_argument('--feature_dtype', type=str, default='float32', choices=DTYPES,
+                      help='Precision the thumbnail features are stored in')
+  parser.add_argument('-d', '--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu',
+                      help='Device to extract thumbnail features on')
+  parser.add_argument('-p', '--precision', type=str, default='fp32', choices=PRECISIONS,
+                      help='Precision of the feature extractor, see feature_extraction.py for the tradeoffs')
+  parser.add_argument('-b', '--batch_size', type=int, default=64,
+                      help='Thumbnails per forward pass')
+  parser.add_argument('--n_threads', type=int, default=None,
+                      help='Intra-op threads used by torch, defaults to the number of cores')
+  parser.add_argument('--n_workers', type=int, default=4,
+                      help='Processes that decode thumbnails while features are extracted')
+  parser.add_argument('--packed_thumbnails', type=str, default=None,
+                      help='Read thumbnails from shards written by thumbnail_packing.py instead of thumbnails/')
+  parser.add_argument('--feature_cache', type=str, default='data/embedding_cache.sqlite',
+                      help='Cache of thumbnail features keyed by image content, "" to disable')
+  parser.add_argument('--dedup_distance', type=int, default=3,
+                      help='Extract features once per group of thumbnails whose perceptual hashes differ by '
+                           'at most this many bits, -1 to extract every thumbnail')
+  parser.add_argument('--thumbnail_groups', type=str, default='data/thumbnail_groups.csv',
+                      help='File to write the group of every thumbnail to when deduplicating')
+  parser.add_argument('--compact_cache', action='store_true',
+                      help='Drop cached features of other models and of thumbnails that no longer exist')
+
+  args = parser.parse_args()
+  if args.output_file is None:
+    args.output_file = 'data/full_data.' + args.output_format
+
+  return args
 
 def yt_label_to_datetime(label, reference_date=None):
     """Converts YT formatted date strings into datetime objects."""
@@ -67,74 +114,173 @@ def yt_label_to_datetime(label, reference_date=None):
 
 def format_dates(df, column_name, ref_column_name=None):
     # Dates should be a series
-    drop_idxs = df[column_name].apply(lambda x: 'stream' in x.lower())
-    df = df[~drop_idxs]
-    drop_idxs = df[column_name].apply(lambda x: 'premiere' in x.lower())
+    drop_idxs = df[column_name].astype(str).str.contains('stream|premiere', case=False, regex=True)
     df = df[~drop_idxs]
 
-    if ref_column_name is not None:
-        lambda_func = lambda x: yt_label_to_datetime(x[column_name], x[ref_column_name])
-        df[column_name] = df.apply(lambda_func, axis=1)
-    else:
-        lambda_func = lambda x: yt_label_to_datetime(x)
-        df[column_name] = df[column_name].apply(lambda_func)
-    return df
+    reference_dates = None if ref_column_name is None else df[ref_column_name]
+    dates, valid = labels_to_datetimes(df[column_name], reference_dates)
+    df = df.assign(**{column_name: dates})
+    return df[valid]
+
+
+def build_channel_table(channel_videos):
+    """Returns the scrape date of every channel, hash indexed by (channel_name, channel_link)."""
+    channel_table = channel_videos.groupby(['channel_name', 'channel_link'], observed=True)['scrape_date'].max()
+    return channel_table.rename('channel_scrape_date')
+
+def drop_seen_keys(df, seen_hashes):
+    """
+    Drops rows whose `DEDUPE_COLUMNS` repeat within `df` or were seen in an earlier chunk.
+    Keys are kept as a sorted array of 64 bit hashes, returns (df, seen_hashes).
+    """
+    hashes = pd.util.hash_pandas_object(df[DEDUPE_COLUMNS], index=False).values
+    positions = np.minimum(np.searchsorted(seen_hashes, hashes), max(len(seen_hashes) - 1, 0))
+    seen = seen_hashes[positions] == hashes if len(seen_hashes) else np.zeros(len(df), dtype=bool)
+    keep = ~pd.Series(hashes).duplicated().values & ~seen
+    return df[keep], np.union1d(seen_hashes, hashes[keep])
+
+def prepare_video_chunk(chunk, offset, channel_table, seen_hashes):
+    """
+    Joins a chunk of video rows whose first row is row `offset` of the video data with
+    the channel table, then drops incomplete and duplicate rows and parses the dates.
+    Returns (prepared chunk, positions of the chunk's channels in the table, seen_hashes).
+    """
+    chunk = chunk.reset_index(drop=True)
+    # Thumbnails and their features are named by the row number in the video data
+    chunk.insert(0, 'feature_id', np.arange(offset, offset + len(chunk)))
+
+    channel_keys = pd.MultiIndex.from_arrays([chunk['channel_name'], chunk['channel_link']])
+    positions = channel_table.index.get_indexer(channel_keys)
+    chunk['channel_scrape_date'] = channel_table.values[positions]
+    chunk = chunk[positions >= 0]
+
+    # Drop NA rows and remove duplicate entries
+    chunk = chunk.dropna()
+    chunk, seen_hashes = drop_seen_keys(chunk, seen_hashes)
+
+    # Format dates
+    chunk = format_dates(chunk, 'scrape_date')
+    chunk = format_dates(chunk, 'date', 'scrape_date')
+    chunk = chunk.assign(time_up=(chunk['scrape_date'] - chunk['date']).dt.total_seconds())
+
+    # Every channel of the output is in the table, so all chunks share one categorical dtype
+    chunk = chunk.astype({column: np.int64 for column in COUNT_COLUMNS if column in chunk.columns})
+    for column in ('channel_name', 'channel_link'):
+        categories = channel_table.index.unique(level=column)
+        chunk[column] = pd.Categorical(chunk[column].astype(str), categories=categories)
+    return chunk, channel_table.index.get_indexer(channel_keys[chunk.index]), seen_hashes
 
+class ChunkWriter():
+    """Appends chunks of rows with the same columns to a CSV or Parquet file."""
+    def __init__(self, path, output_format='csv'):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'Unknown output format "{output_format}", expected one of {OUTPUT_FORMATS}.')
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self.path = path
+        self.output_format = output_format
+        self.n_rows = 0
+        self._n_chunks = 0
+        self._parquet_writer = None
 
+    def write(self, df):
+        if self.output_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='a' if self._n_chunks else 'w', header=self._n_chunks == 0, index=False)
+        self.n_rows += len(df)
+        self._n_chunks += 1
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
 
 if __name__ == '__main__':
     args = parse_args()
 
-    # Load the data
-    video_df = pd.read_csv('data/yt_video_data.csv', index_col=0)
-    channel_df = pd.read_csv('data/yt_channel_data.csv', index_col=0)
-
-    thumbnail_dataset = ImageDataset(root_dir='thumbnails', transform=img_transform)
-    thumbnail_loader = DataLoader(thumbnail_dataset, batch_size=64, shuffle=False)
+    if args.packed_thumbnails:
+        thumbnail_dataset = PackedImageDataset(args.packed_thumbnails, transform=packed_img_transform)
+    else:
+        thumbnail_dataset = ImageDataset(root_dir='thumbnails', transform=img_transform)
+    engine = FeatureExtractionEngine(
+        precision=args.precision, device=args.device, n_threads=args.n_threads,
+        n_workers=args.n_workers, batch_size=args.batch_size)
 
-    feature_extractor = ImageFeatureExtractor().to(DEVICE)
+    # Near-identical thumbnails (reuploads, templates, placeholders) share the features of one member
+    thumbnail_feature_idxs = [int(img_name.split('.')[0]) for img_name in thumbnail_dataset.img_names]
+    if args.dedup_distance >= 0:
+        print('Hashing thumbnails...')
+        if args.packed_thumbnails:
+            phashes, decodable = hash_packed_thumbnails(args.packed_thumbnails)
+        else:
+            phashes, decodable = hash_thumbnail_files(
+                [os.path.join(thumbnail_dataset.root_dir, img_name) for img_name in thumbnail_dataset.img_names])
+        groups = group_near_duplicates(phashes, args.dedup_distance, decodable)
+        save_groups(args.thumbnail_groups, thumbnail_feature_idxs, groups, phashes)
+    else:
+        groups = np.arange(len(thumbnail_dataset))
+    group_idxs, group_of_thumbnail = np.unique(groups, return_inverse=True)
+    group_dataset = Subset(thumbnail_dataset, group_idxs)
+    print('Extracting features for {} groups of {} thumbnails'.format(len(group_idxs), len(thumbnail_dataset)))
 
     # Generate features for the thumbnails
-    thumbnail_feature_idxs = []
-    thumbnail_features = []
     print('Generating thumbnail features...')
-    for img_names, imgs in tqdm.tqdm(thumbnail_loader):
-        imgs = imgs.to(DEVICE)
-        with torch.no_grad():
-            features = feature_extractor(imgs)
-        features = features.cpu().numpy()
-        thumbnail_features.append(features)
-        feature_idxs = [int(img_name.split('.')[0]) for img_name in img_names]
-        thumbnail_feature_idxs.extend(feature_idxs)
-    thumbnail_features = np.concatenate(thumbnail_features, axis=0)
-            
-    # Save the thumbnail features as a pickle
-    print('Saving thumbnail features')
-    with open(args.output_thumbnail_features, 'wb') as f:
-        pickle.dump((thumbnail_feature_idxs, thumbnail_features), f)
+    if args.feature_cache:
+        if args.packed_thumbnails:
+            content_hashes = thumbnail_dataset.content_hashes
+        else:
+            content_hashes = hash_files(
+                [os.path.join(thumbnail_dataset.root_dir, img_name) for img_name in thumbnail_dataset.img_names])
+        fingerprint = model_fingerprint(engine.model, thumbnail_dataset.transform, args.precision)
+        cache = EmbeddingCache(args.feature_cache, fingerprint)
+        group_features = engine.extract_cached(
+            group_dataset, cache, [content_hashes[i] for i in group_idxs], progress=tqdm.tqdm)
+        if args.compact_cache:
+            cache.invalidate()
+            cache.compact(content_hashes)
+        cache.close()
+    else:
+        _, group_features = engine.extract(group_dataset, progress=tqdm.tqdm)
+    thumbnail_features = group_features[group_of_thumbnail.reshape(-1)]
 
-    # Change channel df column names to not overlap with the video df
-    for old_name, new_name in channel_column_changes.items():
-        channel_df[new_name] = channel_df[old_name]
-        channel_df.drop(old_name, axis=1, inplace=True)
+    # Save the thumbnail features as a memory-mapped store keyed by feature ID
+    print('Saving thumbnail features')
+    EmbeddingStore.create(args.output_thumbnail_features, thumbnail_feature_idxs,
+                          thumbnail_features, dtype=args.feature_dtype)
 
-    # Merge the two dataframes
-    full_df = pd.merge(video_df, channel_df, how='left', on=['channel_name', 'channel_link'])
+    # Channel videos are kept in their own long table, only the scrape date goes into the video rows.
+    # Relative upload dates are resolved against when their channel page was scraped.
+    channel_videos = read_channel_videos(args.channel_data_file)
+    channel_videos = channel_videos.astype({'channel_name': 'category', 'channel_link': 'category'})
+    channel_videos = format_dates(channel_videos, 'scrape_date')
+    channel_videos = format_dates(channel_videos, 'upload_date', 'scrape_date')
+    channel_videos = channel_videos.dropna(subset=['view_count'])
+    channel_videos = channel_videos.astype({'view_count': np.int64})
+    channel_table = build_channel_table(channel_videos)
 
-    # Drop NA rows and remove duplicate entries
-    full_df = full_df.dropna()
-    full_df = full_df.drop_duplicates(subset=['video_url', 'video_title'])
+    # Join, clean and write the video data one chunk at a time
+    print('Preparing video data in chunks of {} rows'.format(args.chunksize))
+    writer = ChunkWriter(args.output_file, args.output_format)
+    seen_hashes = np.zeros(0, dtype=np.uint64)
+    used_channels = np.zeros(len(channel_table), dtype=bool)
+    offset = 0
+    for chunk in tqdm.tqdm(iter_table(args.video_data_file, args.chunksize, VIDEO_DTYPES, compact=True)):
+        n_rows = len(chunk)
+        chunk, positions, seen_hashes = prepare_video_chunk(chunk, offset, channel_table, seen_hashes)
+        used_channels[positions] = True
+        writer.write(chunk)
+        offset += n_rows
+    writer.close()
+    print('Saved {} total entries to {}'.format(writer.n_rows, args.output_file))
 
-    # Format dates
-    full_df = format_dates(full_df, 'scrape_date')
-    full_df = format_dates(full_df, 'channel_scrape_date')
-    full_df = format_dates(full_df, 'date', 'scrape_date')
-    full_df['time_up'] = full_df['scrape_date'] - full_df['date']
-    full_df['time_up'] = full_df['time_up'].apply(lambda x: x.total_seconds())
-    
-    full_df.reset_index(inplace=True)
-    full_df = full_df.rename(columns={'index': 'feature_id'})
-
-    # Save the data
-    print('Saving {} total entries to {}'.format(len(full_df), args.output_file))
-    full_df.to_csv(args.output_file, index=False)
\ No newline at end of file
+    used_links = channel_table.index.get_level_values('channel_link')[used_channels]
+    channel_videos = channel_videos[channel_videos['channel_link'].isin(used_links)]
+    print('Saving {} channel videos to {}'.format(len(channel_videos), args.output_channel_videos))
+    write_channel_videos(channel_videos.reset_index(drop=True), args.output_channel_videos)
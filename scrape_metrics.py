@@ -0,0 +1,212 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+
+METRIC_PREFIX = 'yt_scraper'
+
+
+class _Timer():
+  def __init__(self, worker, stage):
+    self.worker = worker
+    self.stage = stage
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.worker.add_time(self.stage, time.perf_counter() - self.start)
+    return False
+
+class _NullTimer():
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+class WorkerMetrics():
+  """
+  Time spent per stage and event counts of one scraper. Each scraper has its own, so
+  the lock is only ever contended by a reader taking a snapshot.
+  """
+  def __init__(self, name):
+    self.name = name
+    self._timers = {}
+    self._counters = {}
+    self._lock = threading.Lock()
+
+  def time(self, stage):
+    """Context manager that adds the time spent in its block to `stage`."""
+    return _Timer(self, stage)
+
+  def add_time(self, stage, seconds):
+    with self._lock:
+      calls, total, longest = self._timers.get(stage, (0, 0.0, 0.0))
+      self._timers[stage] = (calls + 1, total + seconds, max(longest, seconds))
+
+  def count(self, counter, n=1):
+    with self._lock:
+      self._counters[counter] = self._counters.get(counter, 0) + n
+
+  def snapshot(self):
+    """Returns {'timers': {stage: {'calls', 'seconds', 'max_seconds'}}, 'counters': {counter: n}}."""
+    with self._lock:
+      timers = dict(self._timers)
+      counters = dict(self._counters)
+    return {
+      'timers': {stage: {'calls': calls, 'seconds': total, 'max_seconds': longest}
+                 for stage, (calls, total, longest) in timers.items()},
+      'counters': counters
+    }
+
+class NullWorkerMetrics():
+  """Stand-in used when metrics are disabled, every call is a no-op."""
+  name = None
+  _timer = _NullTimer()
+
+  def time(self, stage):
+    return self._timer
+
+  def add_time(self, stage, seconds):
+    pass
+
+  def count(self, counter, n=1):
+    pass
+
+  def snapshot(self):
+    return {'timers': {}, 'counters': {}}
+
+NULL_METRICS = NullWorkerMetrics()
+
+
+class ScrapeMetrics():
+  """
+  Registry of the metrics of every scraper in a process. Pass one to `YTSManager` (or
+  to scrapers directly) to enable timing, read it with `stats`, or export it in the
+  Prometheus text format with `to_prometheus` or the HTTP endpoint of `serve`.
+  Gauges and counters are callables registered with `gauge` and `counter` and read at
+  export time, counters return totals that only ever grow.
+
+  Scrapers time the stages `pace` (rate limiter sleeps), `navigate`, `wait`, `extract`
+  and `retry` (backoff sleeps), and count `pages`, `failed_pages`, `duplicates`,
+  `timeouts`, `stale_elements`, `retries`, `dead_ends` and `driver_restarts`. The manager times
+  `flush` and counts `worker_restarts`.
+  """
+  def __init__(self):
+    self._workers = {}
+    self._gauges = {}
+    self._counters = {}
+    self._lock = threading.Lock()
+    self._server = None
+    self.start_time = time.time()
+
+  def worker(self, prefix='scraper'):
+    """Returns the metrics of a new worker, named `prefix` plus a number."""
+    with self._lock:
+      name = f'{prefix}-{len(self._workers)}'
+      self._workers[name] = WorkerMetrics(name)
+      return self._workers[name]
+
+  def gauge(self, name, func):
+    """Registers `func`, which returns a number, to be exported as the gauge `name`."""
+    with self._lock:
+      self._gauges[name] = func
+
+  def counter(self, name, func):
+    """Registers `func`, which returns a running total, to be exported as the counter `name`_total."""
+    with self._lock:
+      self._counters[name] = func
+
+  def stats(self):
+    """
+    Returns a dict with the `workers` snapshots, their `totals` across workers, the
+    current `gauges` and `counters` and the `uptime_seconds` of the registry.
+    """
+    with self._lock:
+      workers = list(self._workers.values())
+      gauges = dict(self._gauges)
+      registered_counters = dict(self._counters)
+
+    snapshots = {worker.name: worker.snapshot() for worker in workers}
+    timers, counters = {}, {}
+    for snapshot in snapshots.values():
+      for stage, timer in snapshot['timers'].items():
+        total = timers.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+        total['calls'] += timer['calls']
+        total['seconds'] += timer['seconds']
+        total['max_seconds'] = max(total['max_seconds'], timer['max_seconds'])
+      for counter, n in snapshot['counters'].items():
+        counters[counter] = counters.get(counter, 0) + n
+
+    return {
+      'uptime_seconds': time.time() - self.start_time,
+      'workers': snapshots,
+      'totals': {'timers': timers, 'counters': counters},
+      'gauges': {name: func() for name, func in gauges.items()},
+      'counters': {name: func() for name, func in registered_counters.items()}
+    }
+
+  def to_prometheus(self):
+    """Returns the metrics in the Prometheus text exposition format, labeled by worker."""
+    stats = self.stats()
+    lines = [
+      f'# HELP {METRIC_PREFIX}_stage_seconds_total Time spent in each scraping stage.',
+      f'# TYPE {METRIC_PREFIX}_stage_seconds_total counter']
+    calls = [
+      f'# HELP {METRIC_PREFIX}_stage_calls_total Number of times each scraping stage ran.',
+      f'# TYPE {METRIC_PREFIX}_stage_calls_total counter']
+    events = [
+      f'# HELP {METRIC_PREFIX}_events_total Number of scraping events of each kind.',
+      f'# TYPE {METRIC_PREFIX}_events_total counter']
+    for name, snapshot in stats['workers'].items():
+      for stage, timer in snapshot['timers'].items():
+        labels = f'{{worker="{name}",stage="{stage}"}}'
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_total{labels} {timer["seconds"]:.6f}')
+        calls.append(f'{METRIC_PREFIX}_stage_calls_total{labels} {timer["calls"]}')
+      for counter, n in snapshot['counters'].items():
+        events.append(f'{METRIC_PREFIX}_events_total{{worker="{name}",event="{counter}"}} {n}')
+
+    lines += calls + events
+    for name, value in stats['counters'].items():
+      lines.append(f'# TYPE {METRIC_PREFIX}_{name}_total counter')
+      lines.append(f'{METRIC_PREFIX}_{name}_total {value}')
+    for name, value in stats['gauges'].items():
+      lines.append(f'# TYPE {METRIC_PREFIX}_{name} gauge')
+      lines.append(f'{METRIC_PREFIX}_{name} {value}')
+    lines.append(f'# TYPE {METRIC_PREFIX}_uptime_seconds gauge')
+    lines.append(f'{METRIC_PREFIX}_uptime_seconds {stats["uptime_seconds"]:.3f}')
+    return '\n'.join(lines) + '\n'
+
+  def serve(self, port, host='127.0.0.1'):
+    """Serves `to_prometheus` at http://host:port/metrics on a background thread."""
+    metrics = self
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+          self.send_error(404)
+          return
+        body = metrics.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+    self._server.daemon_threads = True
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    return self._server
+
+  def close(self):
+    """Stops the HTTP endpoint if it was started."""
+    if self._server is not None:
+      self._server.shutdown()
+      self._server.server_close()
+      self._server = None
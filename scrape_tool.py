@@ -1,32 +1,134 @@
 import os
 import random
-from scraping import YTSManager
+from scraping import BROWSER_PROFILES, SCRAPER_BACKENDS, YTSManager, create_chrome_driver, load_known_channel_videos
+from driver_pool import DriverPool
+from frontier import PRIORITIES, CrawlFrontier
+from pacing import AdaptiveRateLimiter
+from scrape_metrics import ScrapeMetrics
+from data_store import SHARD_FORMATS, ShardedDataset, read_table
+from channel_data import explode_channel_videos
+from seen_index import CHANNEL, SeenIndex
 import argparse
+import functools
 import time
 import pandas as pd
 
 
 # Defines the following arguements:
 #  - search_terms_file: The file containing the search terms to be used
-#  - output_file: The file to write the results to
+#  - output_file: The file or dataset directory to write the results to
+#  - output_format: csv (the default), or a streamed jsonl/parquet dataset
 #  - n_threads: The number of threads to use
+#  - backend: Which scraper backend to use (selenium or html)
+#  - snapshot: Whether selenium scrapers should read pages from a single DOM snapshot
+#  - seen_index: Optional file shared by all scrapers and runs that records already scraped URLs
+#  - driver_pool_size: Number of warm browser sessions shared by the selenium scrapers
+#  - browser_profile: Chrome profile of the selenium scrapers, lean blocks images, media, fonts and ads
+#  - frontier: Crawl every discovered link in this priority order instead of random walks
+#  - max_rate: Optional upper bound on page loads per second across all scrapers, adapted to errors
+#  - channel_history: Scrape each channel's full upload history, only fetching what is new since the last run
+#  - metrics: Time each scraping stage and count retries, timeouts etc., optionally served for Prometheus
 def parse_args():
   parser = argparse.ArgumentParser(description='Scrapes the YTS website for torrents')
   parser.add_argument('-s', '--search_terms_file', type=str, default='start_words.txt',
                       help='File containing search terms')
-  parser.add_argument('-vo', '--video_output_file', type=str, default='data/yt_video_data.csv',
-                      help='File to write video data to')
-  parser.add_argument('-co', '--channel_output_file', type=str, default='data/yt_channel_data.csv',
-                      help='File to write channel data to')
+  parser.add_argument('-vo', '--video_output_file', type=str, default=None,
+                      help='File or dataset directory to write video data to')
+  parser.add_argument('-co', '--channel_output_file', type=str, default=None,
+                      help='File or dataset directory to write channel data to')
+  parser.add_argument('-f', '--output_format', type=str, default='csv',
+                      choices=('csv',) + SHARD_FORMATS,
+                      help='"csv" saves everything on exit, the others stream rows to a dataset directory')
+  parser.add_argument('--compaction_interval', type=int, default=600,
+                      help='Seconds between background deduplication of dataset directories')
   parser.add_argument('-n', '--n_threads', type=int, default=4,
                       help='Number of threads to use')
   parser.add_argument('-v', '--scrape_videos', action='store_true',
                       help='Whether to scrape video data')
   parser.add_argument('-c', '--scrape_channel', action='store_true',
                       help='Whether to scrape channel data')
-  parser.set_defaults(scrape_videos=False, scrape_channel=False)
-
-  return parser.parse_args()
+  parser.add_argument('-b', '--backend', type=str, default='selenium',
+                      choices=list(SCRAPER_BACKENDS),
+                      help='Scraper backend, "html" parses raw pages without a browser')
+  parser.add_argument('--snapshot', action='store_true',
+                      help='Read each page from one DOM snapshot (selenium backend only)')
+  parser.add_argument('--seen_index', type=str, default=None,
+                      help='File that records scraped URLs across threads, processes and runs, '
+                           'e.g. data/seen_urls.sqlite')
+  parser.add_argument('--rescrape_channels', action='store_true',
+                      help='Scrape channels again even if a previous run already scraped them')
+  parser.add_argument('--driver_pool_size', type=int, default=None,
+                      help='Warm browser sessions to keep (defaults to n_threads + 1), 0 to disable the pool')
+  parser.add_argument('--recycle_pages', type=int, default=500,
+                      help='Restart a browser session after it has loaded this many pages')
+  parser.add_argument('--recycle_rss_mb', type=float, default=None,
+                      help='Restart a browser session once it uses this much memory (requires psutil)')
+  parser.add_argument('--browser_profile', type=str, default='default', choices=list(BROWSER_PROFILES),
+                      help='Chrome profile of the selenium backend, lean blocks images, media, fonts and ads')
+  parser.add_argument('--frontier', type=str, default=None, choices=list(PRIORITIES),
+                      help='Queue every discovered video link and crawl them in this priority order')
+  parser.add_argument('--max_rate', type=float, default=0,
+                      help='Most page loads per second across all scrapers, slowed down on errors, 0 for no limit')
+  parser.add_argument('--channel_history', action='store_true',
+                      help='Page through every upload of each channel and only keep new or changed videos')
+  parser.add_argument('-ho', '--history_output_dir', type=str, default='data/yt_channel_videos',
+                      help='Dataset directory with one row per channel video for --channel_history')
+  parser.add_argument('--metrics', action='store_true',
+                      help='Time each scraping stage and count events, printed with the status')
+  parser.add_argument('--metrics_port', type=int, default=None,
+                      help='Serve the metrics in the Prometheus format on this local port, implies --metrics')
+  parser.set_defaults(scrape_videos=False, scrape_channel=False, snapshot=False,
+                      rescrape_channels=False, channel_history=False, metrics=False)
+
+  args = parser.parse_args()
+  if args.channel_history and args.output_format == 'csv':
+    parser.error('--channel_history needs a dataset output format, e.g. -f jsonl')
+  extension = '.csv' if args.output_format == 'csv' else ''
+  if args.video_output_file is None:
+    args.video_output_file = 'data/yt_video_data' + extension
+  if args.channel_output_file is None:
+    args.channel_output_file = 'data/yt_channel_data' + extension
+
+  return args
+
+def open_store(args, path, key, keep):
+  if args.output_format == 'csv':
+    return None
+  store = ShardedDataset(path, key, shard_format=args.output_format, keep=keep)
+  store.start_compaction(args.compaction_interval)
+  return store
+
+def get_scraper_kwargs(args):
+  scraper_kwargs = {}
+  if args.snapshot:
+    if args.backend != 'selenium':
+      raise ValueError('--snapshot is only supported by the selenium backend')
+    scraper_kwargs['snapshot'] = True
+  if args.seen_index:
+    seen_index = SeenIndex(args.seen_index)
+    if args.rescrape_channels:
+      seen_index.clear(CHANNEL)
+    scraper_kwargs['seen_index'] = seen_index
+  if args.max_rate > 0:
+    scraper_kwargs['rate_limiter'] = AdaptiveRateLimiter(
+      rate=args.max_rate / 2, max_rate=args.max_rate)
+  if args.metrics or args.metrics_port is not None:
+    scraper_kwargs['metrics'] = ScrapeMetrics()
+    if args.metrics_port is not None:
+      scraper_kwargs['metrics'].serve(args.metrics_port)
+      print(f'Serving metrics at http://127.0.0.1:{args.metrics_port}/metrics')
+  if args.backend == 'selenium':
+    # One spare session is warm by the time a scraper recycles its own
+    pool_size = args.n_threads + 1 if args.driver_pool_size is None else args.driver_pool_size
+    if pool_size > 0:
+      scraper_kwargs['driver_pool'] = DriverPool(
+        functools.partial(create_chrome_driver, profile=args.browser_profile), size=pool_size,
+        max_pages=args.recycle_pages, max_rss_mb=args.recycle_rss_mb)
+    else:
+      scraper_kwargs['browser_profile'] = args.browser_profile
+  elif args.browser_profile != 'default':
+    raise ValueError('--browser_profile is only supported by the selenium backend')
+  return scraper_kwargs
 
 def load_search_terms(file_path):
   with open(file_path, 'r') as f:
@@ -37,10 +139,16 @@ def load_search_terms(file_path):
 
 if __name__ == '__main__':
   args = parse_args()
+  scraper_kwargs = get_scraper_kwargs(args)
   # Do video searching and scraping
   if args.scrape_videos:
+    video_store = open_store(args, args.video_output_file, 'video_url', keep='first')
+    frontier = None
+    if args.frontier is not None:
+      frontier = CrawlFrontier(args.frontier, seen_index=scraper_kwargs.get('seen_index'))
     try:
-      manager = YTSManager()
+      manager = YTSManager(backend=args.backend, video_store=video_store, frontier=frontier,
+                           **scraper_kwargs)
       search_terms = load_search_terms(args.search_terms_file)
 
       if args.n_threads > len(search_terms):
@@ -53,28 +161,37 @@ if __name__ == '__main__':
       print('#' * 80)
       while True:
           manager.print_status()
+          manager.print_stage_times()
           time.sleep(5)
     except KeyboardInterrupt:
       manager.stop_scraping()
       print('\n\nStopped scraping')
     finally:
-      print('Saving data')
-      df = manager.get_dataframe()
-
-      print(os.path.exists(args.video_output_file), os.path.isfile(args.video_output_file))
-      if os.path.exists(args.video_output_file) and \
-         os.path.isfile(args.video_output_file):
-        print('Reading existing data')
-        old_df = pd.read_csv(args.video_output_file, index_col=0)
-
-      df = pd.concat([df, old_df], axis=0)
-      df = df.drop_duplicates()
-
-      # Reset the index
-      df = df.reset_index(drop=True)
-
-      print('# videos scraped:', str(len(df)))
-      df.to_csv(args.video_output_file)
+      if video_store is not None:
+        # Rows were already streamed to disk, only deduplicate them
+        video_store.stop_compaction()
+        video_store.compact()
+        print('# new videos scraped:', str(manager.n_videos_scraped))
+      else:
+        print('Saving data')
+        df = manager.get_dataframe()
+
+        old_df = None
+        print(os.path.exists(args.video_output_file), os.path.isfile(args.video_output_file))
+        if os.path.exists(args.video_output_file) and \
+           os.path.isfile(args.video_output_file):
+          print('Reading existing data')
+          old_df = pd.read_csv(args.video_output_file, index_col=0)
+
+        if old_df is not None:
+          df = pd.concat([df, old_df], axis=0)
+        df = df.drop_duplicates()
+
+        # Reset the index
+        df = df.reset_index(drop=True)
+
+        print('# videos scraped:', str(len(df)))
+        df.to_csv(args.video_output_file)
 
   # Do channel scraping
   if args.scrape_channel:
@@ -83,7 +200,7 @@ if __name__ == '__main__':
       raise Exception('You must generate a video data file before scraping channels')
 
     # Load the video data
-    df = pd.read_csv(args.video_output_file, index_col=0)
+    df = read_table(args.video_output_file)
     channel_data = df[['channel_name', 'channel_link']]
     channel_data.drop_duplicates(inplace=True)
 
@@ -91,21 +208,40 @@ if __name__ == '__main__':
     channel_links = channel_data['channel_link'].tolist()
     # video_page_links = channel_data['channel_link'].apply(lambda x: x + '/videos').tolist()
 
-    manager = YTSManager()
+    if args.channel_history:
+      # Rows are keyed by video so a refreshed view count replaces the old one
+      channel_store = open_store(args, args.history_output_dir, 'video_id', keep='last')
+      known_channel_videos = load_known_channel_videos(channel_store.read())
+      manager = YTSManager(backend=args.backend, channel_store=channel_store, channel_history=True,
+                           known_channel_videos=known_channel_videos, **scraper_kwargs)
+    else:
+      channel_store = open_store(args, args.channel_output_file, 'channel_link', keep='last')
+      manager = YTSManager(backend=args.backend, channel_store=channel_store, **scraper_kwargs)
     try:
       manager.start_channel_scrape_loops(channel_names, channel_links, n_workers=args.n_threads)
-      while True:
+      while manager.is_channel_scraping_active():
           manager.print_channel_status()
+          manager.print_stage_times()
           time.sleep(5)
+      manager.print_channel_status()
+      manager.print_stage_times()
     except KeyboardInterrupt:
       manager.stop_channel_scraping()
       print('\n\nStopped scraping')
     finally:
-      print('Saving data')
-      df = manager.get_channel_dataframe()
-      df = df.drop_duplicates()
-      print('# channels scraped:', str(len(df)))
-      df.to_csv(args.channel_output_file)
-
-
-    
\ No newline at end of file
+      if channel_store is not None:
+        channel_store.stop_compaction()
+        channel_store.compact()
+        print('# new channel rows scraped:', str(manager.n_channels_scraped))
+      else:
+        print('Saving data')
+        df = manager.get_channel_dataframe()
+        df = df.drop_duplicates(subset='channel_link', keep='last')
+        print('# channels scraped:', str(len(df)))
+        # CSV has no list columns, so write one row per channel video
+        explode_channel_videos(df).to_csv(args.channel_output_file)
+
+  if 'driver_pool' in scraper_kwargs:
+    scraper_kwargs['driver_pool'].close()
+  if 'metrics' in scraper_kwargs:
+    scraper_kwargs['metrics'].close()
@@ -1,5 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import functools
+import itertools
 import os
+from urllib.parse import urljoin
+from lxml import etree
+from lxml import html as lxml_html
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
@@ -17,16 +23,64 @@ import string
 import threading
 from threading import Lock
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
 import warnings
 from webdriver_manager.chrome import ChromeDriverManager
 
+import page_data
+from pacing import backoff_delay
+from scrape_metrics import NULL_METRICS
+from seen_index import CHANNEL, VIDEO, canonical_video_id
+
 
 YT_SEARCH_URL_TEMPLATE = 'https://www.youtube.com/results?search_query={}'
-ACTION_DELAY_SECONDS = 0.5
 RETRY_DELAY_SECONDS = 3.0
 LOAD_TIMEOUT_SECONDS = 15.0
+MAX_DEAD_ENDS = 3 # Pages in a row without an openable suggestion before searching again
+CHANNEL_QUEUE_FACTOR = 2
+SCROLL_TIMEOUT_SECONDS = 3.0
+SETTLE_QUIET_MS = 300
+READY_POLL_SECONDS = 0.1
+THROTTLE_URL_MARKERS = ('google.com/sorry', 'consent.youtube.com')
+HTTP_POOL_SIZE = 16
+HTTP_HEADERS = {
+  'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                '(KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36',
+  'Accept-Language': 'en-US,en;q=0.9'
+}
+HTTP_COOKIES = {'CONSENT': 'YES+cb'}
 SELENIUM_WAIT_EXCEPTIONS = (NoSuchElementException, StaleElementReferenceException)
 
+# Only the text of a page and the src URLs of its thumbnails are scraped, so the lean
+# profile skips rendering images, playing video and everything Chrome does in the background
+LEAN_CHROME_ARGUMENTS = (
+  '--disable-gpu',
+  '--disable-extensions',
+  '--disable-background-networking',
+  '--disable-component-update',
+  '--disable-default-apps',
+  '--disable-sync',
+  '--no-first-run',
+  '--autoplay-policy=user-gesture-required',
+  '--blink-settings=imagesEnabled=false'
+)
+LEAN_BLOCKED_URL_PATTERNS = (
+  # Images, their src attributes are still set
+  '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.ico', '*i.ytimg.com/*', '*yt3.ggpht.com/*',
+  # Video and audio streams
+  '*googlevideo.com/*', '*/videoplayback*', '*.mp4', '*.webm',
+  # Fonts
+  '*.woff', '*.woff2', '*.ttf', '*fonts.gstatic.com/*',
+  # Ads and tracking
+  '*doubleclick.net/*', '*googlesyndication.com/*', '*googleadservices.com/*',
+  '*google-analytics.com/*', '*/pagead/*', '*/api/stats/*', '*/ptracking*'
+)
+BROWSER_PROFILES = {
+  'default': {'arguments': (), 'blocked_urls': ()},
+  'lean': {'arguments': LEAN_CHROME_ARGUMENTS, 'blocked_urls': LEAN_BLOCKED_URL_PATTERNS}
+}
+
 XPATH_PATTERNS = {
   'search_thumbnail': '//a[@id="thumbnail"]',
   'suggested_thumbnail': '//div[@id="related"][contains(@class, "ytd-watch-flexy")]/*/*/*/*/*/a[@id="thumbnail"]',
@@ -43,11 +97,77 @@ XPATH_PATTERNS = {
   'video_page_titles': '//*[@id="video-title"]'
 }
 
-os.environ['Path'] = os.environ['Path'] + ';.\\chromedriver'
+COMPILED_XPATHS = {item: etree.XPath(pattern) for item, pattern in XPATH_PATTERNS.items()}
+
+# Single round trip checks that every XPath in arguments[0] matches at least one node
+PAGE_READY_SCRIPT = '''
+return arguments[0].every(function(xpath) {
+  return document.evaluate(xpath, document, null,
+    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null;
+});
+'''
+SNAPSHOT_SCRIPT = 'return [document.documentElement.outerHTML, window.location.href];'
+
+# True once the page has loaded and its DOM has not changed for arguments[0] milliseconds.
+# Installs a MutationObserver the first time it runs on a page.
+PAGE_SETTLED_SCRIPT = '''
+if (document.readyState !== 'complete') {
+  return false;
+}
+if (window.__ytsLastMutation === undefined) {
+  window.__ytsLastMutation = performance.now();
+  new MutationObserver(function() {
+    window.__ytsLastMutation = performance.now();
+  }).observe(document.documentElement, {childList: true, subtree: true});
+  return false;
+}
+return performance.now() - window.__ytsLastMutation >= arguments[0];
+'''
+# Counts the nodes matching the XPath in arguments[0], scrolling to the bottom first if arguments[1] is set
+COUNT_NODES_SCRIPT = '''
+if (arguments[1]) {
+  window.scrollTo(0, document.getElementById("content").scrollHeight);
+}
+return document.evaluate('count(' + arguments[0] + ')', document, null,
+  XPathResult.NUMBER_TYPE, null).numberValue;
+'''
+
+# Returns [href, thumbnail src, channel name] for every link matching the XPath in arguments[0]
+COLLECT_LINKS_SCRIPT = '''
+var result = document.evaluate(arguments[0], document, null,
+  XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var links = [];
+for (var i = 0; i < result.snapshotLength; i++) {
+  var link = result.snapshotItem(i);
+  var img = link.querySelector('img');
+  var tile = link.closest('ytd-video-renderer, ytd-compact-video-renderer, ytd-rich-item-renderer');
+  var channel = tile ? tile.querySelector('ytd-channel-name #text') : null;
+  links.push([link.href, img ? img.src : null, channel ? channel.textContent.trim() : null]);
+}
+return links;
+'''
 
+# Returns [href, title, views label, upload date label] for every video tile on a channel /videos page
+CHANNEL_TILES_SCRIPT = '''
+var tiles = document.querySelectorAll('ytd-rich-item-renderer, ytd-grid-video-renderer');
+var result = [];
+for (var i = 0; i < tiles.length; i++) {
+  var link = tiles[i].querySelector('a#video-title-link, a#video-title, a#thumbnail');
+  var title = tiles[i].querySelector('#video-title');
+  var spans = tiles[i].querySelectorAll('#metadata-line span');
+  result.push([
+    link ? link.href : null,
+    title ? title.textContent.trim() : null,
+    spans.length > 0 ? spans[0].textContent : null,
+    spans.length > 1 ? spans[1].textContent : null]);
+}
+return result;
+'''
+
+if 'Path' in os.environ:
+  # Windows looks for a chromedriver next to the scripts
+  os.environ['Path'] = os.environ['Path'] + ';.\\chromedriver'
 
-def action_wait():
-  time.sleep(ACTION_DELAY_SECONDS)
 
 def yt_time_ago_to_datetime(time_ago):
   # Source: https://stackoverflow.com/questions/12566152/python-x-days-ago-to-datetime
@@ -88,31 +208,95 @@ def yt_label_to_datetime(label):
       
   return label # TODO: convert to datetime
 
-def run_with_retry(func, times=3, refresh_driver=None):
+def run_with_retry(func, times=3, refresh_driver=None, metrics=NULL_METRICS):
   for i in range(times-1):
     try:
       return func()
-    except:
+    except Exception as e:
       print('Function call {} failed, retrying...'.format(i + 1))
-      if refresh_driver:
-        refresh_driver.navigate().refresh()
-      time.sleep(RETRY_DELAY_SECONDS)
-      
-    return func()
+      metrics.count('retries')
+      if isinstance(e, StaleElementReferenceException):
+        metrics.count('stale_elements')
+      with metrics.time('retry'):
+        if refresh_driver:
+          refresh_driver.navigate().refresh()
+        time.sleep(backoff_delay(i, RETRY_DELAY_SECONDS))
+
+  return func()
+
+class SnapshotElement():
+  """Read-only stand-in for a WebElement that is backed by a parsed DOM snapshot."""
+  def __init__(self, element, base_url):
+    self.element = element
+    self.base_url = base_url
+
+  @property
+  def text(self):
+    return self.element.text_content().strip()
+
+  def get_attribute(self, name):
+    value = self.element.get(name)
+    if value is not None and name in ('href', 'src'):
+      value = urljoin(self.base_url, value)
+    return value
+
+  get_property = get_attribute
+
+def create_chrome_driver(headless=True, profile='default', arguments=()):
+  """
+  Starts Chrome with one of the `BROWSER_PROFILES`, which adds command line switches and
+  blocks requests to URLs matching its patterns (through the DevTools protocol), plus any
+  extra `arguments`.
+  """
+  if profile not in BROWSER_PROFILES:
+    raise ValueError(f'Unknown browser profile "{profile}", expected one of {list(BROWSER_PROFILES)}.')
+  chrome_options = Options()
+  if headless:
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--mute-audio')
+  for argument in BROWSER_PROFILES[profile]['arguments'] + tuple(arguments):
+    chrome_options.add_argument(argument)
+
+  try:
+    driver = webdriver.Chrome(options=chrome_options)
+  except SessionNotCreatedException:
+    warnings.warn('Error due to likely incorrect version of ChromeDriver. Please update to latest version.')
+    driver = webdriver.Chrome(ChromeDriverManager().install(), options=chrome_options)
+
+  blocked_urls = BROWSER_PROFILES[profile]['blocked_urls']
+  if blocked_urls:
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(blocked_urls)})
+  return driver
 
 class YouTubeScraper():
-  def __init__(self, headless=True):
-    chrome_options = Options()
-    if headless:
-      chrome_options.add_argument('--headless')
-      chrome_options.add_argument('--mute-audio')
-    
-    try:
-      self.driver = webdriver.Chrome(options=chrome_options)
-    except SessionNotCreatedException:
-      warnings.warn('Error due to likely incorrect version of ChromeDriver. Please update to latest version.')
-      self.driver = webdriver.Chrome(ChromeDriverManager().install(), options=chrome_options)
+  def __init__(self, headless=True, snapshot=False, seen_index=None, driver_pool=None,
+               rate_limiter=None, metrics=None, browser_profile='default'):
+    """
+    If `snapshot` is set, video and channel pages are read with a single wait and a
+    single DOM snapshot that is queried locally, instead of one WebDriver call per element.
+    A shared `seen_index.SeenIndex` lets scrapers skip pages that any other scraper,
+    process or previous run has already scraped. With a `driver_pool.DriverPool` the
+    scraper leases a warm session instead of starting its own browser. A shared
+    `pacing.AdaptiveRateLimiter` paces page loads across all scrapers. With a shared
+    `scrape_metrics.ScrapeMetrics` the scraper times its stages and counts its events.
+    `browser_profile` is one of `BROWSER_PROFILES` for the browser the scraper starts
+    itself, pooled sessions use the profile of the pool's factory.
+    """
+    self.snapshot = snapshot
+    self.driver_pool = driver_pool
+    self.rate_limiter = rate_limiter
+    self.metrics = NULL_METRICS if metrics is None else metrics.worker()
+    self.n_pages = 0
+    if driver_pool is not None:
+      self.driver = driver_pool.acquire()
+    else:
+      self.driver = create_chrome_driver(headless, browser_profile)
 
+    self._init_buffers(seen_index)
+
+  def _init_buffers(self, seen_index=None):
+    self.seen_index = seen_index
     self.scraped_vid_urls = set([])
     self.scraped_channel_urls = set([])
 
@@ -123,67 +307,261 @@ class YouTubeScraper():
     self._cdb_lock = Lock()
     
   def terminate(self):
+    if self.driver_pool is not None:
+      if self.driver is not None:
+        self.driver_pool.release(self.driver, pages=self.n_pages)
+        self.driver = None
+      self.n_pages = 0
+      return
     try:
       self.driver.quit()
     except Exception as e:
       print(f'Tried to terminate YouTubeScraper, but failed with exception: {e}')
 
+  def _pace(self):
+    """Called before every page load, blocks until the rate limiter allows it."""
+    self.n_pages += 1
+    self.metrics.count('pages')
+    if self.rate_limiter is not None:
+      with self.metrics.time('pace'):
+        self.rate_limiter.acquire()
+
+  def _record_page(self, success):
+    """Reports whether a page could be scraped so the rate limiter can adapt."""
+    if not success:
+      self.metrics.count('failed_pages')
+    if self.rate_limiter is None:
+      return
+    if success:
+      self.rate_limiter.record_success()
+    elif self._is_throttled():
+      self.rate_limiter.record_throttle()
+    else:
+      self.rate_limiter.record_error()
+
+  def _is_throttled(self):
+    url = self.current_url or ''
+    return any(marker in url for marker in THROTTLE_URL_MARKERS)
+
+  def _navigate(self, url):
+    """Opens `url` and returns whether it loaded, like `HTMLYouTubeScraper._navigate`."""
+    self._pace()
+    with self.metrics.time('navigate'):
+      self.driver.get(url)
+    return True
+
+  def _wait_for_settle(self, timeout=LOAD_TIMEOUT_SECONDS):
+    """Waits until the page has stopped changing, rather than sleeping for a fixed time."""
+    try:
+      with self.metrics.time('wait'):
+        WebDriverWait(self.driver, timeout, poll_frequency=READY_POLL_SECONDS).until(
+          lambda driver: driver.execute_script(PAGE_SETTLED_SCRIPT, SETTLE_QUIET_MS))
+    except TimeoutException:
+      self.metrics.count('timeouts')
+      warnings.warn('Timeout while waiting for the page to settle.')
+
+  def _wait_for_url_change(self, old_url):
+    """Waits for a click to navigate away from `old_url`."""
+    try:
+      with self.metrics.time('wait'):
+        WebDriverWait(self.driver, LOAD_TIMEOUT_SECONDS, poll_frequency=READY_POLL_SECONDS).until(
+          EC.url_changes(old_url))
+    except TimeoutException:
+      self.metrics.count('timeouts')
+      warnings.warn(f'Timeout while waiting to navigate away from "{old_url}".')
+
+  def _scroll_for_more(self, item):
+    """
+    Scrolls to the bottom of the page and waits until more `item` elements have loaded.
+    Returns False if none appeared, e.g. because the end of the page was reached.
+    """
+    pattern = XPATH_PATTERNS[item]
+    n_before = self.driver.execute_script(COUNT_NODES_SCRIPT, pattern, True)
+    try:
+      # Running out of items ends in a timeout too, so it is not counted as one
+      with self.metrics.time('wait'):
+        WebDriverWait(self.driver, SCROLL_TIMEOUT_SECONDS, poll_frequency=READY_POLL_SECONDS).until(
+          lambda driver: driver.execute_script(COUNT_NODES_SCRIPT, pattern, False) > n_before)
+    except TimeoutException:
+      return False
+    return True
+
+  def _maybe_recycle_driver(self, renavigate=True):
+    """
+    Swaps a long-lived leased session for a fresh one once the pool wants it recycled.
+    With `renavigate` the new session is sent to the page the old one was on.
+    """
+    if self.driver_pool is None or not self.driver_pool.needs_recycle(self.driver, self.n_pages):
+      return
+    url = self.current_url if renavigate else None
+    self.metrics.count('driver_restarts')
+    self.driver_pool.release(self.driver, pages=self.n_pages)
+    self.n_pages = 0
+    # Cleared first so that a timeout while waiting for a new session doesn't release the old one twice
+    self.driver = None
+    self.driver = self.driver_pool.acquire()
+    if url is not None:
+      self._navigate(url)
+
+  @property
+  def current_url(self):
+    return self.driver.current_url
+
+  def _is_scraped_video(self, url):
+    if self.seen_index is not None:
+      return self.seen_index.contains(VIDEO, url)
+    return url in self.scraped_vid_urls
+
+  def _mark_scraped_video(self, url):
+    self.scraped_vid_urls.add(url)
+    if self.seen_index is not None:
+      self.seen_index.add(VIDEO, url)
+
+  def _claim_channel(self, url):
+    """
+    Marks a channel as taken by this scraper. Returns False if it already was, or if any
+    scraper has finished it before. The seen index only records it once it was scraped
+    (see `_mark_scraped_channel`), so channels that failed are tried again by later runs.
+    """
+    if url in self.scraped_channel_urls or (self.seen_index is not None and self.seen_index.contains(CHANNEL, url)):
+      self.metrics.count('duplicates')
+      return False
+    self.scraped_channel_urls.add(url)
+    return True
+
+  def _mark_scraped_channel(self, url):
+    if self.seen_index is not None:
+      self.seen_index.add(CHANNEL, url)
+
+  def _prefer_unseen(self, videos, links):
+    """Drops already scraped videos from the candidates, unless none would be left."""
+    unseen = [video for video, link in zip(videos, links) if not self._is_scraped_video(link)]
+    return unseen or videos
+
+  def _snapshot_elements(self, items):
+    """
+    Waits once for all `items` of `XPATH_PATTERNS` to be present, then copies the DOM in one
+    call and evaluates the patterns locally. Returns a dict of element lists, or None on failure.
+    """
+    patterns = [XPATH_PATTERNS[item] for item in items]
+    try:
+      with self.metrics.time('wait'):
+        WebDriverWait(self.driver, LOAD_TIMEOUT_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS).until(
+          lambda driver: driver.execute_script(PAGE_READY_SCRIPT, patterns))
+    except TimeoutException:
+      self.metrics.count('timeouts')
+      warnings.warn(f'Timeout while waiting for elements {items} to load.')
+      return None
+
+    with self.metrics.time('extract'):
+      source, url = self.driver.execute_script(SNAPSHOT_SCRIPT)
+      tree = lxml_html.fromstring(source)
+      elements = {}
+      for item in items:
+        elements[item] = [SnapshotElement(e, url) for e in COMPILED_XPATHS[item](tree)]
+        if not elements[item]:
+          warnings.warn(f'Element "{item}" disappeared before the snapshot was taken.')
+          return None
+    return elements
+
   def perform_yt_search(self, search_term):
     """Opens up YouTube and performs a search for the specified term."""
-    self.driver.get(YT_SEARCH_URL_TEMPLATE.format(search_term))
-    action_wait()
+    self._navigate(YT_SEARCH_URL_TEMPLATE.format(search_term))
     if 'youtube' not in self.driver.title.lower():
+      self._record_page(False)
       return False
     return True
   
   def _retrieve_search_videos(self):
     """Returns all video link elements from a YouTube page."""
-    videos = WebDriverWait(
-      self.driver,
-      LOAD_TIMEOUT_SECONDS,
-      ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
-      ).until(
-        EC.presence_of_all_elements_located((
-          By.XPATH,
-          XPATH_PATTERNS['search_thumbnail'])))
+    try:
+      with self.metrics.time('wait'):
+        videos = WebDriverWait(
+          self.driver,
+          LOAD_TIMEOUT_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
+          ).until(
+            EC.presence_of_all_elements_located((
+              By.XPATH,
+              XPATH_PATTERNS['search_thumbnail'])))
+    except TimeoutException:
+      self.metrics.count('timeouts')
+      raise
     
-    valid_videos = []
+    valid_videos, valid_links = [], []
     for video in videos:
       link = video.get_attribute('href')
       if link is not None and 'youtube.com' in link.lower():
         valid_videos.append(video)
-    return valid_videos
+        valid_links.append(link)
+    return self._prefer_unseen(valid_videos, valid_links)
   
   def _retrieve_suggested_videos(self):
     """Returns all video link elements from a YouTube suggested bar."""
-    videos = WebDriverWait(
-      self.driver,
-      LOAD_TIMEOUT_SECONDS,
-      ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
-      ).until(
-        EC.presence_of_all_elements_located((
-          By.XPATH,
-          XPATH_PATTERNS['suggested_thumbnail'])))
+    try:
+      with self.metrics.time('wait'):
+        videos = WebDriverWait(
+          self.driver,
+          LOAD_TIMEOUT_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
+          ).until(
+            EC.presence_of_all_elements_located((
+              By.XPATH,
+              XPATH_PATTERNS['suggested_thumbnail'])))
+    except TimeoutException:
+      self.metrics.count('timeouts')
+      raise
     
-    valid_videos = []
+    valid_videos, valid_links = [], []
     for video in videos:
       try:
         link = video.get_attribute('href')
         if link is not None and 'youtube.com' in link.lower():
           valid_videos.append(video)
+          valid_links.append(link)
       except StaleElementReferenceException as e:
+        self.metrics.count('stale_elements')
         continue
 #     print(len(valid_videos) / len(videos))
-    return valid_videos
+    return self._prefer_unseen(valid_videos, valid_links)
+
+  def _collect_links(self, item):
+    """Returns every video link matching an `XPATH_PATTERNS` item as dicts, in one WebDriver call."""
+    try:
+      with self.metrics.time('wait'):
+        WebDriverWait(self.driver, LOAD_TIMEOUT_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS).until(
+          EC.presence_of_element_located((By.XPATH, XPATH_PATTERNS[item])))
+    except TimeoutException:
+      self.metrics.count('timeouts')
+      warnings.warn(f'Timeout while waiting for "{item}" links to load.')
+      return []
+
+    with self.metrics.time('extract'):
+      found_links = self.driver.execute_script(COLLECT_LINKS_SCRIPT, XPATH_PATTERNS[item])
+    links = []
+    for href, thumbnail_link, channel in found_links:
+      if href is None or 'youtube.com' not in href.lower():
+        continue
+      if not thumbnail_link or not thumbnail_link.startswith('http'):
+        # Thumbnails that were never scrolled into view have no src yet
+        thumbnail_link = page_data.YT_THUMBNAIL_URL_TEMPLATE.format(canonical_video_id(href))
+      links.append({'video_url': href, 'thumbnail_link': thumbnail_link, 'channel': channel})
+    return links
+
+  def collect_search_links(self):
+    """Returns all video links on a search page without clicking any of them."""
+    return self._collect_links('search_thumbnail')
+
+  def collect_suggested_links(self):
+    """Returns all video links in the suggested bar without clicking any of them."""
+    return self._collect_links('suggested_thumbnail')
 
   def choose_vid_from_search(self, scroll_chance=0.5, max_scrolls=15):
     """Selects a random YouTube video and clicks on the link. Should only be used on the search page."""
     for n_scrolls in range(max_scrolls):
-      if np.random.rand() < scroll_chance:
-        self.driver.execute_script('window.scrollTo(0, document.getElementById("content").scrollHeight)')
-        action_wait()
-      else:
-        action_wait()
+      if np.random.rand() >= scroll_chance or not self._scroll_for_more('search_thumbnail'):
         break
         
     all_vids = self._retrieve_search_videos()
@@ -197,7 +575,11 @@ class YouTubeScraper():
     if not thumbnail_element:
       return None
     
-    selected_vid.click()
+    old_url = self.current_url
+    self._pace()
+    with self.metrics.time('navigate'):
+      selected_vid.click()
+    self._wait_for_url_change(old_url)
     
     # Return a link to the thumbnail
     return {'thumbnail_link': thumbnail_link}
@@ -205,11 +587,7 @@ class YouTubeScraper():
   def choose_vid_from_suggested(self, scroll_chance=0.5, max_scrolls=5):
     """Selects a random YouTube video and clicks on the link. Should only be used on the suggested bar page."""
     for n_scrolls in range(max_scrolls):
-      if np.random.rand() < scroll_chance:
-        self.driver.execute_script('window.scrollTo(0, document.getElementById("content").scrollHeight)')
-        action_wait()
-      else:
-        action_wait()
+      if np.random.rand() >= scroll_chance or not self._scroll_for_more('suggested_thumbnail'):
         break
         
     all_vids = self._retrieve_suggested_videos()
@@ -222,14 +600,24 @@ class YouTubeScraper():
     
     self.driver.execute_script('arguments[0].scrollIntoView(true)', selected_vid);
     self.driver.execute_script('window.scrollBy(0, -50)')
-    action_wait()  
+    try:
+      with self.metrics.time('wait'):
+        WebDriverWait(self.driver, LOAD_TIMEOUT_SECONDS, poll_frequency=READY_POLL_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS).until(EC.element_to_be_clickable(selected_vid))
+    except TimeoutException:
+      self.metrics.count('timeouts')
+      return None
     
     thumbnail_element = selected_vid.find_element(By.XPATH, './/img')
     if not thumbnail_element:
       return None
     thumbnail_link = thumbnail_element.get_property('src')
     
-    run_with_retry(selected_vid.click)
+    old_url = self.current_url
+    self._pace()
+    with self.metrics.time('navigate'):
+      run_with_retry(selected_vid.click, metrics=self.metrics)
+    self._wait_for_url_change(old_url)
     
     # Return a link to the thumbnail
     return {'thumbnail_link': thumbnail_link}
@@ -240,17 +628,28 @@ class YouTubeScraper():
     
     target_items = ('view_count', 'date', 'video_title', 'video_description',
                     'channel_name_link', 'subscriber_count', 'likes')
-    for item in target_items:
-      pattern = XPATH_PATTERNS[item]
-      try:
-        element = WebDriverWait(self.driver, LOAD_TIMEOUT_SECONDS,
-          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS).until(
-          EC.presence_of_all_elements_located((By.XPATH, pattern)))
-      except TimeoutException:
-        warnings.warn(f'Timeout while waiting for element "{item}" to load.')
+    if self.snapshot:
+      data = self._snapshot_elements(target_items)
+      if data is None:
+        self._record_page(False)
         return None
-      data[item] = element
+    else:
+      for item in target_items:
+        pattern = XPATH_PATTERNS[item]
+        try:
+          with self.metrics.time('wait'):
+            element = WebDriverWait(self.driver, LOAD_TIMEOUT_SECONDS,
+              ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS).until(
+              EC.presence_of_all_elements_located((By.XPATH, pattern)))
+        except TimeoutException:
+          self.metrics.count('timeouts')
+          warnings.warn(f'Timeout while waiting for element "{item}" to load.')
+          self._record_page(False)
+          return None
+        data[item] = element
+    self._record_page(True)
     
+    extract_start = time.perf_counter()
     current_date = datetime.now().strftime("%b %d, %Y")
 
     data['view_count'] = yt_label_to_num(data['view_count'][0].text)
@@ -266,72 +665,153 @@ class YouTubeScraper():
     data['video_url'] = self.driver.current_url
 
     del data['channel_name_link']
+    self.metrics.add_time('extract', time.perf_counter() - extract_start)
     
     return data
 
   # Channel based scraping
   def _scrape_channel_page(self, channel_name, channel_url):
-    if channel_url in self.scraped_channel_urls:
+    if not self._claim_channel(channel_url):
       return
-    self.scraped_channel_urls.add(channel_url)
+    self._maybe_recycle_driver(renavigate=False)
 
     # Naviate to the videos page
     video_page_url = channel_url + '/videos'
-    self.driver.get(video_page_url)
-    action_wait()
-
-    view_counts = WebDriverWait(
-      self.driver,
-      LOAD_TIMEOUT_SECONDS,
-      ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
-      ).until(
-        EC.presence_of_all_elements_located((
-          By.XPATH,
-          XPATH_PATTERNS['video_page_views'])))
-
-    upload_dates = WebDriverWait(
-      self.driver,
-      LOAD_TIMEOUT_SECONDS,
-      ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
-      ).until(
-        EC.presence_of_all_elements_located((
-          By.XPATH,
-          XPATH_PATTERNS['video_page_upload_dates'])))
-
-    titles = WebDriverWait(
-      self.driver,
-      LOAD_TIMEOUT_SECONDS,
-      ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
-      ).until(
-        EC.presence_of_all_elements_located((
-          By.XPATH,
-          XPATH_PATTERNS['video_page_titles'])))
+    self._navigate(video_page_url)
+    # The three lists below must come from the same render of the grid
+    self._wait_for_settle()
+
+    if self.snapshot:
+      target_items = ('video_page_views', 'video_page_upload_dates', 'video_page_titles')
+      elements = self._snapshot_elements(target_items)
+      if elements is None:
+        self._record_page(False)
+        return
+      view_counts, upload_dates, titles = (elements[item] for item in target_items)
+    else:
+      with self.metrics.time('wait'):
+        view_counts = WebDriverWait(
+          self.driver,
+          LOAD_TIMEOUT_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
+          ).until(
+            EC.presence_of_all_elements_located((
+              By.XPATH,
+              XPATH_PATTERNS['video_page_views'])))
+
+        upload_dates = WebDriverWait(
+          self.driver,
+          LOAD_TIMEOUT_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
+          ).until(
+            EC.presence_of_all_elements_located((
+              By.XPATH,
+              XPATH_PATTERNS['video_page_upload_dates'])))
+
+        titles = WebDriverWait(
+          self.driver,
+          LOAD_TIMEOUT_SECONDS,
+          ignored_exceptions=SELENIUM_WAIT_EXCEPTIONS
+          ).until(
+            EC.presence_of_all_elements_located((
+              By.XPATH,
+              XPATH_PATTERNS['video_page_titles'])))
 
     if view_counts is None or upload_dates is None or titles is None:
       warnings.warn('Some of the data loaded on the channel videos page was null, skipping.')
+      self._record_page(False)
       return
     elif not (len(view_counts) == len(upload_dates) == len(titles)):
       warnings.warn('Number of view counts, upload dates, and titles do not match, skipping.')
+      self._record_page(False)
       return
 
     # Convert elements to target format (int, datetime, str)
-    view_counts = [yt_label_to_num(view_count.text) for view_count in view_counts]
-    upload_dates = [yt_label_to_datetime(upload_date.text) for upload_date in upload_dates]
-    titles = [title.text for title in titles]
+    with self.metrics.time('extract'):
+      view_counts = [yt_label_to_num(view_count.text) for view_count in view_counts]
+      upload_dates = [yt_label_to_datetime(upload_date.text) for upload_date in upload_dates]
+      titles = [title.text for title in titles]
     
     current_date = datetime.now().strftime('%b %d, %Y')
+    self._record_page(True)
 
     channel_data = {
       'channel_name': channel_name,
       'channel_link': channel_url,
-      'title': tuple(titles),
-      'upload_date': tuple(upload_dates),
-      'view_count': tuple(view_counts),
+      'title': titles,
+      'upload_date': upload_dates,
+      'view_count': view_counts,
       'scrape_date': current_date
     }
 
     self._add_to_channel_data_buffer(channel_data)
+    self._mark_scraped_channel(channel_url)
   
+  def _iter_channel_video_batches(self, channel_url, max_batches=None):
+    """Yields the video tiles of a channel /videos page batch by batch, scrolling to load the next one."""
+    self._navigate(channel_url + '/videos')
+    self._wait_for_settle()
+
+    n_seen = 0
+    for n_batches in itertools.count(1):
+      tiles = []
+      with self.metrics.time('extract'):
+        found_tiles = self.driver.execute_script(CHANNEL_TILES_SCRIPT)[n_seen:]
+      for href, title, view_count, upload_date in found_tiles:
+        n_seen += 1
+        if href is None:
+          continue
+        tiles.append({'video_id': canonical_video_id(href), 'title': title,
+                      'upload_date': upload_date, 'view_count': view_count})
+      if n_batches == 1:
+        self._record_page(n_seen > 0)
+      yield tiles
+
+      if max_batches is not None and n_batches >= max_batches:
+        return
+      if not self._scroll_for_more('video_page_titles'):
+        return
+
+  def _scrape_channel_history(self, channel_name, channel_url, known_videos=None, max_batches=None):
+    """
+    Pages through the uploads of a channel, newest first, and stops after the batch that
+    reaches a video in `known_videos`, a dict of video IDs to view counts from earlier
+    scrapes. Adds one row per new video, and one per known video in the loaded batches
+    whose view count changed, so refreshing a channel only costs its new uploads.
+    """
+    if channel_url in self.scraped_channel_urls:
+      self.metrics.count('duplicates')
+      return
+    self.scraped_channel_urls.add(channel_url)
+    known_videos = known_videos or {}
+    scrape_date = datetime.now().strftime('%b %d, %Y')
+
+    rows = []
+    for tiles in self._iter_channel_video_batches(channel_url, max_batches):
+      reached_known = False
+      for tile in tiles:
+        view_count = yt_label_to_num(tile['view_count'])
+        is_new = tile['video_id'] not in known_videos
+        if not is_new:
+          reached_known = True
+          if known_videos[tile['video_id']] == view_count:
+            continue
+        rows.append({
+          'channel_name': channel_name,
+          'channel_link': channel_url,
+          'video_id': tile['video_id'],
+          'title': tile['title'],
+          'upload_date': yt_label_to_datetime(tile['upload_date']),
+          'view_count': view_count,
+          'scrape_date': scrape_date,
+          'is_new': is_new
+        })
+      if reached_known:
+        break
+
+    for row in rows:
+      self._add_to_channel_data_buffer(row)
+
   def _add_to_video_data_buffer(self, data):
     with self._vdb_lock:
       self._video_data_buffer.append(data)
@@ -352,52 +832,376 @@ class YouTubeScraper():
       self._channel_data_buffer = []
     return channel_data
   
+  def _scrape_opened_video(self, video_data):
+    """Scrapes the video that `choose_vid_from_*` opened into the buffer, unless it was scraped before."""
+    video_url = self.current_url
+    if self._is_scraped_video(video_url):
+      self.metrics.count('duplicates')
+      return
+    new_video_data = self.scrape_vid_data()
+    if new_video_data is not None:
+      video_data.update(new_video_data)
+      self._add_to_video_data_buffer(video_data)
+      self._mark_scraped_video(video_url)
+
   def _scrape_loop(self, start_term, stop_check):
-    # Start initial scrape
-    self.perform_yt_search(start_term)
+    """
+    Follows random suggested videos from a search for `start_term`. After `MAX_DEAD_ENDS`
+    pages in a row where no video could be opened it searches again, and it returns, so
+    that the manager restarts it, when no video of the search could be opened either.
+    """
+    while not stop_check():
+      # Start a new chain of videos from the search page
+      self.perform_yt_search(start_term)
+      video_data = self.choose_vid_from_search()
+      if video_data is None:
+        self.metrics.count('dead_ends')
+        return
+      self._scrape_opened_video(video_data)
+
+      n_dead_ends = 0
+      while n_dead_ends < MAX_DEAD_ENDS:
+        video_data = run_with_retry(self.choose_vid_from_suggested, metrics=self.metrics)
+        if video_data is None:
+          n_dead_ends += 1
+        else:
+          n_dead_ends = 0
+          self._scrape_opened_video(video_data)
+
+        # Stop thread when variable set to true
+        if stop_check():
+          return
+
+        self._maybe_recycle_driver()
+      self.metrics.count('dead_ends')
+
+  def _frontier_loop(self, start_term, frontier, stop_check):
+    """
+    Scrapes the videos popped from a shared `frontier.CrawlFrontier` and queues every
+    link found on their pages, instead of clicking through one random link at a time.
+    """
+    if self.perform_yt_search(start_term):
+      frontier.push_many(self.collect_search_links(), depth=0)
+
+    while not stop_check():
+      entry = frontier.pop(timeout=LOAD_TIMEOUT_SECONDS)
+      if entry is None:
+        # The frontier ran dry, seed it from the search page again
+        if self.perform_yt_search(start_term):
+          frontier.push_many(self.collect_search_links(), depth=0)
+        continue
+
+      # Known videos are skipped before they cost a page load
+      if self._is_scraped_video(entry.url):
+        self.metrics.count('duplicates')
+        continue
+      if not self._navigate(entry.url):
+        frontier.requeue(entry)
+        continue
 
-    # Scrape first video
-    video_data = self.choose_vid_from_search()
-    video_url = self.driver.current_url
-    if video_url not in self.scraped_vid_urls:
       new_video_data = self.scrape_vid_data()
       if new_video_data is not None:
+        video_data = {'thumbnail_link': entry.thumbnail_link}
         video_data.update(new_video_data)
         self._add_to_video_data_buffer(video_data)
-        self.scraped_vid_urls.add(video_url)
-    else:
-      action_wait()
-
-    # Start scraping loop
-    while True:
-      video_data = run_with_retry(self.choose_vid_from_suggested)
-      video_url = self.driver.current_url
-      if video_url not in self.scraped_vid_urls:
-        new_video_data = self.scrape_vid_data()
-        if new_video_data is not None:
-          video_data.update(new_video_data)
-          self._add_to_video_data_buffer(video_data)
-          self.scraped_vid_urls.add(video_url)
-      else:
-        action_wait()
+        self._mark_scraped_video(entry.url)
+        frontier.mark_scraped(entry)
 
-      # Stop thread when variable set to true
-      if stop_check():
-        break
+      frontier.push_many(self.collect_suggested_links(), depth=entry.depth + 1)
+      self._maybe_recycle_driver(renavigate=False)
+
+
+class HTMLYouTubeScraper(YouTubeScraper):
+  """
+  Browserless scraper that fetches raw YouTube pages over a pooled HTTP session
+  and reads the embedded `ytInitialData`/`ytInitialPlayerResponse` JSON instead
+  of rendering the page. Produces the same data as `YouTubeScraper`.
+  """
+  def __init__(self, session=None, timeout=LOAD_TIMEOUT_SECONDS, seen_index=None, rate_limiter=None,
+               metrics=None):
+    if session is None:
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+      session.mount('https://', adapter)
+      session.mount('http://', adapter)
+      session.headers.update(HTTP_HEADERS)
+      session.cookies.update(HTTP_COOKIES)
+    self.session = session
+    self.timeout = timeout
+
+    self._url = None
+    self._initial_data = None
+    self._player_response = None
+    self._ytcfg = {}
+    self.driver_pool = None
+    self.rate_limiter = rate_limiter
+    self.metrics = NULL_METRICS if metrics is None else metrics.worker()
+    self.n_pages = 0
+
+    self._init_buffers(seen_index)
+
+  def terminate(self):
+    try:
+      self.session.close()
+    except Exception as e:
+      print(f'Tried to terminate HTMLYouTubeScraper, but failed with exception: {e}')
+
+  @property
+  def current_url(self):
+    return self._url
+
+  def _is_throttled(self):
+    return False
+
+  def _check_response(self, response, url):
+    """Returns False and reports to the rate limiter if a request failed or was throttled."""
+    if response.status_code != 200:
+      warnings.warn(f'Request for "{url}" failed with status {response.status_code}.')
+      self.metrics.count('failed_pages')
+      if self.rate_limiter is not None:
+        if response.status_code == 429:
+          self.rate_limiter.record_throttle()
+        else:
+          self.rate_limiter.record_error()
+      return False
+    if any(marker in response.url for marker in THROTTLE_URL_MARKERS):
+      warnings.warn(f'Request for "{url}" was redirected to "{response.url}".')
+      self.metrics.count('failed_pages')
+      if self.rate_limiter is not None:
+        self.rate_limiter.record_throttle()
+      return False
+    return True
+
+  def _browse(self, token):
+    """Fetches the batch of a paged list behind a continuation token. Returns None if it failed."""
+    self._pace()
+    api_key = self._ytcfg.get('api_key')
+    client_version = self._ytcfg.get('client_version') or page_data.DEFAULT_CLIENT_VERSION
+    with self.metrics.time('navigate'):
+      response = self.session.post(
+        page_data.YT_BROWSE_API_URL,
+        params={'key': api_key} if api_key else None,
+        json=page_data.browse_continuation_request(token, client_version),
+        timeout=self.timeout)
+    if not self._check_response(response, page_data.YT_BROWSE_API_URL):
+      return None
+    self._record_page(True)
+    with self.metrics.time('extract'):
+      return response.json()
+
+  def _load_page(self, url):
+    """Fetches a page and parses its embedded JSON. Returns False if the request failed."""
+    # Forget the previous page first, so a failed load can never be scraped as if it were that page
+    self._url = None
+    self._initial_data = None
+    self._player_response = None
+    self._ytcfg = {}
+    self._pace()
+    with self.metrics.time('navigate'):
+      response = self.session.get(url, timeout=self.timeout)
+      html = response.text
+    if not self._check_response(response, url):
+      return False
+
+    self._url = url
+    with self.metrics.time('extract'):
+      self._initial_data = page_data.extract_initial_json(html, 'ytInitialData')
+      self._player_response = page_data.extract_initial_json(html, 'ytInitialPlayerResponse')
+      self._ytcfg = page_data.extract_ytcfg(html)
+    self._record_page(self._initial_data is not None)
+    return self._initial_data is not None
+
+  def _choose_and_load(self, videos):
+    if not videos:
+      return None
+    videos = self._prefer_unseen(videos, [video['video_url'] for video in videos])
+    selected_vid = videos[np.random.randint(len(videos))]
+    if not self._load_page(selected_vid['video_url']):
+      return None
+    return {'thumbnail_link': selected_vid['thumbnail_link']}
+
+  def _navigate(self, url):
+    return self._load_page(url)
+
+  def perform_yt_search(self, search_term):
+    """Fetches the search results page for the specified term."""
+    return self._load_page(YT_SEARCH_URL_TEMPLATE.format(search_term))
+
+  def collect_search_links(self):
+    return page_data.parse_search_page(self._initial_data)
+
+  def collect_suggested_links(self):
+    return page_data.parse_suggested_videos(self._initial_data)
+
+  def choose_vid_from_search(self, *args, **kwargs):
+    """Loads a random video from the current search page. Scroll arguments are ignored."""
+    return self._choose_and_load(page_data.parse_search_page(self._initial_data))
+
+  def choose_vid_from_suggested(self, *args, **kwargs):
+    """Loads a random video from the related videos of the current page. Scroll arguments are ignored."""
+    return self._choose_and_load(page_data.parse_suggested_videos(self._initial_data))
+
+  def scrape_vid_data(self):
+    """Scrapes video data from the JSON embedded in the current YT video page."""
+    with self.metrics.time('extract'):
+      labels = page_data.parse_watch_page(self._initial_data, self._player_response)
+    missing = [k for k, v in labels.items() if v is None]
+    if missing:
+      warnings.warn(f'Missing data for {missing} on "{self._url}".')
+      return None
+
+    return {
+      'view_count': yt_label_to_num(labels['view_count']),
+      'date': labels['date'],
+      'video_title': labels['video_title'],
+      'video_description': labels['video_description'],
+      'scrape_date': datetime.now().strftime('%b %d, %Y'),
+      'channel_name': labels['channel_name'],
+      'channel_link': labels['channel_link'],
+      'subscriber_count': yt_label_to_num(labels['subscriber_count']),
+      'likes': yt_label_to_num(labels['likes']),
+      'video_url': self._url
+    }
+
+  def _iter_channel_video_batches(self, channel_url, max_batches=None):
+    """Yields the video tiles of a channel /videos page batch by batch, following continuation tokens."""
+    if not self._load_page(channel_url + '/videos'):
+      warnings.warn(f'Could not load the videos page of "{channel_url}", skipping.')
+      return
+
+    data = self._initial_data
+    for n_batches in itertools.count(1):
+      yield page_data.parse_channel_video_tiles(data)
+
+      token = page_data.find_continuation_token(data)
+      if token is None or (max_batches is not None and n_batches >= max_batches):
+        return
+      data = self._browse(token)
+      if data is None:
+        return
+
+  def _scrape_channel_page(self, channel_name, channel_url):
+    if not self._claim_channel(channel_url):
+      return
+
+    if not self._load_page(channel_url + '/videos'):
+      warnings.warn(f'Could not load the videos page of "{channel_url}", skipping.')
+      return
+
+    titles, upload_dates, view_counts = page_data.parse_channel_videos_page(self._initial_data)
+
+    channel_data = {
+      'channel_name': channel_name,
+      'channel_link': channel_url,
+      'title': list(titles),
+      'upload_date': [yt_label_to_datetime(upload_date) for upload_date in upload_dates],
+      'view_count': [yt_label_to_num(view_count) for view_count in view_counts],
+      'scrape_date': datetime.now().strftime('%b %d, %Y')
+    }
+
+    self._add_to_channel_data_buffer(channel_data)
+    self._mark_scraped_channel(channel_url)
+
+
+def load_known_channel_videos(df):
+  """Maps each channel link to {video ID: view count} from channel history rows scraped before."""
+  known_videos = {}
+  if len(df) == 0:
+    return known_videos
+  for channel_link, video_id, view_count in df[['channel_link', 'video_id', 'view_count']].itertuples(index=False):
+    known_videos.setdefault(channel_link, {})[video_id] = view_count
+  return known_videos
+
+SCRAPER_BACKENDS = {
+  'selenium': YouTubeScraper,
+  'html': HTMLYouTubeScraper
+}
 
 
 class YTSManager():
-  def __init__(self):
+  def __init__(self, backend='selenium', video_store=None, channel_store=None, frontier=None,
+               channel_history=False, known_channel_videos=None, metrics=None, **scraper_kwargs):
+    """
+    Scraped rows are streamed to `video_store`/`channel_store` (see `data_store.ShardedDataset`)
+    on every flush when they are given, and kept in memory otherwise. With a shared
+    `frontier.CrawlFrontier` the scrape loops crawl every discovered link instead of doing
+    random walks. With `channel_history` channels are scraped into one row per video over
+    their whole upload history, stopping at the videos in `known_channel_videos` (see
+    `load_known_channel_videos`). With a `scrape_metrics.ScrapeMetrics` every scraper
+    times its stages and counts its events, the manager times its flushes and `stats`
+    reports them. Extra keyword arguments are passed on to every scraper the manager creates.
+    """
+    if backend not in SCRAPER_BACKENDS:
+      raise ValueError(f'Unknown scraper backend "{backend}", expected one of {list(SCRAPER_BACKENDS)}.')
+    self.backend = backend
+    self.scraper_kwargs = scraper_kwargs
+    self.metrics = metrics
+    self._metrics = NULL_METRICS
+    if metrics is not None:
+      self.scraper_kwargs = dict(scraper_kwargs, metrics=metrics)
+      self._metrics = metrics.worker('manager')
+      self._register_gauges()
+    self.frontier = frontier
+    self.channel_history = channel_history
+    self.known_channel_videos = known_channel_videos or {}
+    self.video_store = video_store
+    self.channel_store = channel_store
     self.video_data = []
     self.channel_data = []
+    self.n_videos_scraped = 0
+    self.n_channels_scraped = 0
     self._threads = {}
+    self._pending_start_terms = []
     self._stop_scrape_thread = False
+    self._scrape_epoch = 0
     self._thread_lock = Lock()
     self._video_flush_interval = 2 # Flush video data every x seconds
-    self._channel_flush_interval = 2 # Flush channel data every x seconds
-    self._channel_scrape_interval = 0.2 # Create new scraping threads every x seconds
+    self._save_lock = Lock()
     self.checking_thread = None
-    self.channel_checking_thread = None
+
+    # Channel scraping state, see `start_channel_scrape_loops`
+    self.channel_scrape_thread = None
+    self.scrapers = []
+    self._channel_local = threading.local()
+    self._channel_stop = threading.Event()
+    self.n_channel_workers = 0
+    self.n_channels_queued = 0
+    self.n_channels_done = 0
+    self.n_channels_failed = 0
+
+  def _new_scraper(self):
+    return SCRAPER_BACKENDS[self.backend](**self.scraper_kwargs)
+
+  def _register_gauges(self):
+    self.metrics.counter('videos_scraped', lambda: self.n_videos_scraped)
+    self.metrics.counter('channel_rows_scraped', lambda: self.n_channels_scraped)
+    self.metrics.counter('channels_done', lambda: self.n_channels_done)
+    self.metrics.counter('channels_failed', lambda: self.n_channels_failed)
+    self.metrics.gauge('video_threads', lambda: len(self._threads))
+    self.metrics.gauge('channel_workers', lambda: self.n_channel_workers)
+    self.metrics.gauge('channels_queued', lambda: self.n_channels_queued)
+
+  def _save_video_data(self, rows):
+    if not rows:
+      return
+    with self._save_lock:
+      self.n_videos_scraped += len(rows)
+    with self._metrics.time('flush'):
+      if self.video_store is not None:
+        self.video_store.append(rows)
+      else:
+        self.video_data.extend(rows)
+
+  def _save_channel_data(self, rows):
+    if not rows:
+      return
+    with self._save_lock:
+      self.n_channels_scraped += len(rows)
+    with self._metrics.time('flush'):
+      if self.channel_store is not None:
+        self.channel_store.append(rows)
+      else:
+        self.channel_data.extend(rows)
   
   def start_scrape_loops(self, start_terms):
     if hasattr(start_terms, '__len__') and len(start_terms) == 0:
@@ -406,24 +1210,49 @@ class YTSManager():
     if isinstance(start_terms, str):
       start_terms = (start_terms,)
     
-    for start_term in start_terms:
-      yts = YouTubeScraper()
-      thread = threading.Thread(target=yts._scrape_loop, args=(start_term, self._stop_check))
-      self._threads[thread] = (start_term, yts)
-      thread.start()
+    self._start_scrape_loops(start_terms, self._scrape_epoch)
       
     if not self.is_thread_checking_active():
       self._start_check_video_thread()
+
+  def _start_scrape_loops(self, start_terms, epoch):
+    """
+    Starts a scrape loop for each term. Scrapers are created outside of the thread lock,
+    as they may wait minutes for a browser session, and are dropped if `stop_scraping`
+    ran in the meantime, which it marks by moving on to a new `epoch`.
+    """
+    for start_term in start_terms:
+      try:
+        yts = self._new_scraper()
+      except Exception as e:
+        # E.g. no browser session became available, the term is retried on the next check
+        print(f'Could not start a scraper for "{start_term}": {e}')
+        with self._thread_lock:
+          if epoch == self._scrape_epoch:
+            self._pending_start_terms.append(start_term)
+        continue
+
+      with self._thread_lock:
+        if epoch != self._scrape_epoch:
+          yts.terminate()
+          continue
+        if self.frontier is not None:
+          thread = threading.Thread(target=yts._frontier_loop,
+            args=(start_term, self.frontier, self._stop_check))
+        else:
+          thread = threading.Thread(target=yts._scrape_loop, args=(start_term, self._stop_check))
+        self._threads[thread] = (start_term, yts)
+        thread.start()
       
   def _check_video_threads(self):
     """Check to renew dead threads and flush video data buffers on a regular interval."""
-    while len(self._threads) > 0:
+    while len(self._threads) > 0 or self._pending_start_terms:
       time.sleep(self._video_flush_interval)
       
       with self._thread_lock:
         # Flush video data on all threads
         for thread, (start_term, yts) in self._threads.items():
-          self.video_data.extend(yts.flush_video_data())
+          self._save_video_data(yts.flush_video_data())
             
         # Remove deleted threads, but keep the start words
         start_words_refresh_list = []
@@ -433,25 +1262,26 @@ class YTSManager():
             updated_threads[thread] = (sw, yts)
           else:
             yts.terminate()
+            self._metrics.count('worker_restarts')
             start_words_refresh_list.append(sw)
         self._threads = updated_threads
         
-        # Refresh any removed threads
-        self.start_scrape_loops(start_words_refresh_list)
+        # Refresh any removed threads, and those that could not be started before
+        start_words_refresh_list += self._pending_start_terms
+        self._pending_start_terms = []
+        epoch = self._scrape_epoch
+      self._start_scrape_loops(start_words_refresh_list, epoch)
         
   def is_thread_checking_active(self):
     return self.checking_thread and self.checking_thread.is_alive()
 
-  def is_channel_thread_checking_active(self):
-    return self.channel_checking_thread and self.channel_checking_thread.is_alive()
+  def is_channel_scraping_active(self):
+    return self.channel_scrape_thread is not None and self.channel_scrape_thread.is_alive()
         
   def _start_check_video_thread(self):
     self.checking_thread = threading.Thread(target=self._check_video_threads)
     self.checking_thread.start()
 
-  def _start_check_channel_thread(self):
-    self.channel_checking_thread = threading.Thread(target=self._check_channel_threads)
-    self.channel_checking_thread.start()
                    
   def _stop_check(self):
     return self._stop_scrape_thread
@@ -461,123 +1291,153 @@ class YTSManager():
       self._stop_scrape_thread = True
       for thread, (_, yts) in self._threads.items():
         thread.join()
+        self._save_video_data(yts.flush_video_data())
         yts.terminate()
       self._stop_scrape_thread = False
+      self._scrape_epoch += 1
       self._threads = {}
+      self._pending_start_terms = []
 
   def stop_channel_scraping(self):
+    """Cancels the channels that have not started yet and waits for the running ones to be saved."""
     print('Stopping channel scraping')
-    with self._thread_lock:
-      self._stop_scrape_thread = True
-      print('Scrapers:', self.scrapers, 'Threads:', self._threads)
-      for thread, yts in self._threads.items():
-        print('Found thread:', thread)
-        if thread.is_alive():
-          print('Thread is alive')
-          thread.join()
-          print('Thread joined')
-        yts.terminate()
-        print('Thread scraper terminated')
-      for scraper in self.scrapers:
-        scraper.terminate()
-        print('Scraper terminated')
-      self._threads = {}
-      self.scrapers = []
-      self._stop_scrape_thread = False
+    self._channel_stop.set()
+    if self.channel_scrape_thread is not None:
+      self.channel_scrape_thread.join()
+      self.channel_scrape_thread = None
       
   def print_status(self):
-    print('# Videos Scraped: {}'.format(len(self.video_data)))
+    print('# Videos Scraped: {}'.format(self.n_videos_scraped))
     print('# Threads Running: {}'.format(len(self._threads)))
 
   def print_channel_status(self):
-    print('# Channels Scraped: {}'.format(len(self.channel_data)))
-    print('# Threads Running: {}'.format(len(self._threads)))
+    print('# Channels Scraped: {} / {} ({} failed)'.format(
+      self.n_channels_done, self.n_channels_queued, self.n_channels_failed))
+    print('# Workers Running: {}'.format(self.n_channel_workers))
+
+  def stats(self):
+    """
+    Returns the scraping progress as a dict. If the manager was given metrics, it also
+    holds the time spent per stage and the event counts of every scraper under `metrics`.
+    """
+    stats = {
+      'videos_scraped': self.n_videos_scraped,
+      'video_threads': len(self._threads),
+      'channel_rows_scraped': self.n_channels_scraped,
+      'channels_queued': self.n_channels_queued,
+      'channels_done': self.n_channels_done,
+      'channels_failed': self.n_channels_failed,
+      'channel_workers': self.n_channel_workers
+    }
+    if self.metrics is not None:
+      stats['metrics'] = self.metrics.stats()
+    return stats
+
+  def print_stage_times(self):
+    """Prints where the scrapers spent their time and the event counts, if metrics are enabled."""
+    if self.metrics is None:
+      return
+    totals = self.metrics.stats()['totals']
+    total_seconds = sum(timer['seconds'] for timer in totals['timers'].values()) or 1.0
+    print(' | '.join('{}: {:.1f}s ({:.0%})'.format(stage, timer['seconds'], timer['seconds'] / total_seconds)
+                     for stage, timer in sorted(totals['timers'].items())))
+    print(' | '.join('{}: {}'.format(counter, n) for counter, n in sorted(totals['counters'].items())))
 
   def get_dataframe(self):
+    if self.video_store is not None:
+      return self.video_store.read()
     return pd.DataFrame(self.video_data)
 
   def get_channel_dataframe(self):
+    if self.channel_store is not None:
+      return self.channel_store.read()
     return pd.DataFrame(self.channel_data)
 
-  def start_channel_scrape_loops(self, channel_names, channel_urls, n_workers=8):
+  def start_channel_scrape_loops(self, channel_names, channel_urls, n_workers=8, on_channel_done=None):
+    """
+    Scrapes channels on a pool of `n_workers` threads that each keep one scraper alive for
+    the whole run. Only `CHANNEL_QUEUE_FACTOR` channels per worker are queued at a time, and
+    rows are saved as soon as each channel finishes, after which
+    `on_channel_done(channel_name, channel_url, rows)` is called if it is given.
+    Returns immediately, `stop_channel_scraping` cancels the remaining channels.
+    """
+    self._channel_stop.clear()
     self.channel_scrape_thread = threading.Thread(
       target=self._run_channel_scrape_loops,
-      args=(channel_names, channel_urls, n_workers))
+      args=(channel_names, channel_urls, n_workers, on_channel_done))
     self.channel_scrape_thread.start()
 
-  def _run_channel_scrape_loops(self, channel_names, channel_urls, n_workers=8):
-    if hasattr(channel_urls, '__len__') and len(channel_urls) == 0:
-      return
-    
-    # Scraping agents are reused by the threads created below
-    self.scrapers = [YouTubeScraper() for _ in range(n_workers)]
-
-    early_stop = False
-    i = 0
-    while i < len(channel_names):
-      if len(self._threads) < n_workers:
-        # Create a new thread for a new channel
-        channel_name = channel_names[i]
-        channel_url = channel_urls[i]
-        with self._thread_lock:
-          if len(self.scrapers) == 0:
-              print('No scrapers available, stopping scraping')
-              early_stop = True
-              break
-          yts = self.scrapers.pop(0)
-          thread = threading.Thread(target=yts._scrape_channel_page,
-            args=(channel_name, channel_url))
-          self._threads[thread] = yts
-          thread.start()
-
-        if early_stop:
-          break
+  def _channel_worker_scraper(self):
+    """Returns the scraper of the calling pool thread, creating it on first use."""
+    scraper = getattr(self._channel_local, 'scraper', None)
+    if scraper is None:
+      scraper = self._new_scraper()
+      self._channel_local.scraper = scraper
+      with self._thread_lock:
+        self.scrapers.append(scraper)
+    return scraper
 
-        i += 1
+  def _scrape_channel(self, channel_name, channel_url):
+    if self._channel_stop.is_set():
+      return []
+    scraper = self._channel_worker_scraper()
+    if self.channel_history:
+      scraper._scrape_channel_history(
+        channel_name, channel_url, self.known_channel_videos.get(channel_url))
+    else:
+      scraper._scrape_channel_page(channel_name, channel_url)
+    return scraper.flush_channel_data()
 
-      # Wait for the channel sleep time
-      time.sleep(self._channel_scrape_interval)
+  def _on_channel_done(self, future, channel_name, channel_url, in_flight, on_channel_done):
+    in_flight.release()
+    if future.cancelled():
+      return
+    try:
+      rows = future.result()
+    except Exception as e:
+      print(f'Scraping channel "{channel_url}" failed with exception: {e}')
+      rows = []
+      with self._save_lock:
+        self.n_channels_failed += 1
 
-      # Get rid of dead threads
-      with self._thread_lock:
-        updated_threads = {}
-        for thread, yts in self._threads.items():
-          if thread.is_alive():
-            updated_threads[thread] = yts
-          else:
-            self.scrapers.append(yts)
-        self._threads = updated_threads
+    self._save_channel_data(rows)
+    with self._save_lock:
+      self.n_channels_done += 1
+    if on_channel_done is not None:
+      on_channel_done(channel_name, channel_url, rows)
 
-      if not self.is_channel_thread_checking_active():
-        # Starts a thread to periodically flush data
-        self._start_check_channel_thread()
+  def _run_channel_scrape_loops(self, channel_names, channel_urls, n_workers=8, on_channel_done=None):
+    if hasattr(channel_urls, '__len__') and len(channel_urls) == 0:
+      return
 
-      if self._stop_check():
-        early_stop = True
-        break
+    self.n_channels_queued = len(channel_urls)
+    self.n_channels_done = 0
+    self.n_channels_failed = 0
+    self.n_channel_workers = n_workers
+    # Backpressure, the pool never holds more than a few channels per worker
+    in_flight = threading.BoundedSemaphore(n_workers * CHANNEL_QUEUE_FACTOR)
 
-    # Wait for all threads to finish
-    if not early_stop:
+    executor = ThreadPoolExecutor(max_workers=n_workers)
+    try:
+      for channel_name, channel_url in zip(channel_names, channel_urls):
+        while not in_flight.acquire(timeout=1.0):
+          if self._channel_stop.is_set():
+            break
+        if self._channel_stop.is_set():
+          break
+        future = executor.submit(self._scrape_channel, channel_name, channel_url)
+        future.add_done_callback(functools.partial(
+          self._on_channel_done, channel_name=channel_name, channel_url=channel_url,
+          in_flight=in_flight, on_channel_done=on_channel_done))
+    finally:
+      executor.shutdown(wait=True, cancel_futures=self._channel_stop.is_set())
       with self._thread_lock:
-        updated_threads = {}
-        for thread, yts in self._threads.items():
-          if thread.is_alive():
-            thread.join()
-          yts.terminate()
         for scraper in self.scrapers:
+          self._save_channel_data(scraper.flush_channel_data())
           scraper.terminate()
         self.scrapers = []
-        self._threads = {}
-
-  def _check_channel_threads(self):
-    """Check to renew dead threads and flush video data buffers on a regular interval."""
-    while len(self._threads) > 0:
-      time.sleep(self._channel_flush_interval)
-      
-      with self._thread_lock:
-        # Flush video data on all threads
-        for _, yts in self._threads.items():
-          self.channel_data.extend(yts.flush_channel_data())
+      self._channel_local = threading.local()
+      self.n_channel_workers = 0
 
 if __name__ == '__main__':
   try:
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import threading
+from urllib.parse import parse_qs, urlparse
+
+
+VIDEO = 'video'
+CHANNEL = 'channel'
+
+
+def canonical_video_id(url):
+  """Returns the video ID of a YT watch, shorts or youtu.be URL, or the URL itself if it has none."""
+  parsed = urlparse(url)
+  if parsed.netloc.endswith('youtu.be'):
+    return parsed.path.strip('/') or url
+  video_ids = parse_qs(parsed.query).get('v')
+  if video_ids:
+    return video_ids[0]
+  parts = parsed.path.strip('/').split('/')
+  if len(parts) == 2 and parts[0] in ('shorts', 'embed', 'live'):
+    return parts[1]
+  return url
+
+def canonical_channel_url(url):
+  """Strips the scheme, query, trailing slashes and tab (e.g. /videos) from a channel URL."""
+  parsed = urlparse(url)
+  path = parsed.path.rstrip('/')
+  for tab in ('/videos', '/featured', '/streams', '/shorts'):
+    if path.endswith(tab):
+      path = path[:-len(tab)]
+  return parsed.netloc.lower().replace('m.youtube.com', 'www.youtube.com') + path
+
+CANONICALIZERS = {
+  VIDEO: canonical_video_id,
+  CHANNEL: canonical_channel_url
+}
+
+
+class SeenIndex():
+  """
+  Set of already scraped videos and channels that is shared by all scraper
+  threads, processes and runs.
+
+  Lookups hit an in-memory set of canonical keys first. Misses fall through
+  to a SQLite file, which other processes write to as well, and new keys are
+  written to it immediately so they survive restarts. The whole file is
+  loaded into memory on startup.
+  """
+  def __init__(self, path='data/seen_urls.sqlite'):
+    dir_name = os.path.dirname(path)
+    if dir_name:
+      os.makedirs(dir_name, exist_ok=True)
+    self.path = path
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+    with self._lock, self._conn:
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute('PRAGMA synchronous=NORMAL')
+      self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS seen (kind TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (kind, key))')
+      rows = self._conn.execute('SELECT kind, key FROM seen').fetchall()
+
+    self._seen = {kind: set() for kind in CANONICALIZERS}
+    for kind, key in rows:
+      self._seen.setdefault(kind, set()).add(key)
+
+  def __len__(self):
+    return sum(len(keys) for keys in self._seen.values())
+
+  def _key(self, kind, url):
+    return CANONICALIZERS[kind](url)
+
+  def contains(self, kind, url):
+    key = self._key(kind, url)
+    if key in self._seen[kind]:
+      return True
+
+    # Another process may have added it since it was loaded
+    with self._lock:
+      row = self._conn.execute(
+        'SELECT 1 FROM seen WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+    if row is not None:
+      self._seen[kind].add(key)
+      return True
+    return False
+
+  def add(self, kind, url):
+    """Marks a URL as seen. Returns False if it had already been seen by any thread or process."""
+    key = self._key(kind, url)
+    if key in self._seen[kind]:
+      return False
+    with self._lock, self._conn:
+      cursor = self._conn.execute(
+        'INSERT OR IGNORE INTO seen (kind, key) VALUES (?, ?)', (kind, key))
+    self._seen[kind].add(key)
+    return cursor.rowcount == 1
+
+  def filter_unseen(self, kind, urls):
+    return [url for url in urls if not self.contains(kind, url)]
+
+  def clear(self, kind):
+    """Forgets every URL of one kind, e.g. to scrape all channels again."""
+    with self._lock, self._conn:
+      self._conn.execute('DELETE FROM seen WHERE kind = ?', (kind,))
+    self._seen[kind] = set()
+
+  def close(self):
+    with self._lock:
+      self._conn.close()
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from embedding_store import EmbeddingStore
+
+
+INDEX_META_FILE = 'index.json'
+CENTROIDS_FILE = 'centroids.npy'
+LISTS_FILE = 'lists.npy'
+# Below this many vectors an exact search is fast enough and needs no training
+EXACT_MAX_ROWS = 100000
+BLOCK_ROWS = 65536
+KMEANS_ITERATIONS = 10
+TRAIN_ROWS_PER_LIST = 64
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Builds a similarity index over thumbnail features.')
+    parser.add_argument('-s', '--feature_store', type=str, default='data/thumbnail_features',
+                        help='Embedding store directory written by prepare_data.py')
+    parser.add_argument('-o', '--index_dir', type=str, default='data/thumbnail_index',
+                        help='Directory of the index, features not in an existing index are added to it')
+    parser.add_argument('--n_lists', type=int, default=None,
+                        help='Number of IVF clusters, 0 for exact search, defaults to a size based choice')
+    parser.add_argument('--n_probe', type=int, default=16,
+                        help='Clusters searched per query')
+    parser.add_argument('--duplicates_output', type=str, default=None,
+                        help='CSV file to write pairs of near-duplicate thumbnails to')
+    parser.add_argument('--threshold', type=float, default=0.95,
+                        help='Cosine similarity above which two thumbnails are near-duplicates')
+
+    return parser.parse_args()
+
+def _save_atomic(path, array):
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def _default_n_lists(n_rows):
+    return 0 if n_rows < EXACT_MAX_ROWS else int(4 * np.sqrt(n_rows))
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k):
+    """Merges new candidate scores into the running top-k of each query, best first."""
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_rows = np.concatenate([best_rows, rows], axis=1)
+    if all_scores.shape[1] > k:
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        all_scores = np.take_along_axis(all_scores, top, axis=1)
+        all_rows = np.take_along_axis(all_rows, top, axis=1)
+    order = np.argsort(-all_scores, axis=1, kind='stable')
+    return np.take_along_axis(all_scores, order, axis=1), np.take_along_axis(all_rows, order, axis=1)
+
+def train_centroids(vectors, n_lists, n_iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means over unit vectors, returns (n_lists, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(n_iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_lists)
+        # Empty clusters restart from a random vector
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), empty.sum())]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class SimilarityIndex():
+    """
+    Cosine similarity top-k search over feature vectors, stored in a directory.
+
+    Vectors are normalized and kept in an `EmbeddingStore` in the index directory, so
+    they are memory-mapped and only the rows a query touches are read. Small indexes
+    are searched exactly, block by block. Larger ones are an inverted file (IVF): the
+    vectors are clustered by k-means and a query is only compared exactly with the
+    vectors of the `n_probe` clusters whose centroids are closest, which makes search
+    time depend on the cluster sizes rather than on the number of vectors. Added vectors
+    are assigned to the existing clusters, rebuilding re-clusters everything.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.n_probe = meta['n_probe']
+        self.store = EmbeddingStore(path)
+        self.centroids = None
+        if meta['n_lists'] > 0:
+            self.centroids = np.load(os.path.join(path, CENTROIDS_FILE))
+
+        lists = np.load(os.path.join(path, LISTS_FILE))[:len(self.store)]
+        if len(lists) < len(self.store):
+            # An add was interrupted after its vectors were stored, assign the rest now
+            lists = np.concatenate([lists, self._assign(self.store.vectors[len(lists):])])
+        self._set_lists(lists)
+
+    @classmethod
+    def build(cls, path, ids, vectors, n_lists=None, n_probe=16, dtype='float16', seed=0):
+        """
+        Writes a new index, replacing any index already at `path`. `vectors` may be a
+        memory-mapped array, it is read in blocks and k-means only sees a sample of it.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if n_lists is None:
+            n_lists = _default_n_lists(len(ids))
+        n_lists = min(n_lists, len(ids))
+
+        store = EmbeddingStore.create(path, ids[:0], np.zeros((0, vectors.shape[1])), dtype=dtype)
+        for start in range(0, len(ids), BLOCK_ROWS):
+            store.append(ids[start:start + BLOCK_ROWS], _normalize(vectors[start:start + BLOCK_ROWS]))
+        if n_lists > 0:
+            rng = np.random.default_rng(seed)
+            n_train = min(len(ids), n_lists * TRAIN_ROWS_PER_LIST)
+            train_vectors = _normalize(vectors[np.sort(rng.choice(len(ids), n_train, replace=False))])
+            centroids = train_centroids(train_vectors, n_lists, seed=seed)
+            _save_atomic(os.path.join(path, CENTROIDS_FILE), centroids)
+        _save_atomic(os.path.join(path, LISTS_FILE), np.zeros(0, dtype=np.int32))
+        with open(os.path.join(path, INDEX_META_FILE), 'w') as f:
+            json.dump({'n_lists': n_lists, 'n_probe': n_probe}, f)
+
+        index = cls(path)
+        index._save_lists()
+        return index
+
+    @classmethod
+    def from_store(cls, path, store, **build_kwargs):
+        """Builds an index over every vector of an `EmbeddingStore`, e.g. the thumbnail features."""
+        return cls.build(path, np.asarray(store.ids), store.vectors, **build_kwargs)
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def n_lists(self):
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def _assign(self, vectors):
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int32)
+        assignments = [np.argmax(_normalize(vectors[start:start + BLOCK_ROWS]) @ self.centroids.T, axis=1)
+                       for start in range(0, len(vectors), BLOCK_ROWS)]
+        return np.concatenate(assignments).astype(np.int32) if assignments else np.zeros(0, dtype=np.int32)
+
+    def _set_lists(self, lists):
+        self._lists = lists
+        # Rows of each cluster are contiguous in `_list_rows`, in row order
+        self._list_rows = np.argsort(lists, kind='stable')
+        self._list_offsets = np.zeros(max(self.n_lists, 1) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=max(self.n_lists, 1)), out=self._list_offsets[1:])
+
+    def _save_lists(self):
+        _save_atomic(os.path.join(self.path, LISTS_FILE), self._lists)
+
+    def add(self, ids, vectors):
+        """Adds vectors for IDs that are not in the index yet, without re-clustering."""
+        vectors = _normalize(vectors)
+        lists = np.concatenate([self._lists, self._assign(vectors)])
+        self.store.append(ids, vectors)
+        self._set_lists(lists)
+        self._save_lists()
+
+    def _search_exact(self, queries, k):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self.store), BLOCK_ROWS):
+            block = np.asarray(self.store.vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            best_scores, best_rows = _merge_top_k(best_scores, best_rows, scores, rows, k)
+        return best_scores, best_rows
+
+    def _search_ivf(self, queries, k, n_probe):
+        n_probe = min(n_probe, self.n_lists)
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        # Each probed cluster is read once and compared with every query that probes it
+        query_idxs = np.repeat(np.arange(len(queries)), n_probe)
+        probed_lists = probes.reshape(-1)
+        order = np.argsort(probed_lists, kind='stable')
+        boundaries = np.flatnonzero(np.diff(probed_lists[order])) + 1
+        for group in np.split(order, boundaries):
+            list_idx = probed_lists[group[0]]
+            rows = self._list_rows[self._list_offsets[list_idx]:self._list_offsets[list_idx + 1]]
+            if len(rows) == 0:
+                continue
+            group_queries = query_idxs[group]
+            scores = queries[group_queries] @ np.asarray(self.store.vectors[rows], dtype=np.float32).T
+            merged_scores, merged_rows = _merge_top_k(
+                best_scores[group_queries], best_rows[group_queries],
+                scores, np.broadcast_to(rows, scores.shape), k)
+            best_scores[group_queries] = merged_scores
+            best_rows[group_queries] = merged_rows
+        return best_scores, best_rows
+
+    def search(self, queries, k=10, n_probe=None):
+        """
+        Returns (ids, similarities), both of shape (n_queries, k), of the vectors most
+        similar to each query, best first. `queries` is one vector or an array of them.
+        Missing results, when fewer than k vectors were searched, have ID -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        single = queries.ndim == 1
+        queries = _normalize(queries.reshape(1, -1) if single else queries)
+
+        if len(self.store) == 0:
+            scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+            rows = np.full((len(queries), k), -1, dtype=np.int64)
+        elif self.centroids is None:
+            scores, rows = self._search_exact(queries, k)
+        else:
+            scores, rows = self._search_ivf(queries, k, n_probe or self.n_probe)
+
+        ids = np.where(rows >= 0, np.asarray(self.store.ids)[np.maximum(rows, 0)], -1)
+        if scores.shape[1] < k:
+            pad = k - scores.shape[1]
+            scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+            ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+        if single:
+            return ids[0], scores[0]
+        return ids, scores
+
+    def search_ids(self, ids, k=10, n_probe=None):
+        """Like `search`, with the stored vectors of `ids` as the queries. Each ID finds itself first."""
+        return self.search(self.store.lookup(ids), k, n_probe)
+
+    def find_duplicates(self, threshold=0.95, k=10, batch_size=1024, n_probe=None, progress=False):
+        """
+        Returns a DataFrame of (id_a, id_b, similarity), with id_a < id_b, for every vector
+        and each of its `k` nearest neighbors with a cosine similarity of at least `threshold`.
+        """
+        all_ids = np.asarray(self.store.ids)
+        pairs = []
+        for start in tqdm(range(0, len(all_ids), batch_size), desc='Duplicates', disable=not progress):
+            batch_ids = all_ids[start:start + batch_size]
+            ids, scores = self.search_ids(batch_ids, k + 1, n_probe)
+            query_ids = np.broadcast_to(batch_ids[:, None], ids.shape)
+            match = (scores >= threshold) & (ids >= 0) & (query_ids < ids)
+            pairs.append(pd.DataFrame({
+                'id_a': query_ids[match], 'id_b': ids[match], 'similarity': scores[match]}))
+        if not pairs:
+            return pd.DataFrame(columns=['id_a', 'id_b', 'similarity'])
+        return pd.concat(pairs, ignore_index=True)
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    store = EmbeddingStore(args.feature_store)
+    if os.path.isfile(os.path.join(args.index_dir, INDEX_META_FILE)):
+        index = SimilarityIndex(args.index_dir)
+        new_ids = np.asarray(store.ids)[~index.store.contains(store.ids)]
+        for start in range(0, len(new_ids), BLOCK_ROWS):
+            batch_ids = new_ids[start:start + BLOCK_ROWS]
+            index.add(batch_ids, store.lookup(batch_ids))
+        print(f'Added {len(new_ids)} features to the index')
+    else:
+        index = SimilarityIndex.from_store(args.index_dir, store, n_lists=args.n_lists, n_probe=args.n_probe)
+        print(f'Indexed {len(index)} features in {index.n_lists} clusters')
+
+    if args.duplicates_output:
+        duplicates = index.find_duplicates(args.threshold, n_probe=args.n_probe, progress=True)
+        duplicates.to_csv(args.duplicates_output, index=False)
+        print(f'Found {len(duplicates)} near-duplicate pairs')
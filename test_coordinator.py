@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from coordinator import CHANNEL, DONE, FAILED, LEASED, PENDING, SEARCH, VIDEO, CrawlWorker, SQLiteTaskQueue
+
+
+@pytest.fixture
+def task_queue(tmp_path):
+  task_queue = SQLiteTaskQueue(str(tmp_path / 'tasks.sqlite'), lease_seconds=60, max_attempts=2)
+  yield task_queue
+  task_queue.close()
+
+def task_state(task_queue, task):
+  with task_queue._lock:
+    return task_queue._conn.execute('SELECT state, worker, error FROM tasks WHERE id = ?', (task.id,)).fetchone()
+
+def expire_leases(task_queue):
+  with task_queue._lock:
+    task_queue._conn.execute('UPDATE tasks SET lease_expires = ?', (time.time() - 1,))
+
+
+def test_put_deduplicates_tasks(task_queue):
+  assert task_queue.put(VIDEO, {'url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa'})
+  assert not task_queue.put(VIDEO, {'url': 'https://youtu.be/aaaaaaaaaaa'})
+  assert task_queue.put_many(SEARCH, [{'term': 'bread'}, {'term': 'bread'}, {'term': 'cake'}]) == 2
+  assert task_queue.counts() == {f'{VIDEO}/{PENDING}': 1, f'{SEARCH}/{PENDING}': 2}
+
+def test_lease_by_priority_and_kind(task_queue):
+  task_queue.put(SEARCH, {'term': 'bread'}, priority=1)
+  task_queue.put(CHANNEL, {'name': 'A', 'url': 'https://www.youtube.com/@a'}, priority=0)
+
+  assert task_queue.lease('w1', kinds=(SEARCH,)).payload == {'term': 'bread'}
+  task = task_queue.lease('w1')
+  assert task.kind == CHANNEL and task.attempts == 1
+  assert task_queue.lease('w2') is None
+  assert task_state(task_queue, task)[:2] == (LEASED, 'w1')
+
+def test_complete_and_fail(task_queue):
+  task_queue.put_many(SEARCH, [{'term': 'bread'}, {'term': 'cake'}])
+  done, failed = task_queue.lease('w1'), task_queue.lease('w1')
+  task_queue.complete(done, 'w1')
+  task_queue.fail(failed, 'w1', IOError('no page'))
+  assert task_state(task_queue, done)[0] == DONE
+  assert task_state(task_queue, failed) == (PENDING, 'w1', 'no page')
+
+  # The second failure uses up the attempts
+  task = task_queue.lease('w2')
+  assert task.id == failed.id and task.attempts == 2
+  task_queue.fail(task, 'w2', IOError('no page'))
+  assert task_state(task_queue, task)[0] == FAILED
+  assert task_queue.lease('w2') is None
+
+def test_expired_lease_is_reclaimed(task_queue):
+  task_queue.put(SEARCH, {'term': 'bread'})
+  task = task_queue.lease('w1')
+  expire_leases(task_queue)
+
+  reclaimed = task_queue.lease('w2')
+  assert reclaimed.id == task.id and reclaimed.attempts == 2
+  # The first worker lost the task, so its late result is ignored
+  task_queue.complete(task, 'w1')
+  assert task_state(task_queue, task)[:2] == (LEASED, 'w2')
+
+def test_heartbeat_keeps_lease(task_queue):
+  task_queue.put(SEARCH, {'term': 'bread'})
+  task = task_queue.lease('w1')
+  expire_leases(task_queue)
+  task_queue.heartbeat('w1')
+  assert task_queue.lease('w2') is None
+  assert task_state(task_queue, task)[:2] == (LEASED, 'w1')
+
+def test_expired_lease_without_attempts_left_fails(task_queue):
+  task_queue.put(SEARCH, {'term': 'bread'})
+  task_queue.lease('w1')
+  expire_leases(task_queue)
+  task = task_queue.lease('w2')
+  expire_leases(task_queue)
+
+  assert task_queue.lease('w3') is None
+  assert task_state(task_queue, task) == (FAILED, 'w2', 'Lease expired')
+
+
+class FailingScraper():
+  """Scraper whose pages never load, it stops `worker` after the first attempt."""
+  def __init__(self, worker):
+    self.worker = worker
+
+  def _navigate(self, url):
+    self.worker.stop()
+    return False
+
+  def scrape_vid_data(self):
+    raise AssertionError('Scraped a page that did not load')
+
+  def terminate(self):
+    pass
+
+def test_video_that_did_not_load_is_retried(task_queue):
+  worker = CrawlWorker(task_queue, lambda: FailingScraper(worker), video_store=None, channel_store=None,
+                       worker_id='w1', kinds=(VIDEO,))
+  task_queue.put(VIDEO, {'url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa', 'depth': 0})
+
+  worker._thread_loop()
+  assert (worker.n_completed, worker.n_failed) == (0, 1)
+  assert task_queue.counts() == {f'{VIDEO}/{PENDING}': 1}
+  with task_queue._lock:
+    assert task_queue._conn.execute('SELECT error FROM tasks').fetchone() == ('Video page did not load',)
@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+
+import driver_pool
+from driver_pool import DriverPool
+
+
+class FakeDriver():
+  def __init__(self):
+    self.healthy = True
+    self.n_quits = 0
+
+  def execute_script(self, script):
+    if not self.healthy:
+      raise IOError('session is gone')
+    return 1
+
+  def quit(self):
+    self.n_quits += 1
+
+class FakeFactory():
+  """Returns new `FakeDriver`s, after raising for the first `n_failures` calls."""
+  def __init__(self, n_failures=0):
+    self.n_failures = n_failures
+    self.n_calls = 0
+    self.drivers = []
+
+  def __call__(self):
+    self.n_calls += 1
+    if self.n_calls <= self.n_failures:
+      raise IOError('browser did not start')
+    self.drivers.append(FakeDriver())
+    return self.drivers[-1]
+
+@pytest.fixture
+def make_pool():
+  pools = []
+  def make_pool(factory, **kwargs):
+    pools.append(DriverPool(factory, **kwargs))
+    return pools[-1]
+  yield make_pool
+  for pool in pools:
+    pool.close()
+
+
+def test_acquire_and_release(make_pool):
+  factory = FakeFactory()
+  pool = make_pool(factory, size=1)
+  driver = pool.acquire(timeout=5)
+  pool.release(driver, pages=3)
+
+  assert pool.acquire(timeout=5) is driver
+  assert pool._pages[driver] == 3
+  assert (pool.n_created, pool.n_recycled, pool.n_failed) == (1, 0, 0)
+
+def test_acquire_times_out(make_pool):
+  pool = make_pool(FakeFactory(), size=1)
+  pool.acquire(timeout=5)
+  with pytest.raises(TimeoutError):
+    pool.acquire(timeout=0.05)
+
+def test_unhealthy_session_is_replaced(make_pool):
+  factory = FakeFactory()
+  pool = make_pool(factory, size=1)
+  driver = pool.acquire(timeout=5)
+  driver.healthy = False
+  pool.release(driver)
+
+  replacement = pool.acquire(timeout=5)
+  assert replacement is not driver
+  assert driver.n_quits == 1
+  assert pool.n_failed == 1
+
+def test_session_is_recycled_after_max_pages(make_pool):
+  pool = make_pool(FakeFactory(), size=1, max_pages=10)
+  driver = pool.acquire(timeout=5)
+  pool.release(driver, pages=6)
+  assert pool.acquire(timeout=5) is driver
+  assert pool.needs_recycle(driver, pages=4)
+  pool.release(driver, pages=4)
+
+  assert pool.acquire(timeout=5) is not driver
+  assert driver.n_quits == 1
+  assert pool.n_recycled == 1
+
+def test_session_is_recycled_above_max_rss(make_pool):
+  pool = make_pool(FakeFactory(), size=1, max_pages=None, max_rss_mb=100, rss_func=lambda driver: 150.0)
+  driver = pool.acquire(timeout=5)
+  pool.release(driver)
+  assert pool.acquire(timeout=5) is not driver
+
+def test_failed_starts_are_retried(make_pool, monkeypatch):
+  monkeypatch.setattr(driver_pool, 'CREATE_RETRY_DELAY_SECONDS', 0.01)
+  factory = FakeFactory(n_failures=3)
+  pool = make_pool(factory, size=1)
+
+  assert pool.acquire(timeout=5) is factory.drivers[0]
+  assert factory.n_calls == 4
+
+def test_close_quits_sessions(make_pool):
+  pool = make_pool(FakeFactory(), size=2)
+  leased = pool.acquire(timeout=5)
+  idle = pool.acquire(timeout=5)
+  pool.release(idle)
+  pool.close()
+
+  assert idle.n_quits == 1
+  pool.release(leased)
+  assert leased.n_quits == 1
+  with pytest.raises(RuntimeError):
+    pool.acquire(timeout=5)
+
+def test_session_started_after_close_is_quit():
+  started = threading.Event()
+  proceed = threading.Event()
+  drivers = []
+  def slow_factory():
+    started.set()
+    proceed.wait()
+    drivers.append(FakeDriver())
+    return drivers[-1]
+
+  pool = DriverPool(slow_factory, size=1)
+  started.wait(5)
+  pool.close()
+  proceed.set()
+  for thread in threading.enumerate():
+    if thread is not threading.current_thread() and thread.daemon:
+      thread.join(0.5)
+  assert drivers[0].n_quits == 1
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('torchvision')
+import feature_extraction
+
+
+def test_compare_features():
+    reference = np.array([[1.0, 0.0], [0.0, 2.0]], dtype=np.float32)
+    features = np.array([[1.0, 0.0], [0.0, -2.0]], dtype=np.float32)
+    assert feature_extraction.compare_features(reference, reference) == {
+        'mean_cosine': 1.0, 'min_cosine': 1.0, 'max_abs_diff': 0.0}
+    assert feature_extraction.compare_features(reference, features) == {
+        'mean_cosine': 0.0, 'min_cosine': -1.0, 'max_abs_diff': 4.0}
+
+def test_empty_dataset_is_rejected():
+    with pytest.raises(ValueError):
+        feature_extraction.benchmark([], n_workers=0)
+    with pytest.raises(ValueError):
+        feature_extraction.compare_precisions([], n_workers=0)
+
+def test_int8_is_cpu_only():
+    with pytest.raises(ValueError):
+        feature_extraction.FeatureExtractionEngine(precision='int8', device='cuda')
@@ -0,0 +1,27 @@
+from frontier import CrawlFrontier
+
+
+def test_pop_returns_shallowest_unseen_entry():
+  frontier = CrawlFrontier()
+  assert frontier.push('https://www.youtube.com/watch?v=aaaaaaaaaaa', depth=2)
+  assert frontier.push('https://www.youtube.com/watch?v=bbbbbbbbbbb', depth=1)
+  # The same video under another URL form is only queued once
+  assert not frontier.push('https://youtu.be/bbbbbbbbbbb', depth=0)
+
+  assert frontier.pop(timeout=0).url.endswith('bbbbbbbbbbb')
+  assert frontier.pop(timeout=0).url.endswith('aaaaaaaaaaa')
+  assert frontier.pop(timeout=0) is None
+
+def test_requeue_until_max_attempts():
+  frontier = CrawlFrontier(max_attempts=2)
+  frontier.push('https://www.youtube.com/watch?v=aaaaaaaaaaa')
+  frontier.push('https://www.youtube.com/watch?v=bbbbbbbbbbb')
+
+  entry = frontier.pop(timeout=0)
+  assert frontier.requeue(entry)
+  # A requeued entry goes behind the entries of the same priority
+  assert frontier.pop(timeout=0).url.endswith('bbbbbbbbbbb')
+  assert frontier.pop(timeout=0) is entry
+  assert not frontier.requeue(entry)
+  assert frontier.n_failed == 1
+  assert frontier.pop(timeout=0) is None
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from label_parsing import labels_to_datetimes, labels_to_nums
+
+
+REFERENCE_DATE = '2023-01-22'
+
+
+@pytest.mark.parametrize('label, expected', [
+    ('12', 12),
+    (' 7 views', 7),
+    ('3,401 likes', 3401),
+    ('1,234,567 views', 1234567),
+    ('15K', 15000),
+    ('4.3K subscribers', 4300),
+    ('1.2M views', 1200000),
+    ('2.5B views', 2500000000),
+    ('No views', 0),
+    ('no likes', 0),
+])
+def test_labels_to_nums(label, expected):
+    values, valid = labels_to_nums([label])
+    assert values.dtype == np.int64
+    assert values.tolist() == [expected]
+    assert valid.tolist() == [True]
+
+@pytest.mark.parametrize('label', ['', 'views', 'abc 12', None, float('nan')])
+def test_labels_to_nums_invalid(label):
+    values, valid = labels_to_nums([label])
+    assert values.tolist() == [0]
+    assert valid.tolist() == [False]
+
+def test_labels_to_nums_repeated_labels():
+    values, valid = labels_to_nums(['1.2M views', None, '1.2M views', 'No views'])
+    assert values.tolist() == [1200000, 0, 1200000, 0]
+    assert valid.tolist() == [True, False, True, True]
+
+def test_labels_to_nums_empty():
+    values, valid = labels_to_nums([])
+    assert len(values) == 0 and len(valid) == 0
+
+
+@pytest.mark.parametrize('label, expected', [
+    ('Mar 2, 2021', '2021-03-02'),
+    ('Premiered Mar 2, 2021', '2021-03-02'),
+    ('Streamed live on Mar 2, 2021', '2021-03-02'),
+    ('3 weeks ago', '2023-01-01'),
+    ('1 year ago', '2022-01-22'),
+    ('Streamed 3 days ago', '2023-01-19'),
+    ('Premiered 2 hours ago', '2023-01-21T22:00'),
+])
+def test_labels_to_datetimes(label, expected):
+    values, valid = labels_to_datetimes([label], [REFERENCE_DATE])
+    assert values[0] == np.datetime64(expected)
+    assert valid.tolist() == [True]
+
+@pytest.mark.parametrize('label', ['yesterday', 'Premieres in 2 hours', 'Mar 32, 2021', '', None])
+def test_labels_to_datetimes_invalid(label):
+    values, valid = labels_to_datetimes([label], [REFERENCE_DATE])
+    assert np.isnat(values).tolist() == [True]
+    assert valid.tolist() == [False]
+
+def test_relative_dates_need_reference_dates():
+    values, valid = labels_to_datetimes(['3 weeks ago', 'Mar 2, 2021'])
+    assert np.isnat(values).tolist() == [True, False]
+    assert valid.tolist() == [False, True]
+
+def test_relative_dates_use_their_own_reference_date():
+    values, valid = labels_to_datetimes(
+        ['2 days ago', '2 days ago', 'Mar 2, 2021'], ['2023-01-22', '2023-03-10', None])
+    assert values.astype('datetime64[D]').astype(str).tolist() == ['2023-01-20', '2023-03-08', '2021-03-02']
+    assert valid.tolist() == [True, True, True]
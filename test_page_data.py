@@ -0,0 +1,176 @@
+import json
+import os
+
+import pytest
+
+import page_data
+from benchmarks import FakeSession, synthetic_watch_page
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WATCH_URL = page_data.YT_WATCH_URL_TEMPLATE.format('Xk4bC2pQmT8')
+CHANNEL_URL = 'https://www.youtube.com/@FixtureKitchen'
+
+
+def load_fixture(name):
+  with open(os.path.join(FIXTURE_DIR, name), 'r', encoding='utf-8') as f:
+    return f.read()
+
+def initial_data(name):
+  return page_data.extract_initial_json(load_fixture(name), 'ytInitialData')
+
+def thumbnail(video_id, query):
+  return f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg?sqp={query}'
+
+
+def test_extract_initial_json():
+  html = load_fixture('watch_page.html')
+  assert 'twoColumnWatchNextResults' in page_data.extract_initial_json(html, 'ytInitialData')['contents']
+  player_response = page_data.extract_initial_json(html, 'ytInitialPlayerResponse')
+  assert player_response['videoDetails']['videoId'] == 'Xk4bC2pQmT8'
+
+def test_extract_initial_json_window_assignment():
+  assert 'twoColumnBrowseResultsRenderer' in initial_data('channel_videos_page.html')['contents']
+  html = '<script>window["ytInitialData"] = {"a": {"b": "};"}};</script>'
+  assert page_data.extract_initial_json(html) == {'a': {'b': '};'}}
+
+def test_extract_initial_json_missing():
+  assert page_data.extract_initial_json('<html><body></body></html>') is None
+  assert page_data.extract_initial_json('<script>var ytInitialData = null;</script>') is None
+  assert page_data.extract_initial_json(load_fixture('search_page.html'), 'ytInitialPlayerResponse') is None
+
+def test_extract_ytcfg():
+  assert page_data.extract_ytcfg(load_fixture('search_page.html')) == {
+    'api_key': 'AIzaSyFixtureKey0000000000000000000000', 'client_version': '2.20231101.05.00'}
+  assert page_data.extract_ytcfg('<html></html>') == {'api_key': None, 'client_version': None}
+
+def test_parse_watch_page():
+  html = load_fixture('watch_page.html')
+  labels = page_data.parse_watch_page(
+    page_data.extract_initial_json(html, 'ytInitialData'),
+    page_data.extract_initial_json(html, 'ytInitialPlayerResponse'))
+  assert labels == {
+    'view_count': '1,234,567 views',
+    'date': 'Mar 2, 2021',
+    'video_title': 'Sourdough in 10 Steps (No Mixer)',
+    'video_description': 'Everything you need for a first loaf.\n\n0:00 Starter\n1:32 Autolyse',
+    'channel_name': 'Fixture Kitchen',
+    'channel_link': CHANNEL_URL,
+    'subscriber_count': '1.2M subscribers',
+    'likes': '48,213 likes'
+  }
+
+def test_parse_watch_page_player_response_fallback():
+  html = load_fixture('watch_page.html')
+  labels = page_data.parse_watch_page(None, page_data.extract_initial_json(html, 'ytInitialPlayerResponse'))
+  assert labels['video_title'] == 'Sourdough in 10 Steps (No Mixer)'
+  assert labels['view_count'] == '1234567 views'
+  assert labels['date'] == '2021-03-02'
+  assert labels['channel_name'] == 'Fixture Kitchen'
+  assert labels['channel_link'] == 'http://www.youtube.com/@FixtureKitchen'
+  assert labels['likes'] is None
+
+def test_parse_synthetic_benchmark_page():
+  # The scraper benchmarks run on these pages, so they must stay readable
+  html = synthetic_watch_page(1234)
+  labels = page_data.parse_watch_page(page_data.extract_initial_json(html, 'ytInitialData'), None)
+  assert labels['video_title'] == 'Synthetic video 1234'
+  assert None not in labels.values()
+
+def test_parse_suggested_videos():
+  # The radio mix and the playlist lockup are left out
+  assert page_data.parse_suggested_videos(initial_data('watch_page.html')) == [
+    {'video_url': page_data.YT_WATCH_URL_TEMPLATE.format('pL2vN8rQw3E'),
+     'thumbnail_link': thumbnail('pL2vN8rQw3E', '-oaymwEbCKgBEF5IVfKriqkDDggBFQAAiEIYAXABwAEG&rs=AOn4CLB336'),
+     'channel': 'Crumb Lab'},
+    {'video_url': page_data.YT_WATCH_URL_TEMPLATE.format('Zb91kTn0sYc'),
+     'thumbnail_link': thumbnail('Zb91kTn0sYc', '-oaymwEbCKgBEF5IVfKriqkDDggBFQAAiEIYAXABwAEG&rs=AOn4CLB336'),
+     'channel': 'Fixture Kitchen'},
+    {'video_url': page_data.YT_WATCH_URL_TEMPLATE.format('Qe5mW1hJd7A'),
+     'thumbnail_link': thumbnail('Qe5mW1hJd7A', '-oaymwEnCNACELwBSFryq4qpAxkIARUAAIhCGAHYAQHiAQoIGBACGAY4AUAB'),
+     'channel': None}
+  ]
+
+def test_parse_suggested_videos_without_suggestions():
+  assert page_data.parse_suggested_videos(initial_data('watch_page_no_suggestions.html')) == []
+  assert page_data.parse_suggested_videos(None) == []
+
+def test_parse_search_page():
+  # Ads, channels and shorts are left out, videos nested in shelves are kept
+  videos = page_data.parse_search_page(initial_data('search_page.html'))
+  assert [video['video_url'] for video in videos] == [
+    page_data.YT_WATCH_URL_TEMPLATE.format(video_id) for video_id in ('Xk4bC2pQmT8', 'pL2vN8rQw3E', 'Hn3dW7cVb0K')]
+  assert [video['channel'] for video in videos] == ['Fixture Kitchen', 'Crumb Lab', 'Oven Notes']
+  assert videos[0]['thumbnail_link'] == thumbnail(
+    'Xk4bC2pQmT8', '-oaymwEbCKgBEF5IVfKriqkDDggBFQAAiEIYAXABwAEG&rs=AOn4CLB720')
+
+def test_parse_channel_videos_page():
+  titles, upload_dates, view_counts = page_data.parse_channel_videos_page(initial_data('channel_videos_page.html'))
+  assert titles == ['Baguettes at Home', 'Sourdough in 10 Steps (No Mixer)',
+                    'Live: Answering Your Bread Questions', 'Croissant Day (Premiere)']
+  assert upload_dates == ['2 days ago', '2 years ago', 'Streamed 3 weeks ago', None]
+  assert view_counts == ['3,402 views', '1,234,567 views', '12,877 views', 'No views']
+
+def test_parse_channel_video_tiles_of_continuation():
+  data = json.loads(load_fixture('channel_videos_continuation.json'))
+  assert page_data.parse_channel_video_tiles(data) == [
+    {'video_id': 'Ol4dV1de0A1', 'title': 'Pain de Mie', 'upload_date': '3 years ago', 'view_count': '250,004 views'},
+    {'video_id': 'Ol4dV1de0B2', 'title': 'My First Loaf', 'upload_date': '4 years ago', 'view_count': '1.1M views'}
+  ]
+
+def test_find_continuation_token():
+  token = page_data.find_continuation_token(initial_data('channel_videos_page.html'))
+  assert token.startswith('4qmFsgKrCBIYVUNmeDdraXRjaGVu')
+  # The last batch of a list has no token
+  assert page_data.find_continuation_token(json.loads(load_fixture('channel_videos_continuation.json'))) is None
+  request = page_data.browse_continuation_request(token, '2.20231101.05.00')
+  assert request['continuation'] == token
+  assert request['context']['client']['clientVersion'] == '2.20231101.05.00'
+
+
+def test_html_scraper_scrape_vid_data():
+  scraping = pytest.importorskip('scraping')
+  scraper = scraping.HTMLYouTubeScraper(session=FakeSession([(WATCH_URL, load_fixture('watch_page.html'))]))
+  assert scraper._navigate(WATCH_URL)
+
+  video_data = scraper.scrape_vid_data()
+  assert video_data['view_count'] == 1234567
+  assert video_data['likes'] == 48213
+  assert video_data['subscriber_count'] == 1200000
+  assert video_data['video_title'] == 'Sourdough in 10 Steps (No Mixer)'
+  assert video_data['channel_link'] == CHANNEL_URL
+  assert video_data['video_url'] == WATCH_URL
+  assert len(scraper.collect_suggested_links()) == 3
+  assert scraper.n_pages == 1
+
+def test_html_scraper_forgets_page_after_failed_load():
+  scraping = pytest.importorskip('scraping')
+  session = FakeSession([(WATCH_URL, load_fixture('watch_page.html'))])
+  scraper = scraping.HTMLYouTubeScraper(session=session)
+  assert scraper._navigate(WATCH_URL)
+
+  session.statuses = [500]
+  with pytest.warns(UserWarning):
+    assert not scraper._navigate(page_data.YT_WATCH_URL_TEMPLATE.format('pL2vN8rQw3E'))
+  assert scraper.current_url is None
+  assert scraper.collect_suggested_links() == []
+  with pytest.warns(UserWarning):
+    assert scraper.scrape_vid_data() is None
+
+def test_html_scraper_missing_initial_data():
+  scraping = pytest.importorskip('scraping')
+  scraper = scraping.HTMLYouTubeScraper(session=FakeSession([(WATCH_URL, '<html></html>')]))
+  assert not scraper._navigate(WATCH_URL)
+  with pytest.warns(UserWarning):
+    assert scraper.scrape_vid_data() is None
+
+def test_html_scraper_follows_channel_continuations():
+  scraping = pytest.importorskip('scraping')
+  session = FakeSession([(CHANNEL_URL + '/videos', load_fixture('channel_videos_page.html'))],
+                            browse_pages=[load_fixture('channel_videos_continuation.json')])
+  scraper = scraping.HTMLYouTubeScraper(session=session)
+
+  batches = list(scraper._iter_channel_video_batches(CHANNEL_URL))
+  assert [len(batch) for batch in batches] == [4, 2]
+  assert batches[1][0]['video_id'] == 'Ol4dV1de0A1'
+  assert session.n_requests == 2
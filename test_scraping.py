@@ -0,0 +1,112 @@
+import os
+import threading
+
+import pytest
+
+from benchmarks import FakeSession
+from frontier import CrawlFrontier
+import page_data
+from scrape_metrics import ScrapeMetrics
+
+scraping = pytest.importorskip('scraping')
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SEARCH_URL = scraping.YT_SEARCH_URL_TEMPLATE.format('sourdough')
+
+
+def load_fixture(name):
+  with open(os.path.join(FIXTURE_DIR, name), 'r', encoding='utf-8') as f:
+    return f.read()
+
+class FailingWatchSession(FakeSession):
+  """Serves search pages, but every watch page request fails."""
+  def get(self, url, timeout=None):
+    if '/watch' in url:
+      self.statuses.append(500)
+    return super().get(url, timeout)
+
+def stop_after(n_checks):
+  checks = []
+  def stop_check():
+    checks.append(None)
+    return len(checks) >= n_checks
+  return stop_check
+
+def make_scraper(session):
+  metrics = ScrapeMetrics()
+  return scraping.HTMLYouTubeScraper(session=session, metrics=metrics), metrics
+
+
+def test_scrape_loop_searches_again_after_dead_ends():
+  # Every video of the search leads to a watch page without suggestions
+  session = FakeSession([(SEARCH_URL, load_fixture('search_page.html')),
+                         (SEARCH_URL, load_fixture('watch_page_no_suggestions.html'))])
+  scraper, metrics = make_scraper(session)
+
+  # One chain is a search check and MAX_DEAD_ENDS suggestion checks, stop in the second chain
+  scraper._scrape_loop('sourdough', stop_after(scraping.MAX_DEAD_ENDS + 3))
+
+  assert session.n_requests == 4
+  assert metrics.stats()['totals']['counters']['dead_ends'] == 1
+  # Each chain opened a different video of the search
+  assert len({row['video_url'] for row in scraper.flush_video_data()}) == 2
+
+def test_scrape_loop_returns_when_search_leads_nowhere():
+  session = FailingWatchSession([(SEARCH_URL, load_fixture('search_page.html'))])
+  scraper, metrics = make_scraper(session)
+
+  with pytest.warns(UserWarning):
+    scraper._scrape_loop('sourdough', stop_after(100))
+  assert session.n_requests == 2
+  assert metrics.stats()['totals']['counters']['dead_ends'] == 1
+  assert scraper.flush_video_data() == []
+
+def test_frontier_loop_skips_known_videos_and_requeues_failed_loads():
+  frontier = CrawlFrontier()
+  urls = [page_data.YT_WATCH_URL_TEMPLATE.format(video_id) for video_id in ('aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc')]
+  for url in urls:
+    frontier.push(url, thumbnail_link=url + '/thumb.jpg')
+  # The search and the first load of the first video fail
+  session = FakeSession([(SEARCH_URL, load_fixture('watch_page_no_suggestions.html'))], statuses=[500, 500])
+  scraper, metrics = make_scraper(session)
+  scraper._mark_scraped_video(urls[1])
+
+  with pytest.warns(UserWarning):
+    scraper._frontier_loop('sourdough', frontier, stop_after(5))
+
+  rows = scraper.flush_video_data()
+  assert [row['video_url'] for row in rows] == [urls[2], urls[0]]
+  assert [row['thumbnail_link'] for row in rows] == [urls[2] + '/thumb.jpg', urls[0] + '/thumb.jpg']
+  assert session.n_requests == 4
+  assert metrics.stats()['totals']['counters']['duplicates'] == 1
+
+def test_stop_scraping_does_not_wait_for_scraper_start():
+  manager = scraping.YTSManager(backend='html')
+  manager._video_flush_interval = 0.01
+  creating = threading.Event()
+  proceed = threading.Event()
+  scrapers = []
+  def new_scraper():
+    if not scrapers:
+      scrapers.append(None)
+      raise TimeoutError('No driver session became available')
+    # Stands in for a scraper waiting on the driver pool
+    creating.set()
+    proceed.wait()
+    scrapers.append(scraping.HTMLYouTubeScraper(session=FakeSession([(SEARCH_URL, '')])))
+    return scrapers[-1]
+  manager._new_scraper = new_scraper
+
+  manager.start_scrape_loops(['sourdough'])
+  assert creating.wait(5)
+  stopper = threading.Thread(target=manager.stop_scraping)
+  stopper.start()
+  stopper.join(1)
+  assert not stopper.is_alive()
+
+  # The scraper that was being created when scraping stopped is not started
+  proceed.set()
+  manager.checking_thread.join(5)
+  assert manager._threads == {}
+  assert manager._pending_start_terms == []
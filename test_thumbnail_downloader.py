@@ -0,0 +1,92 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+pytest.importorskip('requests')
+from thumbnail_downloader import LEGACY_MANIFEST_NAME, ThumbnailDownloader, load_manifest
+
+
+def jpeg_bytes(color):
+    f = io.BytesIO()
+    Image.new('RGB', (48, 36), color).save(f, format='JPEG')
+    return f.getvalue()
+
+def serve_thumbnails(stub_server, n):
+    urls = {}
+    for i in range(n):
+        stub_server.files[f'/vi/{i}/hq.jpg'] = jpeg_bytes((i * 40 % 256, 80, 160))
+        urls[i] = stub_server.url(f'/vi/{i}/hq.jpg')
+    return urls
+
+def make_downloader(tmp_path, **kwargs):
+    return ThumbnailDownloader(output_dir=str(tmp_path / 'thumbnails'), n_workers=4, backoff=0, **kwargs)
+
+
+def test_downloads_only_images_into_output_dir(stub_server, tmp_path):
+    downloader = make_downloader(tmp_path)
+    counts = downloader.download_all(serve_thumbnails(stub_server, 3), progress=False)
+
+    assert counts == {'done': 3}
+    assert sorted(os.listdir(tmp_path / 'thumbnails')) == ['0.jpg', '1.jpg', '2.jpg']
+    assert os.listdir(tmp_path / 'thumbnails.partial') == []
+    assert sorted(load_manifest(downloader.manifest_path)) == [0, 1, 2]
+
+def test_image_dataset_reads_downloaded_dir(stub_server, tmp_path):
+    data_handling = pytest.importorskip('data_handling')
+    make_downloader(tmp_path).download_all(serve_thumbnails(stub_server, 3), progress=False)
+
+    dataset = data_handling.ImageDataset(str(tmp_path / 'thumbnails'))
+    assert sorted(int(name.split('.')[0]) for name in dataset.img_names) == [0, 1, 2]
+    for i in range(len(dataset)):
+        _, img = dataset[i]
+        assert img.size == (48, 36)
+
+def test_moves_legacy_manifest_out_of_output_dir(stub_server, tmp_path):
+    urls = serve_thumbnails(stub_server, 2)
+    make_downloader(tmp_path).download_all(urls, progress=False)
+    output_dir = tmp_path / 'thumbnails'
+    os.replace(tmp_path / 'thumbnails_manifest.jsonl', output_dir / LEGACY_MANIFEST_NAME)
+
+    downloader = make_downloader(tmp_path)
+    assert not os.path.exists(output_dir / LEGACY_MANIFEST_NAME)
+    assert sorted(downloader.manifest) == [0, 1]
+
+def test_skips_manifested_files(stub_server, tmp_path):
+    urls = serve_thumbnails(stub_server, 3)
+    make_downloader(tmp_path).download_all(urls, progress=False)
+    n_requests = len(stub_server.requests)
+
+    counts = make_downloader(tmp_path).download_all(urls, progress=False)
+    assert counts == {'skipped': 3}
+    assert len(stub_server.requests) == n_requests
+
+def test_revalidate_keeps_unchanged_files(stub_server, tmp_path):
+    urls = serve_thumbnails(stub_server, 2)
+    make_downloader(tmp_path).download_all(urls, progress=False)
+
+    counts = make_downloader(tmp_path, revalidate=True).download_all(urls, progress=False)
+    assert counts == {'not_modified': 2}
+
+def test_retries_server_errors(stub_server, tmp_path):
+    urls = serve_thumbnails(stub_server, 1)
+    stub_server.failures['/vi/0/hq.jpg'] = [503, 500]
+
+    entry = make_downloader(tmp_path, retries=2).download(0, urls[0])
+    assert entry['status'] == 'done'
+    assert len(stub_server.requests) == 3
+    with open(tmp_path / 'thumbnails' / '0.jpg', 'rb') as f:
+        assert f.read() == stub_server.files['/vi/0/hq.jpg']
+
+def test_gives_up_without_leaving_partial_files(stub_server, tmp_path):
+    urls = serve_thumbnails(stub_server, 2)
+    stub_server.failures['/vi/0/hq.jpg'] = [503, 503, 503]
+    urls[2] = stub_server.url('/vi/missing/hq.jpg')
+
+    downloader = make_downloader(tmp_path, retries=2)
+    counts = downloader.download_all(urls, progress=False)
+    assert counts == {'done': 1, 'failed': 2}
+    assert os.listdir(tmp_path / 'thumbnails') == ['1.jpg']
+    assert os.listdir(tmp_path / 'thumbnails.partial') == []
+    assert downloader.manifest[0]['error'] == 'HTTP 503'
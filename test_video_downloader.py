@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+pytest.importorskip('requests')
+from video_downloader import (DONE, FAILED, PENDING, SKIPPED, HTTPRangeFetcher, JobManifest,
+                              VideoDownloadPipeline)
+
+
+STREAM = bytes(range(256)) * 40
+
+
+def range_headers(stub_server):
+    return [headers.get('Range') for _, headers in stub_server.requests]
+
+def write_part(path, data):
+    with open(path + '.part', 'wb') as f:
+        f.write(data)
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_fetch_in_chunks(stub_server, tmp_path):
+    stub_server.files['/stream'] = STREAM
+    path = str(tmp_path / '0.mp4')
+
+    n_bytes = HTTPRangeFetcher(chunk_bytes=4096).fetch(stub_server.url('/stream'), path, len(STREAM))
+    assert n_bytes == len(STREAM)
+    assert read(path) == STREAM
+    assert not os.path.exists(path + '.part')
+    assert range_headers(stub_server) == ['bytes=0-4095', 'bytes=4096-8191', 'bytes=8192-10239']
+
+def test_fetch_resumes_partial_file(stub_server, tmp_path):
+    stub_server.files['/stream'] = STREAM
+    path = str(tmp_path / '0.mp4')
+    write_part(path, STREAM[:6000])
+
+    HTTPRangeFetcher(chunk_bytes=4096).fetch(stub_server.url('/stream'), path, len(STREAM))
+    assert read(path) == STREAM
+    assert range_headers(stub_server) == ['bytes=6000-10095', 'bytes=10096-10239']
+
+def test_fetch_resumes_without_known_size(stub_server, tmp_path):
+    stub_server.files['/stream'] = STREAM
+    path = str(tmp_path / '0.mp4')
+    write_part(path, STREAM[:6000])
+
+    assert HTTPRangeFetcher(chunk_bytes=4096).fetch(stub_server.url('/stream'), path) == len(STREAM)
+    assert read(path) == STREAM
+
+def test_fetch_finishes_complete_partial_file(stub_server, tmp_path):
+    # A .part that already holds the whole stream is answered with 416
+    stub_server.files['/stream'] = STREAM
+    path = str(tmp_path / '0.mp4')
+    write_part(path, STREAM)
+
+    assert HTTPRangeFetcher(chunk_bytes=4096).fetch(stub_server.url('/stream'), path) == len(STREAM)
+    assert read(path) == STREAM
+
+def test_fetch_restarts_when_range_is_ignored(stub_server, tmp_path):
+    stub_server.files['/stream'] = STREAM
+    stub_server.honor_range = False
+    path = str(tmp_path / '0.mp4')
+    write_part(path, b'stale bytes')
+
+    HTTPRangeFetcher(chunk_bytes=4096).fetch(stub_server.url('/stream'), path, len(STREAM))
+    assert read(path) == STREAM
+    assert len(stub_server.requests) == 1
+
+def test_fetch_keeps_partial_file_on_error(stub_server, tmp_path):
+    stub_server.files['/stream'] = STREAM
+    stub_server.failures['/stream'] = [500]
+    path = str(tmp_path / '0.mp4')
+    write_part(path, STREAM[:6000])
+
+    with pytest.raises(Exception):
+        HTTPRangeFetcher(chunk_bytes=4096).fetch(stub_server.url('/stream'), path, len(STREAM))
+    assert not os.path.exists(path)
+    assert read(path + '.part') == STREAM[:6000]
+
+
+def test_manifest_state_survives_restart(tmp_path):
+    path = str(tmp_path / 'manifest.sqlite')
+    manifest = JobManifest(path)
+    manifest.add_jobs([(0, 'url0'), (1, 'url1'), (2, 'url2'), (3, 'url3')])
+    manifest.update(0, DONE, filesize=10)
+    manifest.update(1, SKIPPED, length=5000, error='too long')
+    manifest.update(2, FAILED, error='probe: unavailable')
+    manifest.close()
+
+    manifest = JobManifest(path)
+    # Jobs that are already known keep their state
+    manifest.add_jobs([(0, 'url0'), (4, 'url4')])
+    assert manifest.counts() == {DONE: 1, SKIPPED: 1, FAILED: 1, PENDING: 2}
+    assert manifest.get_jobs() == [(3, 'url3'), (4, 'url4')]
+    assert manifest.get_jobs(retry_failed=True) == [(2, 'url2'), (3, 'url3'), (4, 'url4')]
+    manifest.close()
+
+
+class StubProber():
+    def __init__(self, infos):
+        self.infos = infos
+        self.probed = []
+
+    def probe(self, url):
+        self.probed.append(url)
+        if isinstance(self.infos[url], Exception):
+            raise self.infos[url]
+        return self.infos[url]
+
+def test_pipeline_records_outcomes(stub_server, tmp_path):
+    stub_server.files['/stream'] = STREAM
+    stream_url = stub_server.url('/stream')
+    prober = StubProber({
+        'url0': {'length': 60, 'stream_url': stream_url, 'filesize': len(STREAM)},
+        'url1': {'length': 5000, 'stream_url': stream_url, 'filesize': len(STREAM)},
+        'url2': {'length': 60, 'stream_url': None, 'filesize': None},
+        'url3': IOError('unavailable')})
+    manifest = JobManifest(str(tmp_path / 'manifest.sqlite'))
+    manifest.add_jobs([(i, f'url{i}') for i in range(4)])
+    pipeline = VideoDownloadPipeline(manifest, output_dir=str(tmp_path / 'videos'), prober=prober,
+                                     fetcher=HTTPRangeFetcher(chunk_bytes=4096), max_length=1200)
+
+    assert pipeline.run(progress=False) == {DONE: 1, SKIPPED: 2, FAILED: 1}
+    assert os.listdir(tmp_path / 'videos') == ['0.mp4']
+    assert read(str(tmp_path / 'videos' / '0.mp4')) == STREAM
+
+    # A rerun probes nothing, a retry only probes the failed video
+    assert pipeline.run(progress=False) == {DONE: 1, SKIPPED: 2, FAILED: 1}
+    assert len(prober.probed) == 4
+    pipeline.run(retry_failed=True, progress=False)
+    assert prober.probed[4:] == ['url3']
+    manifest.close()
@@ -1,23 +1,219 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import os
-import requests
+import threading
+import time
+from urllib.parse import urlparse
+
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+from data_store import iter_table
+
+
+# Older runs kept their manifest inside the thumbnail directory, see `default_manifest_path`
+LEGACY_MANIFEST_NAME = 'manifest.jsonl'
+REQUEST_TIMEOUT_SECONDS = 15.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Downloads the thumbnails of scraped videos.')
+    parser.add_argument('-v', '--video_data_file', type=str, default='data/yt_video_data',
+                        help='CSV file or dataset directory of video data with a "thumbnail_link" column')
+    parser.add_argument('-o', '--output_dir', type=str, default='thumbnails',
+                        help='Directory to write thumbnails to')
+    parser.add_argument('-m', '--manifest', type=str, default=None,
+                        help='File recording every finished download, defaults to <output_dir>_manifest.jsonl')
+    parser.add_argument('-n', '--n_workers', type=int, default=32,
+                        help='Number of concurrent downloads')
+    parser.add_argument('--per_host_limit', type=int, default=16,
+                        help='Maximum number of concurrent downloads from a single host')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Number of times to retry a failed download')
+    parser.add_argument('--backoff', type=float, default=0.5,
+                        help='Base delay in seconds between retries, doubled on every attempt')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='Re-request existing thumbnails and only rewrite them if their ETag changed')
+    parser.set_defaults(revalidate=False)
+
+    return parser.parse_args()
+
+def default_manifest_path(output_dir):
+    """
+    Returns the manifest path next to `output_dir`. Only thumbnails may live in the
+    directory itself, as every file in it is read as an image named by its row number.
+    """
+    return os.path.normpath(output_dir) + '_manifest.jsonl'
+
+def load_manifest(path):
+    """Returns the latest manifest entry for each index."""
+    entries = {}
+    if not os.path.isfile(path):
+        return entries
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A crash can leave a partial last line behind
+                continue
+            entries[entry['index']] = entry
+    return entries
+
+class ThumbnailDownloader():
+    """
+    Downloads thumbnails concurrently over pooled keep-alive sessions. Every
+    finished index is appended to a manifest next to `output_dir` so that reruns
+    skip files that are already present. Downloads are written to a `.partial`
+    directory next to `output_dir` and moved in once complete.
+    """
+    def __init__(self, output_dir='thumbnails', n_workers=32, per_host_limit=16,
+                 retries=3, backoff=0.5, revalidate=False, timeout=REQUEST_TIMEOUT_SECONDS,
+                 manifest_path=None):
+        self.output_dir = output_dir
+        self.partial_dir = os.path.normpath(output_dir) + '.partial'
+        self.n_workers = n_workers
+        self.per_host_limit = per_host_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.revalidate = revalidate
+        self.timeout = timeout
+
+        self.manifest_path = manifest_path or default_manifest_path(output_dir)
+        legacy_path = os.path.join(output_dir, LEGACY_MANIFEST_NAME)
+        if os.path.isfile(legacy_path) and not os.path.isfile(self.manifest_path):
+            os.replace(legacy_path, self.manifest_path)
+        self.manifest = load_manifest(self.manifest_path)
+        self._manifest_lock = threading.Lock()
+
+        self._local = threading.local()
+        self._host_limits = {}
+        self._host_lock = threading.Lock()
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.per_host_limit)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return self._local.session
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_limits[host]
+
+    def _record(self, entry):
+        with self._manifest_lock:
+            self.manifest[entry['index']] = entry
+            with open(self.manifest_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def _fetch(self, url, headers):
+        """GETs `url`, retrying connection errors and retryable status codes with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                with self._host_limit(url):
+                    response = self._session().get(url, headers=headers, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                error = f'HTTP {response.status_code}'
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise IOError(error)
+
+    def download(self, index, url):
+        """Downloads a single thumbnail to `{output_dir}/{index}.jpg` and returns its manifest entry."""
+        index = int(index)
+        path = os.path.join(self.output_dir, f'{index}.jpg')
+        previous = self.manifest.get(index, {})
+        exists = os.path.isfile(path)
+
+        if exists and not self.revalidate:
+            entry = {'index': index, 'url': url, 'status': 'skipped',
+                     'bytes': os.path.getsize(path), 'etag': previous.get('etag')}
+            # Only files from before the manifest existed need a new entry
+            if not previous:
+                self._record(entry)
+            return entry
+
+        headers = {}
+        if exists and previous.get('etag') and previous.get('url') == url:
+            headers['If-None-Match'] = previous['etag']
+
+        try:
+            response = self._fetch(url, headers)
+        except IOError as e:
+            entry = {'index': index, 'url': url, 'status': 'failed', 'bytes': 0, 'error': str(e)}
+            self._record(entry)
+            return entry
+
+        if response.status_code == 304:
+            entry = {'index': index, 'url': url, 'status': 'not_modified',
+                     'bytes': os.path.getsize(path), 'etag': previous.get('etag')}
+        elif response.status_code != 200:
+            entry = {'index': index, 'url': url, 'status': 'failed', 'bytes': 0,
+                     'error': f'HTTP {response.status_code}'}
+        else:
+            # Write to a temporary file first so an interrupted run never leaves a truncated image
+            os.makedirs(self.output_dir, exist_ok=True)
+            os.makedirs(self.partial_dir, exist_ok=True)
+            tmp_path = os.path.join(self.partial_dir, f'{index}.jpg.part')
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, path)
+            entry = {'index': index, 'url': url, 'status': 'done',
+                     'bytes': len(response.content), 'etag': response.headers.get('ETag')}
+
+        self._record(entry)
+        return entry
+
+    def download_all(self, urls, progress=True):
+        """
+        Downloads every (index, url) pair in `urls`, a dict or an iterable of pairs.
+        Returns a dict counting the resulting statuses.
+        """
+        if isinstance(urls, dict):
+            urls = urls.items()
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest_dir = os.path.dirname(self.manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+
+        counts = {}
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = [executor.submit(self.download, index, url) for index, url in urls]
+            for future in tqdm(as_completed(futures), total=len(futures), disable=not progress):
+                status = future.result()['status']
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+
 if __name__ == '__main__':
-    # Load the list of YT URLs from the file, loading only the "thumbnail_link" column
-    url_list = pd.read_csv('./data/yt_video_data.csv', usecols=['thumbnail_link'])
-
-    # Create folder to store thumbnails
-    if not os.path.exists('thumbnails'):
-        os.makedirs('thumbnails')
-
-    # Download thumbnails from each link listed in `url_list` if not pd.nan
-    # And name them based on their index number
-    # Also use a progress bar to show progress
-    for index, url in tqdm(url_list.iterrows(), total=url_list.shape[0]):
-        if not pd.isnull(url['thumbnail_link']):
-            r = requests.get(url['thumbnail_link'])
-            with open(f'thumbnails/{index}.jpg', 'wb') as f:
-                f.write(r.content)
-    
-    print('Done!')
\ No newline at end of file
+    args = parse_args()
+
+    # Load the list of YT URLs from the file, keeping only the "thumbnail_link" column
+    url_list = pd.concat([chunk['thumbnail_link'] for chunk in iter_table(args.video_data_file, compact=True)],
+                         ignore_index=True)
+    url_list = url_list.dropna()
+
+    # Thumbnails are named based on their row number, the same one prepare_data.py uses
+    downloader = ThumbnailDownloader(
+        output_dir=args.output_dir,
+        manifest_path=args.manifest,
+        n_workers=args.n_workers,
+        per_host_limit=args.per_host_limit,
+        retries=args.retries,
+        backoff=args.backoff,
+        revalidate=args.revalidate)
+    counts = downloader.download_all(url_list.items())
+
+    print('Done!', counts)
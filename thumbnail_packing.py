@@ -0,0 +1,137 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from embedding_cache import HASH_BYTES
+
+
+IMAGE_SIZE = 224
+IMAGES_PER_SHARD = 20000
+SHARD_NAME_TEMPLATE = 'shard-{:05d}.npy'
+NAMES_FILE = 'names.npy'
+HASHES_FILE = 'hashes.npy'
+SHARDS_FILE = 'shards.npy'
+ROWS_FILE = 'rows.npy'
+META_FILE = 'meta.json'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Packs thumbnails into shards of pre-resized RGB arrays.')
+    parser.add_argument('-t', '--thumbnail_dir', type=str, default='thumbnails',
+                        help='Directory of thumbnails to pack')
+    parser.add_argument('-o', '--output_dir', type=str, default='data/packed_thumbnails',
+                        help='Directory to write the shards to, thumbnails already in it are skipped')
+    parser.add_argument('-n', '--n_workers', type=int, default=os.cpu_count(),
+                        help='Number of processes that decode thumbnails')
+    parser.add_argument('--images_per_shard', type=int, default=IMAGES_PER_SHARD,
+                        help='Number of thumbnails per shard file')
+
+    return parser.parse_args()
+
+def decode_thumbnail(path, size=IMAGE_SIZE):
+    """
+    Returns (content hash, uint8 array of shape (size, size, 3)) for an image file, or
+    (None, None) if it can't be decoded. JPEGs are decoded straight at a reduced scale
+    close to `size` (draft mode) instead of at full size, and every image is converted to
+    RGB so grayscale and CMYK thumbnails work.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.blake2b(data, digest_size=HASH_BYTES).hexdigest()
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.draft('RGB', (size, size))
+        img = img.convert('RGB').resize((size, size), Image.BILINEAR)
+    except (OSError, ValueError) as e:
+        print(f'Could not decode "{path}": {e}')
+        return None, None
+    return content_hash, np.asarray(img, dtype=np.uint8)
+
+def _save_index(output_dir, arrays, meta):
+    for file_name, array in arrays.items():
+        path = os.path.join(output_dir, file_name)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+    # The metadata is written last and names the shards that are complete
+    with open(os.path.join(output_dir, META_FILE + '.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(output_dir, META_FILE + '.tmp'), os.path.join(output_dir, META_FILE))
+
+def load_index(output_dir):
+    """Returns (meta, names, hashes, shards, rows) of a packed directory, empty if it has none yet."""
+    meta_path = os.path.join(output_dir, META_FILE)
+    if not os.path.isfile(meta_path):
+        empty = np.zeros(0, dtype=np.int32)
+        return {'image_size': IMAGE_SIZE, 'n_shards': 0, 'n_images': 0}, \
+            np.zeros(0, dtype=str), np.zeros(0, dtype=str), empty, empty
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    n = meta['n_images']
+    arrays = [np.load(os.path.join(output_dir, file_name))[:n]
+              for file_name in (NAMES_FILE, HASHES_FILE, SHARDS_FILE, ROWS_FILE)]
+    return (meta, *arrays)
+
+def pack_thumbnails(thumbnail_dir, output_dir, n_workers=None, images_per_shard=IMAGES_PER_SHARD,
+                    size=IMAGE_SIZE, progress=True):
+    """
+    Decodes every thumbnail in `thumbnail_dir` that is not packed yet and appends them to
+    `output_dir` as new shards. Returns the number of thumbnails that were added.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    meta, names, hashes, shards, rows = load_index(output_dir)
+    if meta['n_images'] > 0 and meta['image_size'] != size:
+        raise ValueError(f'{output_dir} holds {meta["image_size"]}px images, not {size}px.')
+
+    packed = set(names.tolist())
+    new_names = sorted(name for name in os.listdir(thumbnail_dir) if name.endswith('.jpg') and name not in packed)
+    if not new_names:
+        return 0
+
+    names, hashes, shards, rows = list(names), list(hashes), list(shards), list(rows)
+    n_added = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for start in tqdm(range(0, len(new_names), images_per_shard), desc='Shards', disable=not progress):
+            shard_names = new_names[start:start + images_per_shard]
+            shard_idx = meta['n_shards']
+            shard_path = os.path.join(output_dir, SHARD_NAME_TEMPLATE.format(shard_idx))
+            shard = np.lib.format.open_memmap(
+                shard_path + '.tmp', mode='w+', dtype=np.uint8, shape=(len(shard_names), size, size, 3))
+
+            n_rows = 0
+            paths = [os.path.join(thumbnail_dir, name) for name in shard_names]
+            for name, (content_hash, img) in zip(
+                    shard_names, executor.map(decode_thumbnail, paths, chunksize=64)):
+                if img is None:
+                    continue
+                shard[n_rows] = img
+                names.append(name)
+                hashes.append(content_hash)
+                shards.append(shard_idx)
+                rows.append(n_rows)
+                n_rows += 1
+            shard.flush()
+            del shard
+            os.replace(shard_path + '.tmp', shard_path)
+
+            n_added += n_rows
+            meta = {'image_size': size, 'n_shards': shard_idx + 1, 'n_images': len(names)}
+            _save_index(output_dir, {
+                NAMES_FILE: np.array(names, dtype=str),
+                HASHES_FILE: np.array(hashes, dtype=str),
+                SHARDS_FILE: np.array(shards, dtype=np.int32),
+                ROWS_FILE: np.array(rows, dtype=np.int32)
+            }, meta)
+    return n_added
+
+if __name__ == '__main__':
+    args = parse_args()
+    n_added = pack_thumbnails(args.thumbnail_dir, args.output_dir, args.n_workers, args.images_per_shard)
+    print(f'Packed {n_added} new thumbnails')
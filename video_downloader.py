@@ -1,43 +1,254 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import requests
+import sqlite3
+import threading
+import time
+
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-import pytube
 
-if __name__ == '__main__':
-    # Load the list of YT URLs from the file, loading only the "video_url" column
-    url_list = pd.read_csv('./data/yt_video_data.csv', usecols=['video_url'])
-
-    # Create folder to store videos
-    if not os.path.exists('./videos'):
-        os.makedirs('./videos')
-
-    # Download video from each link listed in `url_list`
-    # if not pd.nan by using pytube
-    # And name them based on their index number
-    # Also use a progress bar to show progress
-    for i, url in tqdm(url_list.iterrows(), total=url_list.shape[0]):
-        if os.path.exists('./videos/{}.mp4'.format(i)):
-            continue
+from data_store import iter_table
+
+
+MAX_VIDEO_SECONDS = 1200
+CHUNK_BYTES = 1024 * 1024
+REQUEST_TIMEOUT_SECONDS = 30.0
+
+PENDING = 'pending'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+DONE = 'done'
+FINAL_STATES = (SKIPPED, FAILED, DONE)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Downloads the videos of scraped video data.')
+    parser.add_argument('-v', '--video_data_file', type=str, default='data/yt_video_data',
+                        help='CSV file or dataset directory of video data with a "video_url" column')
+    parser.add_argument('-o', '--output_dir', type=str, default='videos',
+                        help='Directory to write videos to')
+    parser.add_argument('-m', '--manifest', type=str, default='videos/manifest.sqlite',
+                        help='SQLite file that records the state of every download')
+    parser.add_argument('-np', '--n_probe_workers', type=int, default=8,
+                        help='Number of concurrent metadata probes')
+    parser.add_argument('-nd', '--n_download_workers', type=int, default=4,
+                        help='Number of concurrent stream downloads')
+    parser.add_argument('--max_length', type=int, default=MAX_VIDEO_SECONDS,
+                        help='Skip videos longer than this many seconds')
+    parser.add_argument('--resolution', type=str, default='240p',
+                        help='Resolution of the stream to download')
+    parser.add_argument('--retry_failed', action='store_true',
+                        help='Probe and download videos that failed in a previous run again')
+    parser.set_defaults(retry_failed=False)
+
+    return parser.parse_args()
+
+class JobManifest():
+    """Durable record of the state of every video download, stored in SQLite."""
+    def __init__(self, path):
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'idx INTEGER PRIMARY KEY, url TEXT NOT NULL, state TEXT NOT NULL, '
+                'length INTEGER, filesize INTEGER, error TEXT, updated REAL)')
+
+    def add_jobs(self, jobs):
+        """Adds (index, url) pairs that are not in the manifest yet as pending jobs."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO jobs (idx, url, state, updated) VALUES (?, ?, ?, ?)',
+                [(int(i), url, PENDING, time.time()) for i, url in jobs])
+
+    def get_jobs(self, retry_failed=False):
+        """Returns the (index, url) pairs that still need to be processed."""
+        states = (SKIPPED, DONE) if retry_failed else FINAL_STATES
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT idx, url FROM jobs WHERE state NOT IN ({}) ORDER BY idx'.format(
+                    ', '.join('?' * len(states))), states).fetchall()
+        return rows
+
+    def update(self, index, state, **fields):
+        fields['state'] = state
+        fields['updated'] = time.time()
+        columns = ', '.join(f'{k} = ?' for k in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f'UPDATE jobs SET {columns} WHERE idx = ?', (*fields.values(), int(index)))
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+    def close(self):
+        self._conn.close()
+
+class PytubeProber():
+    """
+    Looks up the length and stream URL of a video with pytube. pytube is only
+    imported here, so the manifest, fetcher and pipeline work without it.
+    """
+    def __init__(self, resolution='240p'):
+        self.resolution = resolution
+
+    def probe(self, url):
+        """Returns a dict with the `length` in seconds, `stream_url` and `filesize` of a video."""
+        import pytube
+
+        yt = pytube.YouTube(url)
+        length = yt.length
+        stream = yt.streams.filter(res=self.resolution).first()
+        if stream is None:
+            return {'length': length, 'stream_url': None, 'filesize': None}
+        return {'length': length, 'stream_url': stream.url, 'filesize': stream.filesize}
+
+class HTTPRangeFetcher():
+    """Downloads a URL in chunks with HTTP range requests, resuming from a partial file."""
+    def __init__(self, chunk_bytes=CHUNK_BYTES, timeout=REQUEST_TIMEOUT_SECONDS):
+        self.chunk_bytes = chunk_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return self._local.session
+
+    def fetch(self, url, path, filesize=None):
+        """Downloads `url` to `path` through `path + '.part'` and returns the number of bytes written."""
+        part_path = path + '.part'
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+
+        while filesize is None or offset < filesize:
+            end = offset + self.chunk_bytes - 1
+            if filesize is not None:
+                end = min(end, filesize - 1)
+            response = self._session().get(
+                url, headers={'Range': f'bytes={offset}-{end}'}, timeout=self.timeout)
+            if response.status_code == 416:
+                # The partial file already covers the whole stream
+                break
+            response.raise_for_status()
+            if response.status_code == 200 and offset > 0:
+                # The server ignored the range, so start over
+                offset = 0
+            with open(part_path, 'r+b' if offset > 0 else 'wb') as f:
+                f.seek(offset)
+                f.write(response.content)
+            offset += len(response.content)
+            if response.status_code == 200 or len(response.content) < self.chunk_bytes:
+                break
+
+        if filesize is not None and offset != filesize:
+            raise IOError(f'Downloaded {offset} bytes, expected {filesize}')
+        os.replace(part_path, path)
+        return offset
+
+class VideoDownloadPipeline():
+    """
+    Probes video metadata and downloads streams on two concurrent worker pools.
+    Every outcome is written to a `JobManifest`, so reruns never re-probe videos
+    that were already skipped, failed or finished. `prober` and `fetcher` are the
+    network layer and can be replaced, e.g. by stubs pointing at a local server.
+    """
+    def __init__(self, manifest, output_dir='videos', prober=None, fetcher=None,
+                 n_probe_workers=8, n_download_workers=4, max_length=MAX_VIDEO_SECONDS):
+        self.manifest = manifest
+        self.output_dir = output_dir
+        self.prober = prober or PytubeProber()
+        self.fetcher = fetcher or HTTPRangeFetcher()
+        self.n_probe_workers = n_probe_workers
+        self.n_download_workers = n_download_workers
+        self.max_length = max_length
+
+    def _video_path(self, index):
+        return os.path.join(self.output_dir, f'{index}.mp4')
+
+    def _probe(self, index, url, download_executor):
+        # Videos downloaded before the manifest existed are kept as they are
+        if os.path.isfile(self._video_path(index)):
+            self.manifest.update(index, DONE, filesize=os.path.getsize(self._video_path(index)))
+            return None
+
         try:
-            yt = pytube.YouTube(url.video_url)
+            info = self.prober.probe(url)
+        except Exception as e:
+            self.manifest.update(index, FAILED, error=f'probe: {e}')
+            return None
 
-            # Skip if the video is longer than 20 minutes
-            print(yt.length)
-            if yt.length > 1200:
-                continue
+        if info['length'] is not None and info['length'] > self.max_length:
+            self.manifest.update(index, SKIPPED, length=info['length'], error='too long')
+            return None
+        if info['stream_url'] is None:
+            self.manifest.update(index, SKIPPED, length=info['length'], error='no matching stream')
+            return None
 
-            # Get the video in 240p
-            video = yt.streams.filter(res='240p').first()
-            video.download('./videos')
+        self.manifest.update(index, PENDING, length=info['length'], filesize=info['filesize'])
+        return download_executor.submit(self._download, index, info)
 
-            # Rename the file to the index number
-            os.rename('./videos/{}'.format(video.default_filename), './videos/{}.mp4'.format(i))
+    def _download(self, index, info):
+        try:
+            n_bytes = self.fetcher.fetch(info['stream_url'], self._video_path(index), info['filesize'])
         except Exception as e:
-            if isinstance(e, KeyboardInterrupt):
-                raise e
-            print('Error: {}'.format(url.video_url))
-            print(e)
-            print()
-        
-    print('Done!')
\ No newline at end of file
+            self.manifest.update(index, FAILED, error=f'download: {e}')
+            return FAILED
+        self.manifest.update(index, DONE, filesize=n_bytes, error=None)
+        return DONE
+
+    def run(self, retry_failed=False, progress=True):
+        os.makedirs(self.output_dir, exist_ok=True)
+        jobs = self.manifest.get_jobs(retry_failed=retry_failed)
+
+        download_futures = []
+        with ThreadPoolExecutor(max_workers=self.n_download_workers) as download_executor, \
+             ThreadPoolExecutor(max_workers=self.n_probe_workers) as probe_executor:
+            probe_futures = [
+                probe_executor.submit(self._probe, index, url, download_executor)
+                for index, url in jobs]
+            for future in tqdm(as_completed(probe_futures), total=len(probe_futures),
+                               desc='Probing', disable=not progress):
+                if future.result() is not None:
+                    download_futures.append(future.result())
+            for future in tqdm(as_completed(download_futures), total=len(download_futures),
+                               desc='Downloading', disable=not progress):
+                future.result()
+
+        return self.manifest.counts()
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Load the list of YT URLs from the file, keeping only the "video_url" column
+    url_list = pd.concat([chunk['video_url'] for chunk in iter_table(args.video_data_file, compact=True)],
+                         ignore_index=True)
+    url_list = url_list.dropna()
+
+    # Videos are named based on their row number, the same one prepare_data.py uses
+    manifest = JobManifest(args.manifest)
+    manifest.add_jobs(url_list.items())
+
+    pipeline = VideoDownloadPipeline(
+        manifest,
+        output_dir=args.output_dir,
+        prober=PytubeProber(resolution=args.resolution),
+        n_probe_workers=args.n_probe_workers,
+        n_download_workers=args.n_download_workers,
+        max_length=args.max_length)
+    try:
+        counts = pipeline.run(retry_failed=args.retry_failed)
+    finally:
+        manifest.close()
+
+    print('Done!', counts)